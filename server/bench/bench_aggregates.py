@@ -0,0 +1,69 @@
+"""
+Analytics latency: aggregate.ticker_summary / aggregate.top_tickers over the aggregate tables, against the same figures
+computed from the transactions table (what a client does after downloading the rows), on a seeded database.
+  python -m bench.bench_aggregates --db /tmp/load.db --rows 500000
+"""
+import argparse, json, os, statistics, tempfile, time
+from bench import common
+
+def measure(name: str, func, repeat: int) -> dict:
+  samples = []
+  for _ in range(repeat):
+    start = time.perf_counter()
+    func()
+    samples.append(time.perf_counter() - start)
+  samples.sort()
+  return {"query": name, "ms_mean": round(statistics.fmean(samples) * 1000, 2), "ms_p50": round(samples[len(samples) // 2] * 1000, 2), "ms_max": round(samples[-1] * 1000, 2)}
+
+def main():
+  arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  arg_parser.add_argument("--rows", type=int, default=500000)
+  arg_parser.add_argument("--db", default=None, help="database file, a temporary one by default (reused when it already has rows)")
+  arg_parser.add_argument("--repeat", type=int, default=20)
+  args = arg_parser.parse_args()
+
+  tmp = tempfile.TemporaryDirectory() if not args.db else None
+  path = os.path.abspath(args.db or os.path.join(tmp.name, "bench.db"))
+  os.environ["SQLALCHEMY_DATABASE_URL"] = f"sqlite:///{path}"
+  from sqlalchemy import func, inspect, select
+  from db import engine, SessionLocal, Base
+  from models import transaction as model
+  from services import aggregate
+  import migrations
+
+  if not inspect(engine).has_table("transactions"):
+    common.seed_transactions(engine, args.rows)
+  Base.metadata.create_all(bind=engine)
+  migrations.upgrade(engine)
+  db = SessionLocal()
+  t = model.Transaction.__table__
+  ticker = db.scalar(select(t.c.ticker).group_by(t.c.ticker).order_by(func.count().desc()).limit(1))
+  last = db.scalar(select(func.max(t.c.trade_date)))
+  results = []
+
+  def raw_summary():
+    rows = db.execute(select(t.c.trade_type, t.c.insider_name, t.c.trade_date, t.c.qty, t.c.value).where(t.c.ticker == ticker)).all()
+    by_type, insiders = {}, set()
+    for trade_type, insider_name, trade_date, qty, value in rows:
+      stats = by_type.setdefault(trade_type, [0, 0, 0.0, set()])
+      stats[0] += 1; stats[1] += qty or 0; stats[2] += float(value or 0); stats[3].add(insider_name)
+      insiders.add(insider_name)
+  results.append(measure(f"summary {ticker}: transactions rows", raw_summary, args.repeat))
+  results.append(measure(f"summary {ticker}: aggregates", lambda: aggregate.ticker_summary(db, ticker), args.repeat))
+
+  for window in ("30d", "1y"):
+    from_date, to_date = aggregate.window_range(window, last)
+    def raw_top():
+      gross = func.sum(func.abs(t.c.value))
+      db.execute(select(t.c.ticker, gross).where(t.c.trade_date.between(from_date, to_date)).group_by(t.c.ticker).order_by(gross.desc()).limit(20)).all()
+    results.append(measure(f"top by value {window}: transactions GROUP BY", raw_top, args.repeat))
+    results.append(measure(f"top by value {window}: aggregates", lambda: aggregate.top_tickers(db, "value", from_date, to_date), args.repeat))
+    results.append(measure(f"top by insiders {window}: aggregates", lambda: aggregate.top_tickers(db, "insiders", from_date, to_date, "P - Purchase"), args.repeat))
+  db.close()
+  engine.dispose()
+  if tmp:
+    tmp.cleanup()
+  print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,72 @@
+"""
+Authentication overhead per request: routers.auth.get_current_client with the principal cache off (JWT verification,
+TokenData and a client lookup every time) and on (in-process tier; with --redis, also the Redis tier alone).
+  python -m bench.bench_auth --requests 5000 --clients 100 --redis
+"""
+import argparse, asyncio, json, os, statistics, tempfile, time
+from bench import common
+
+async def measure(name: str, call, requests: int, tokens: list[str]) -> dict:
+  samples = []
+  for i in range(requests):
+    start = time.perf_counter()
+    await call(tokens[i % len(tokens)])
+    samples.append(time.perf_counter() - start)
+  samples.sort()
+  return {
+    "auth": name,
+    "requests": requests,
+    "us_mean": round(statistics.fmean(samples) * 1e6, 2),
+    "us_p50": round(samples[len(samples) // 2] * 1e6, 2),
+    "us_p99": round(samples[int(len(samples) * 0.99)] * 1e6, 2),
+  }
+
+async def run(args) -> list[dict]:
+  from fastapi.security import SecurityScopes
+  import settings
+  from db import Base, engine, async_engine, AsyncSessionLocal
+  from models import client as model
+  from routers.auth import get_current_client
+  from services import auth as auth_mgr, principal
+
+  Base.metadata.create_all(bind=engine)
+  client_ids = [f"bench-client-{i}" for i in range(args.clients)]
+  async with AsyncSessionLocal() as db:
+    for client_id in client_ids:
+      await db.merge(model.Client(id=client_id, hashed_secret="", is_active=True, role="client"))
+    await db.commit()
+  tokens = [auth_mgr.create_access_token(data={"sub": client_id}, scopes=["read"]) for client_id in client_ids]
+  scopes = SecurityScopes(scopes=["read"])
+
+  results = []
+  async with AsyncSessionLocal() as db:
+    call = lambda token: get_current_client(scopes, token, db)
+    settings.AUTH_CACHE_ENABLED = False
+    results.append(await measure("no cache: decode + client lookup", call, args.requests, tokens))
+    settings.AUTH_CACHE_ENABLED = True
+    for token in tokens: # first request of each token
+      await call(token)
+    results.append(await measure("principal cache: in-process", call, args.requests, tokens))
+    if args.redis:
+      async def redis_tier(token):
+        principal.lru.clear()
+        await call(token)
+      results.append(await measure("principal cache: Redis", redis_tier, args.requests, tokens))
+  await async_engine.dispose()
+  return results
+
+def main():
+  arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  arg_parser.add_argument("--requests", type=int, default=5000)
+  arg_parser.add_argument("--clients", type=int, default=100, help="distinct clients (and tokens) the requests are spread over")
+  arg_parser.add_argument("--redis", action="store_true", help="also measure the Redis tier (REDIS_URL/REDIS_PORT must point to a server)")
+  args = arg_parser.parse_args()
+
+  tmp = tempfile.TemporaryDirectory()
+  os.environ["SQLALCHEMY_DATABASE_URL"] = f"sqlite:///{os.path.join(tmp.name, 'bench.db')}"
+  results = asyncio.run(run(args))
+  tmp.cleanup()
+  print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+  main()
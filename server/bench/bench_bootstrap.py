@@ -0,0 +1,72 @@
+"""
+End-to-end bootstrap (fetch, parse, import) against the local stub server and a scratch SQLite database.
+  python -m bench.bench_bootstrap --start-year 2013 --rows 500 --latency 0.2 --concurrency 3
+With a per-request latency L and C concurrent fetches, the wall-clock should approach months * L / C.
+Compare the direct ingestion with the CSV round-trip (and the archive formats):
+  python -m bench.bench_bootstrap --ingest-modes direct csv --archive off
+--daily-syncs N then runs N daily syncs on the bootstrapped database: the first one loads today's filings, the next
+ones fetch the same page and find it unchanged (ingestion ledger), the steady state of the scheduled job.
+  python -m bench.bench_bootstrap --start-year 2024 --daily-syncs 5 --output results/bootstrap.json
+"""
+import argparse, os, tempfile
+from datetime import date
+from bench import common
+from bench.stub_server import StubScreenerServer
+
+def main():
+  arg_parser = argparse.ArgumentParser(description=__doc__)
+  arg_parser.add_argument("--start-year", type=int, default=2013)
+  arg_parser.add_argument("--rows", type=int, default=500, help="rows per synthesized month page")
+  arg_parser.add_argument("--latency", type=float, default=0.2, help="stub server latency in seconds")
+  arg_parser.add_argument("--fail-rate", type=float, default=0.0)
+  arg_parser.add_argument("--concurrency", type=int, default=int(os.environ["MAX_WORKERS"]))
+  arg_parser.add_argument("--ingest-modes", nargs="+", default=["direct"], choices=["direct", "csv"])
+  arg_parser.add_argument("--archive", default=None, choices=["gzip", "csv", "off"], help="CSV archive format, defaults to settings.CSV_ARCHIVE")
+  arg_parser.add_argument("--daily-syncs", type=int, default=0, help="daily syncs run after the (last) bootstrap")
+  arg_parser.add_argument("--output", default=None, help="JSON file of the results, stdout by default")
+  args = arg_parser.parse_args()
+
+  with tempfile.TemporaryDirectory() as tmp:
+    os.environ["SQLALCHEMY_DATABASE_URL"] = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+    os.environ["OUTPUT_DIR"] = tmp # the archive, export and metrics directories are under it
+    import settings
+    settings.FETCH_CONCURRENCY = args.concurrency
+    settings.FETCH_RPS = 0
+    settings.FETCH_BACKOFF_BASE = 0.05
+    if args.archive:
+      settings.CSV_ARCHIVE = args.archive
+    server = StubScreenerServer(rows=args.rows, latency=args.latency, fail_rate=args.fail_rate)
+    server.start_in_thread()
+    settings.BASE_URL = server.url
+
+    from db import engine, Base, SessionLocal
+    from models import transaction as model
+    from services import transaction as transact_mgr
+    Base.metadata.create_all(bind=engine)
+    results, daily_syncs = {}, []
+    try:
+      for mode in args.ingest_modes:
+        db = SessionLocal()
+        try:
+          db.query(model.TransactionFact).delete()
+          db.commit()
+          report = transact_mgr.extract_data(db, args.start_year, False, ingest_mode=mode)
+        finally:
+          db.close()
+        summary = report.summary()
+        summary["network_bound_seconds"] = round(len(report.months) * args.latency / args.concurrency, 3)
+        results[mode] = summary
+      for _ in range(args.daily_syncs):
+        with SessionLocal() as db:
+          report = transact_mgr.extract_data(db, date.today().year, True, ingest_mode=args.ingest_modes[-1])
+        summary = report.summary()
+        daily_syncs.append({key: summary[key] for key in ("statuses", "rows", "seconds")})
+    finally:
+      server.shutdown()
+  output = {"archive": settings.CSV_ARCHIVE, "modes": results}
+  if daily_syncs:
+    output["daily_syncs"] = daily_syncs
+  common.write_results(output, args.output)
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,76 @@
+"""
+Full 2013-today bootstrap fetch against the local stub server:
+one requests.get per month on a thread pool (baseline) vs the pooled AsyncFetcher.
+  python -m bench.bench_fetcher --rows 200 --latency 0.05 --fail-rate 0.02 --rps 0
+"""
+import argparse, asyncio, json, os, tempfile, time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from bench import common
+from bench.stub_server import StubScreenerServer
+
+def bootstrap_months(start_year: int = 2013):
+  today = date.today()
+  for year in range(start_year, today.year + 1):
+    for month in range(3 if year == 2013 else 1, (today.month if year == today.year else 12) + 1):
+      first = date(year, month, 1)
+      last = (first + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+      yield first.strftime('%m/%d/%Y'), last.strftime('%m/%d/%Y')
+
+def run_baseline(months, workers: int) -> dict:
+  from services import transaction as transact_mgr
+  start = time.perf_counter()
+  errors = missing = 0
+  with ThreadPoolExecutor(max_workers=workers) as executor:
+    futures = [executor.submit(transact_mgr.scrape_data_by_date_range, s, e) for s, e in months]
+    for future in futures:
+      try:
+        if future.result() is None: # an error page is indistinguishable from an empty month here
+          missing += 1
+      except Exception:
+        errors += 1
+  return {"seconds": time.perf_counter() - start, "errors": errors, "missing_months": missing}
+
+async def run_async(months, concurrency: int, rps: float, max_retries: int) -> dict:
+  from services import transaction as transact_mgr
+  from services.utils.fetcher import AsyncFetcher
+  start = time.perf_counter()
+  async with AsyncFetcher(concurrency=concurrency, rps=rps, max_retries=max_retries, backoff_base=0.05) as fetcher:
+    results = await asyncio.gather(*(transact_mgr.scrape_data_by_date_range_async(fetcher, s, e) for s, e in months), return_exceptions=True)
+  return {
+    "seconds": time.perf_counter() - start,
+    "errors": sum(isinstance(r, Exception) for r in results),
+    "latency": fetcher.stats.summary(),
+  }
+
+def main():
+  arg_parser = argparse.ArgumentParser(description=__doc__)
+  arg_parser.add_argument("--rows", type=int, default=200, help="rows per synthesized month page")
+  arg_parser.add_argument("--latency", type=float, default=0.05, help="stub server latency in seconds")
+  arg_parser.add_argument("--fail-rate", type=float, default=0.0, help="fraction of 503 responses")
+  arg_parser.add_argument("--concurrency", type=int, default=int(os.environ["MAX_WORKERS"]))
+  arg_parser.add_argument("--rps", type=float, default=0, help="requests per second budget for the async fetcher, 0 = unlimited")
+  arg_parser.add_argument("--max-retries", type=int, default=4)
+  args = arg_parser.parse_args()
+
+  with tempfile.TemporaryDirectory() as out_dir:
+    import settings
+    settings.OUTPUT_DIR = out_dir
+    server = StubScreenerServer(rows=args.rows, latency=args.latency, fail_rate=args.fail_rate)
+    server.start_in_thread()
+    settings.BASE_URL = server.url
+    months = list(bootstrap_months())
+    try:
+      baseline = run_baseline(months, args.concurrency)
+      pooled = asyncio.run(run_async(months, args.concurrency, args.rps, args.max_retries))
+    finally:
+      server.shutdown()
+  print(json.dumps({
+    "months": len(months),
+    "stub": {"rows": args.rows, "latency": args.latency, "fail_rate": args.fail_rate},
+    "baseline_threadpool_requests": baseline,
+    "async_fetcher": pooled,
+  }, indent=2))
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,87 @@
+"""
+Load N synthetic normalized rows into a scratch SQLite database:
+one ORM object per row + bulk_save_objects (previous import_file_db) vs the chunked Core executemany loader.
+Reports rows/sec, and with --memory the Python heap peak (tracemalloc, in a second slower pass) of each loader.
+--refresh compares the two ways of reloading the whole table: upserts into the indexed table, and a load into the
+index-less shadow table followed by the swap (deduplication and index build included, see transaction.refresh_data).
+  python -m bench.bench_loader --rows 200000 --batch-sizes 1000 5000 20000 --memory
+  python -m bench.bench_loader --rows 1000000 --batch-sizes 5000 --skip-orm --refresh
+"""
+import argparse, json, os, tempfile, time, tracemalloc
+from bench import common
+
+def run(name, func, engine, table, memory: bool):
+  def reset():
+    with engine.begin() as conn:
+      conn.execute(table.delete())
+  reset()
+  start = time.perf_counter()
+  rows = func()
+  seconds = time.perf_counter() - start
+  result = {"loader": name, "rows": rows, "seconds": round(seconds, 3), "rows_per_sec": round(rows / seconds)}
+  if memory:
+    reset()
+    tracemalloc.start()
+    func()
+    result["heap_peak_mb"] = round(tracemalloc.get_traced_memory()[1] / 1024 / 1024, 1)
+    tracemalloc.stop()
+  return result
+
+def main():
+  arg_parser = argparse.ArgumentParser(description=__doc__)
+  arg_parser.add_argument("--rows", type=int, default=200000)
+  arg_parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1000, 5000, 20000])
+  arg_parser.add_argument("--memory", action="store_true", help="also measure the heap peak")
+  arg_parser.add_argument("--skip-orm", action="store_true", help="skip the (slow) ORM baseline")
+  arg_parser.add_argument("--refresh", action="store_true", help="also compare the indexed upserts with the shadow table swap")
+  args = arg_parser.parse_args()
+
+  with tempfile.TemporaryDirectory() as tmp:
+    os.environ["SQLALCHEMY_DATABASE_URL"] = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+    from db import engine, Base, SessionLocal
+    from models import transaction as model
+    from services.utils import loader
+    import migrations
+    Base.metadata.create_all(bind=engine)
+    table = model.TransactionFact.__table__
+    results = []
+
+    if not args.skip_orm:
+      def orm_load():
+        db = SessionLocal()
+        try:
+          dimensions = loader.Dimensions(db.connection())
+          objects = [model.TransactionFact(**params) for params in dimensions.encode(list(common.synthetic_rows(args.rows)))]
+          db.bulk_save_objects(objects)
+          db.commit()
+          return len(objects)
+        finally:
+          db.close()
+      results.append(run("orm_bulk_save_objects", orm_load, engine, table, args.memory))
+
+    for batch_size in args.batch_sizes:
+      def core_load():
+        return loader.bulk_insert(engine, table, common.synthetic_rows(args.rows), batch_size).rows
+      results.append(run(f"core_executemany_batch_{batch_size}", core_load, engine, table, args.memory))
+
+    if args.refresh:
+      batch_size = args.batch_sizes[0]
+      def indexed_upsert():
+        return loader.bulk_insert(engine, table, common.synthetic_rows(args.rows), batch_size, conflict_keys=model.NATURAL_KEY).rows
+      results.append(run("refresh_indexed_upsert", indexed_upsert, engine, table, False))
+      shadow = loader.shadow_table(table)
+      def shadow_swap():
+        loader.reset_shadow(engine, shadow)
+        started = time.perf_counter()
+        rows = loader.bulk_insert(engine, shadow, common.synthetic_rows(args.rows), batch_size).rows
+        load_seconds = time.perf_counter() - started
+        with engine.begin() as conn:
+          migrations.dedupe_transactions(conn, shadow.name)
+          loader.swap_in(conn, shadow, table)
+        print(f"shadow load {load_seconds:.2f}s, swap {time.perf_counter() - started - load_seconds:.2f}s")
+        return rows
+      results.append(run("refresh_shadow_swap", shadow_swap, engine, table, False))
+  print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+  main()
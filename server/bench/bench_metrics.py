@@ -0,0 +1,56 @@
+"""
+Cost of the instrumentation on the hot path: a counter increment, a histogram observation, RequestMetricsMiddleware
+around an ASGI app which answers at once (so the difference is the middleware alone), and one GET /metrics render.
+  python -m bench.bench_metrics --calls 200000 --requests 20000
+"""
+import argparse, asyncio, json, time
+
+def per_call(name: str, calls: int, run) -> dict:
+  start = time.perf_counter()
+  run(calls)
+  seconds = time.perf_counter() - start
+  return {"op": name, "calls": calls, "us_per_call": round(seconds / calls * 1e6, 3)}
+
+def main():
+  arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  arg_parser.add_argument("--calls", type=int, default=200000)
+  arg_parser.add_argument("--requests", type=int, default=20000)
+  args = arg_parser.parse_args()
+  from services import metrics
+  from routers.metrics import RequestMetricsMiddleware
+
+  registry = metrics.Registry()
+  counter = metrics.Counter("bench_total", "bench", ["route"], registry=registry)
+  histogram = metrics.Histogram("bench_seconds", "bench", ["route"], registry=registry)
+  def inc(calls):
+    for _ in range(calls):
+      counter.labels("/insider_trades/{ticker_id}").inc()
+  def observe(calls):
+    for i in range(calls):
+      histogram.labels("/insider_trades/{ticker_id}").observe(i * 1e-6)
+
+  async def app(scope, receive, send):
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b"{}"})
+  async def send(message):
+    pass
+  def requests(wrapped):
+    def run(calls):
+      scope = {"type": "http", "method": "GET", "path": "/insider_trades/AAPL"}
+      async def loop():
+        for _ in range(calls):
+          await wrapped(scope, None, send)
+      asyncio.run(loop())
+    return run
+
+  results = [
+    per_call("counter inc", args.calls, inc),
+    per_call("histogram observe", args.calls, observe),
+    per_call("request, no middleware", args.requests, requests(app)),
+    per_call("request, RequestMetricsMiddleware", args.requests, requests(RequestMetricsMiddleware(app))),
+    per_call("render /metrics", 100, lambda calls: [metrics.render() for _ in range(calls)]),
+  ]
+  print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+  main()
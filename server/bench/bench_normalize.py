@@ -0,0 +1,59 @@
+"""
+Cost of the normalize stage per million rows, on synthetic scraped rows (cell texts as on the screener: "$1,234.50",
+"+1,000", "+5%", "New", ">999%"): normalize_row on every row vs the columnar batch normalizer (services/utils/normalizer.py),
+alone and with the conversion back to the row tuples the loader takes, then reading the same rows back from a CSV
+archive (transaction.read_csv_rows) with each engine. Both engines are checked to give the same rows.
+  python -m bench.bench_normalize --rows 1000000 --month-rows 5000
+"""
+import argparse, os, tempfile, time
+from bench import common
+
+def raw_rows(n: int, seed: int = 0) -> list[list[str]]:
+  ''' Synthetic rows formatted back to the cell texts of the screener, in COLUMN_HEADERS order '''
+  rows = []
+  for x, filing_date, trade_date, ticker, company, insider, title, trade_type, price, qty, owned, delta_owned, _, _, value in common.synthetic_rows(n, seed):
+    sign = "-" if trade_type.startswith("S") else "+"
+    rows.append([
+      x, f"{filing_date:%Y-%m-%d %H:%M:%S}", trade_date.isoformat(), ticker, company, insider, title, trade_type,
+      f"${price:,.2f}", f"{sign}{qty:,}", f"{owned:,}", delta_owned, f"{sign}${value:,.0f}",
+    ])
+  return rows
+
+def timed(name: str, rows: int, run) -> dict:
+  start = time.perf_counter()
+  run()
+  seconds = time.perf_counter() - start
+  return {"scenario": name, "rows": rows, "seconds": round(seconds, 3), "rows_per_sec": round(rows / seconds), "seconds_per_million_rows": round(seconds / rows * 1e6, 3)}
+
+def main():
+  arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  arg_parser.add_argument("--rows", type=int, default=1000000)
+  arg_parser.add_argument("--month-rows", type=int, default=5000, help="rows per normalize call, like a month of the screener")
+  arg_parser.add_argument("--output", default=None, help="JSON file of the results, stdout by default")
+  args = arg_parser.parse_args()
+  with tempfile.TemporaryDirectory() as tmp:
+    os.environ["OUTPUT_DIR"] = tmp
+    from services import transaction as transact_mgr
+    from services.utils import normalizer
+
+    rows = raw_rows(args.rows)
+    months = [rows[i:i + args.month_rows] for i in range(0, len(rows), args.month_rows)]
+    if transact_mgr.normalize_rows(months[0], "row") != transact_mgr.normalize_rows(months[0], "batch"):
+      raise SystemExit("The row and batch normalizers disagree")
+    file_name = os.path.join(tmp, "rows.csv.gz")
+    transact_mgr.write_to_csv(rows, file_name, transact_mgr.COLUMN_HEADERS)
+
+    def consume(iterator):
+      for _ in iterator:
+        pass
+    results = [
+      timed("normalize_row", args.rows, lambda: [transact_mgr.normalize_rows(month, "row") for month in months]),
+      timed("batch (columns)", args.rows, lambda: [normalizer.normalize_batch(month) for month in months]),
+      timed("batch (row tuples)", args.rows, lambda: [transact_mgr.normalize_rows(month, "batch") for month in months]),
+      timed("csv.gz, row", args.rows, lambda: consume(transact_mgr.read_csv_rows(file_name, "row"))),
+      timed("csv.gz, batch", args.rows, lambda: consume(transact_mgr.read_csv_rows(file_name, "batch"))),
+    ]
+  common.write_results({"meta": common.run_metadata(), "month_rows": args.month_rows, "results": results}, args.output)
+
+if __name__ == "__main__":
+  main()
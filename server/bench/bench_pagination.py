@@ -0,0 +1,62 @@
+"""
+Page latency by depth over the whole date range: OFFSET paging vs the (trade_date, id) cursor.
+  python -m bench.bench_pagination --rows 2000000 --db /tmp/plan.db --depths 0 10 100 1000 10000
+"""
+import argparse, json, os, statistics, tempfile, time
+from datetime import date
+from bench import common
+
+def timed(func, repeat: int) -> float:
+  samples = []
+  for _ in range(repeat):
+    start = time.perf_counter()
+    func()
+    samples.append(time.perf_counter() - start)
+  return round(statistics.median(samples) * 1000, 3)
+
+def main():
+  arg_parser = argparse.ArgumentParser(description=__doc__)
+  arg_parser.add_argument("--rows", type=int, default=2000000)
+  arg_parser.add_argument("--db", default=None, help="database file, a temporary one by default (reused when it already has rows)")
+  arg_parser.add_argument("--limit", type=int, default=100)
+  arg_parser.add_argument("--depths", type=int, nargs="+", default=[0, 10, 100, 1000, 10000], help="page numbers to time")
+  arg_parser.add_argument("--repeat", type=int, default=5)
+  args = arg_parser.parse_args()
+
+  tmp = tempfile.TemporaryDirectory() if not args.db else None
+  path = args.db or os.path.join(tmp.name, "pagination.db")
+  os.environ["SQLALCHEMY_DATABASE_URL"] = f"sqlite:///{path}"
+  from sqlalchemy import inspect, text
+  from db import engine, SessionLocal
+  from services import transaction as transact_mgr
+  import migrations
+
+  if not inspect(engine).has_table("transactions") or not SessionLocal().execute(text("SELECT 1 FROM transactions LIMIT 1")).first():
+    common.seed_transactions(engine, args.rows)
+  else:
+    migrations.upgrade(engine)
+
+  from_date, to_date = date(2000, 1, 1), date.today()
+  db = SessionLocal()
+  results = []
+  try:
+    for depth in args.depths:
+      def offset_page():
+        return db.execute(transact_mgr.transactions_query("", from_date, to_date).offset(depth * args.limit).limit(args.limit)).all()
+      # the cursor a client would hold after reading `depth` pages
+      previous = db.execute(transact_mgr.transactions_query("", from_date, to_date).offset(depth * args.limit - 1).limit(1)).first() if depth else None
+      if depth and previous is None:
+        break # past the last page
+      cursor = transact_mgr.encode_cursor(previous) if previous else None
+      def cursor_page():
+        return transact_mgr.retrieve_transactions(db, "", from_date, to_date, None, cursor, args.limit)
+      results.append({"page": depth, "offset_ms": timed(offset_page, args.repeat), "cursor_ms": timed(cursor_page, args.repeat)})
+  finally:
+    db.close()
+    if tmp:
+      engine.dispose()
+      tmp.cleanup()
+  print(json.dumps({"rows_per_page": args.limit, "pages": results}, indent=2))
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,77 @@
+"""
+Compare the parser engines on screener pages: rows/sec and peak RSS, each engine measured in a fresh process.
+  python -m bench.bench_parser --rows 5000
+  python -m bench.bench_parser --pages saved_page_1.html saved_page_2.html
+The engines are checked to give identical rows on the saved pages of tests/fixtures (tests/test_parser.py).
+"""
+import argparse, json, multiprocessing, os, resource, tempfile, time
+from bench import common
+
+def _max_rss_kb():
+  return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def _run_engine(engine: str, path: str, repeat: int, queue):
+  from services.transaction import COLUMN_HEADERS
+  from services.utils import parser
+  import settings
+  baseline = _max_rss_kb()
+  start = time.perf_counter()
+  for _ in range(repeat):
+    if engine == "stream": # same shape as the scraper: the page arrives in chunks
+      with open(path, encoding="utf-8") as f:
+        chunks = iter(lambda: f.read(settings.PARSER_CHUNK_SIZE), "")
+        rows = list(parser.iter_rows_stream(chunks, len(COLUMN_HEADERS)))
+    else:
+      with open(path, encoding="utf-8") as f:
+        rows = parser.get_engine(engine)(f.read(), len(COLUMN_HEADERS))
+  elapsed = time.perf_counter() - start
+  queue.put({
+    "engine": engine,
+    "rows": len(rows),
+    "seconds": elapsed / repeat,
+    "rows_per_sec": len(rows) * repeat / elapsed if elapsed else None,
+    "peak_rss_mb": _max_rss_kb() / 1024,
+    "peak_rss_delta_mb": (_max_rss_kb() - baseline) / 1024,
+    "result": rows,
+  })
+
+def measure(engine: str, path: str, repeat: int) -> dict:
+  ctx = multiprocessing.get_context("spawn")
+  queue = ctx.Queue()
+  proc = ctx.Process(target=_run_engine, args=(engine, path, repeat, queue))
+  proc.start()
+  result = queue.get()
+  proc.join()
+  return result
+
+def main():
+  arg_parser = argparse.ArgumentParser(description=__doc__)
+  arg_parser.add_argument("--rows", type=int, default=int(os.environ["MAX_ROWS"]), help="rows of the synthesized page")
+  arg_parser.add_argument("--pages", nargs="*", default=[], help="saved screener pages to use instead of a synthesized one")
+  arg_parser.add_argument("--repeat", type=int, default=3)
+  arg_parser.add_argument("--engines", nargs="*", default=["bs4", "stream"])
+  args = arg_parser.parse_args()
+
+  pages = list(args.pages)
+  tmp = None
+  if not pages:
+    tmp = tempfile.NamedTemporaryFile("w", suffix=".html", delete=False, encoding="utf-8")
+    tmp.write(common.synthesize_page(args.rows))
+    tmp.close()
+    pages = [tmp.name]
+
+  report = []
+  try:
+    for page in pages:
+      results = [measure(engine, page, args.repeat) for engine in args.engines]
+      identical = all(r["result"] == results[0]["result"] for r in results)
+      for r in results:
+        del r["result"]
+      report.append({"page": page, "size_mb": os.path.getsize(page) / 1024 / 1024, "identical_output": identical, "engines": results})
+  finally:
+    if tmp:
+      os.unlink(tmp.name)
+  print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,93 @@
+"""
+Rate limiter overhead per request: the previous SQLite fallback (DELETE + COUNT + INSERT + commit on request_logs),
+the in-process sharded token bucket (1 and N threads), and with --redis the Lua sliding window (one EVALSHA round trip).
+  python -m bench.bench_rate_limiter --requests 20000 --clients 100 --threads 8 --redis
+"""
+import argparse, json, os, statistics, tempfile, time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, UTC
+from types import SimpleNamespace
+from bench import common
+
+def measure(name: str, func, requests: int, threads: int = 1) -> dict:
+  ''' Per-call latency of func(i) for i in range(requests), split over threads '''
+  def worker(part):
+    samples = []
+    for i in part:
+      start = time.perf_counter()
+      func(i)
+      samples.append(time.perf_counter() - start)
+    return samples
+  parts = [range(t, requests, threads) for t in range(threads)]
+  start = time.perf_counter()
+  with ThreadPoolExecutor(threads) as pool:
+    samples = sorted(s for part in pool.map(worker, parts) for s in part)
+  seconds = time.perf_counter() - start
+  return {
+    "limiter": name,
+    "threads": threads,
+    "requests": requests,
+    "us_mean": round(statistics.fmean(samples) * 1e6, 2),
+    "us_p50": round(samples[len(samples) // 2] * 1e6, 2),
+    "us_p99": round(samples[int(len(samples) * 0.99)] * 1e6, 2),
+    "requests_per_sec": round(requests / seconds),
+  }
+
+def main():
+  arg_parser = argparse.ArgumentParser(description=__doc__)
+  arg_parser.add_argument("--requests", type=int, default=20000)
+  arg_parser.add_argument("--clients", type=int, default=100, help="distinct client ids the requests are spread over")
+  arg_parser.add_argument("--threads", type=int, default=8)
+  arg_parser.add_argument("--redis", action="store_true", help="also measure the Lua limiter against REDIS_URL:REDIS_PORT")
+  args = arg_parser.parse_args()
+
+  with tempfile.TemporaryDirectory() as tmp:
+    os.environ["SQLALCHEMY_DATABASE_URL"] = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+    import redis
+    from db import engine, Base, SessionLocal
+    from models import client as model
+    from services import rate_limiter
+    Base.metadata.create_all(bind=engine)
+    limit, window = 10 ** 9, 60 # never reached, every request takes the allowed path
+    users = [SimpleNamespace(client_id=f"client-{i}", role="client") for i in range(args.clients)]
+    db = SessionLocal()
+    for user in users:
+      db.add(model.Client(id=user.client_id, hashed_secret="", is_active=True))
+    db.commit()
+    results = []
+
+    def sqlite_fallback(i):
+      # the previous validate_rate_limit_with_sqlite
+      client_id = users[i % args.clients].client_id
+      window_start = datetime.now(UTC) - timedelta(seconds=window)
+      db.query(model.Request_Log).filter(model.Request_Log.client_id == client_id, model.Request_Log.timestamp < window_start).delete()
+      db.query(model.Request_Log).filter(model.Request_Log.client_id == client_id, model.Request_Log.timestamp >= window_start).count()
+      db.add(model.Request_Log(client_id=client_id))
+      db.commit()
+    results.append(measure("sqlite_request_logs", sqlite_fallback, min(args.requests, 5000)))
+    db.close()
+
+    buckets = rate_limiter.ShardedTokenBucket()
+    def token_bucket(i):
+      buckets.acquire(f"rate_limit:{users[i % args.clients].client_id}", limit, window)
+    results.append(measure("local_token_bucket", token_bucket, args.requests))
+    results.append(measure("local_token_bucket", token_bucket, args.requests, args.threads))
+
+    if args.redis:
+      import settings
+      client = redis.Redis(host=settings.REDIS_URL, port=settings.REDIS_PORT, password=settings.REDIS_PASSWORD, decode_responses=True)
+      def lua_sliding_window(i):
+        rate_limiter.validate_rate_limit_with_redis(client, f"bench:rate_limit:{users[i % args.clients].client_id}", limit, window)
+      try:
+        results.append(measure("redis_lua_sliding_window", lua_sliding_window, args.requests))
+        results.append(measure("redis_lua_sliding_window", lua_sliding_window, args.requests, args.threads))
+      except redis.RedisError as e:
+        results.append({"limiter": "redis_lua_sliding_window", "error": str(e)})
+      finally:
+        for key in client.scan_iter("bench:rate_limit:*"):
+          client.delete(key)
+    engine.dispose()
+  print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,65 @@
+"""
+Serialization cost of a page of transactions, per 1,000 rows, on a seeded database:
+  ORM + Pydantic: ORM objects validated into schemas.transaction.Transaction, dumped by Pydantic (the former path)
+  rows + Pydantic: ROW_COLUMNS tuples through the same models, the cost of the validation alone
+  rows + orjson: ROW_COLUMNS tuples encoded by transaction.serialize_page (the current path)
+The bodies are checked to be identical. fetch_ms is the query (and ORM loading), serialize_ms the encoding.
+  python -m bench.bench_serialize --db /tmp/load.db --rows 500000 --limit 1000
+"""
+import argparse, json, os, statistics, tempfile, time
+from bench import common
+
+def main():
+  arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  arg_parser.add_argument("--rows", type=int, default=500000)
+  arg_parser.add_argument("--db", default=None, help="database file, a temporary one by default (reused when it already has rows)")
+  arg_parser.add_argument("--limit", type=int, default=1000, help="rows per page")
+  arg_parser.add_argument("--repeat", type=int, default=20)
+  args = arg_parser.parse_args()
+
+  tmp = tempfile.TemporaryDirectory() if not args.db else None
+  path = os.path.abspath(args.db or os.path.join(tmp.name, "bench.db"))
+  os.environ["SQLALCHEMY_DATABASE_URL"] = f"sqlite:///{path}"
+  from pydantic import TypeAdapter
+  from sqlalchemy import inspect
+  from db import engine, SessionLocal
+  from schemas import transaction as schema
+  from services import transaction as transact_mgr
+
+  if not inspect(engine).has_table("transactions"):
+    common.seed_transactions(engine, args.rows)
+  adapter = TypeAdapter(list[schema.Transaction])
+  query = common.view_query().limit(args.limit)
+  row_query = transact_mgr.transactions_query("").limit(args.limit)
+  modes = {
+    "ORM + Pydantic": (lambda db: db.scalars(query).all(), lambda page: adapter.dump_json(adapter.validate_python(page)).decode()),
+    "rows + Pydantic": (lambda db: db.execute(row_query).all(), lambda page: adapter.dump_json(adapter.validate_python([row._mapping for row in page])).decode()),
+    "rows + orjson": (lambda db: db.execute(row_query).all(), transact_mgr.serialize_page),
+  }
+  results, bodies = [], set()
+  with SessionLocal() as db:
+    for name, (fetch, serialize) in modes.items():
+      fetch_samples, serialize_samples = [], []
+      for _ in range(args.repeat):
+        start = time.perf_counter()
+        page = fetch(db)
+        fetched = time.perf_counter()
+        body = serialize(page)
+        fetch_samples.append(fetched - start)
+        serialize_samples.append(time.perf_counter() - fetched)
+        db.expunge_all()
+      bodies.add(body)
+      per_1000 = 1000 / len(page) * 1000 # seconds per page -> ms per 1,000 rows
+      results.append({
+        "mode": name,
+        "fetch_ms": round(statistics.median(fetch_samples) * per_1000, 2),
+        "serialize_ms": round(statistics.median(serialize_samples) * per_1000, 2),
+        "total_ms": round((statistics.median(fetch_samples) + statistics.median(serialize_samples)) * per_1000, 2),
+      })
+  engine.dispose()
+  if tmp:
+    tmp.cleanup()
+  print(json.dumps({"rows_per_page": len(page), "identical_bodies": len(bodies) == 1, "per_1000_rows": results}, indent=2))
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,153 @@
+"""
+Size and latency of the storage layouts: the legacy transactions table (UUID key, names as text, NUMERIC money) against
+the compact one (models/transaction.py), on the same synthetic rows. A legacy database is seeded, measured, moved to the
+compact layout by the migration (migrations.compact_transactions, then vacuumed) and measured again:
+  bytes of the filing lines, their indexes and the dimension tables (dbstat), of the whole file
+  retrieve_transactions first pages (ticker, ticker + trade type, one week, one week + trade type, median ms)
+  range scans: every row of a month (ROW_COLUMNS), and a year of sums GROUP BY trade type
+The legacy table is read as the API read it before the migration (common.view_query), the compact layout through
+transactions_query, on transaction_facts first.
+The aggregate tables are left out (the same in both layouts).
+  python -m bench.bench_storage --rows 1000000 --output results/storage.json
+"""
+import argparse, os, statistics, tempfile, time, uuid
+from datetime import date
+from bench import common
+
+# the transactions table as created before the compact layout, with its indexes
+LEGACY_SCHEMA = """
+CREATE TABLE transactions (
+  id VARCHAR NOT NULL PRIMARY KEY, x VARCHAR(1), filing_date TIMESTAMP, trade_date DATE, ticker VARCHAR(10), company_name VARCHAR,
+  insider_name VARCHAR, insider_title VARCHAR, trade_type VARCHAR(20), price NUMERIC(10, 2), qty INTEGER, owned INTEGER,
+  delta_owned VARCHAR(20), delta_owned_pct FLOAT, delta_owned_flag VARCHAR(8), value NUMERIC(15, 2)
+);
+CREATE INDEX ix_transactions_id ON transactions (id);
+CREATE UNIQUE INDEX uq_transactions_natural_key ON transactions (ticker, trade_date, insider_name, filing_date, trade_type, qty, price);
+CREATE INDEX ix_transactions_ticker_trade_date_id ON transactions (ticker, trade_date, id);
+CREATE INDEX ix_transactions_trade_date_id ON transactions (trade_date, id);
+CREATE INDEX ix_transactions_trade_type_trade_date_id ON transactions (trade_type, trade_date, id);
+"""
+LEGACY_COLUMNS = ("id", "x", "filing_date", "trade_date", "ticker", "company_name", "insider_name", "insider_title", "trade_type", "price", "qty", "owned", "delta_owned", "delta_owned_pct", "delta_owned_flag", "value")
+DIMENSIONS = ("tickers", "insiders", "trade_types")
+
+def seed_legacy(engine, rows: int, batch_size: int = 20000) -> float:
+  ''' The synthetic rows in the legacy table, loaded then indexed, Returns: seconds '''
+  started = time.perf_counter()
+  create_table, *indexes = [statement for statement in LEGACY_SCHEMA.split(";") if statement.strip()]
+  insert = f"INSERT INTO transactions ({', '.join(LEGACY_COLUMNS)}) VALUES ({', '.join('?' * len(LEGACY_COLUMNS))})"
+  with engine.begin() as conn:
+    conn.exec_driver_sql(create_table)
+    batch = []
+    for row in common.synthetic_rows(rows):
+      batch.append((str(uuid.uuid4()), *row))
+      if len(batch) == batch_size:
+        conn.exec_driver_sql(insert, batch)
+        batch = []
+    if batch:
+      conn.exec_driver_sql(insert, batch)
+    conn.exec_driver_sql("DELETE FROM transactions WHERE rowid NOT IN (SELECT MIN(rowid) FROM transactions GROUP BY ticker, trade_date, insider_name, filing_date, trade_type, qty, price)")
+    for statement in indexes:
+      conn.exec_driver_sql(statement)
+    conn.exec_driver_sql("ANALYZE")
+  return time.perf_counter() - started
+
+def sizes(engine, path: str) -> dict:
+  ''' Bytes of the filing lines (table, indexes) and of the dimension tables with their indexes, from dbstat '''
+  with engine.connect() as conn:
+    objects = conn.exec_driver_sql("SELECT name, tbl_name, type FROM sqlite_master WHERE type IN ('table', 'index')").fetchall()
+    pages = dict(conn.exec_driver_sql("SELECT name, SUM(pgsize) FROM dbstat GROUP BY name").fetchall())
+  result = {"file_bytes": os.path.getsize(path), "table_bytes": 0, "index_bytes": 0, "dimension_bytes": 0}
+  for name, table, kind in objects:
+    if table in DIMENSIONS:
+      result["dimension_bytes"] += pages.get(name, 0)
+    elif table in ("transactions", "transaction_facts"):
+      result["table_bytes" if kind == "table" else "index_bytes"] += pages.get(name, 0)
+  result["transactions_bytes"] = result["table_bytes"] + result["index_bytes"] + result["dimension_bytes"]
+  return result
+
+def latencies(repeat: int, legacy: bool) -> dict:
+  from sqlalchemy import String, cast, text
+  import settings
+  from db import SessionLocal
+  from models import transaction as model
+  from schemas.transaction import TransactionType
+  from services import transaction as transact_mgr
+  week = (date(2019, 3, 4), date(2019, 3, 10))
+  month = (date(2019, 3, 1), date(2019, 3, 31))
+  if legacy: # the same rows from the legacy table, as the API read them before the migration
+    columns = [cast(model.Transaction.id, String).label("id") if field == "id" else getattr(model.Transaction, field) for field in transact_mgr.TRANSACTION_FIELDS]
+    rows = lambda ticker, from_date, to_date, trade_type: common.view_query(ticker, from_date, to_date, trade_type and trade_type.value).with_only_columns(*columns)
+    page = lambda db, *filters: db.execute(rows(*filters).limit(settings.DEFAULT_PAGE_SIZE + 1)).all()
+    year_sums = """SELECT trade_type, COUNT(*), SUM(qty), SUM(value) FROM transactions
+      WHERE trade_date BETWEEN '2019-01-01' AND '2019-12-31' GROUP BY trade_type"""
+  else: # summed on transaction_facts, the names joined to the groups
+    rows = transact_mgr.transactions_query
+    page = transact_mgr.retrieve_transactions
+    year_sums = f"""SELECT tt.trade_type, s.trades, s.qty, s.value FROM (
+        SELECT trade_type_id, COUNT(*) AS trades, SUM(qty) AS qty, SUM(value_cents) / 100.0 AS value FROM {model.TransactionFact.__tablename__}
+        WHERE trade_date BETWEEN '2019-01-01' AND '2019-12-31' GROUP BY trade_type_id
+      ) s LEFT JOIN {model.TradeType.__tablename__} tt ON tt.id = s.trade_type_id"""
+  queries = {
+    "page ticker": lambda db: page(db, "T0042", None, None, None),
+    "page ticker+trade_type": lambda db: page(db, "T0042", None, None, TransactionType.P),
+    "page week": lambda db: page(db, "", *week, None),
+    "page week+trade_type": lambda db: page(db, "", *week, TransactionType.S),
+    "scan month rows": lambda db: db.execute(rows("", *month, None)).all(),
+    "scan year sums": lambda db: db.execute(text(year_sums)).all(),
+  }
+  results = {}
+  with SessionLocal() as db:
+    for name, query in queries.items():
+      query(db) # warm the page cache
+      samples = []
+      for _ in range(repeat):
+        started = time.perf_counter()
+        query(db)
+        samples.append(time.perf_counter() - started)
+      results[name] = round(statistics.median(samples) * 1000, 3)
+  return results
+
+def main():
+  arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  arg_parser.add_argument("--rows", type=int, default=500000)
+  arg_parser.add_argument("--repeat", type=int, default=20)
+  arg_parser.add_argument("--output", default=None, help="JSON file of the results, stdout by default")
+  args = arg_parser.parse_args()
+  with tempfile.TemporaryDirectory() as tmp:
+    path = os.path.join(tmp, "storage.db")
+    os.environ["SQLALCHEMY_DATABASE_URL"] = f"sqlite:///{path}"
+    os.environ["OUTPUT_DIR"] = tmp
+    from db import engine
+    from models import transaction as model
+    import migrations
+
+    seed_seconds = seed_legacy(engine, args.rows)
+    legacy = {"sizes": sizes(engine, path), "ms_p50": latencies(args.repeat, legacy=True)}
+    started = time.perf_counter()
+    for table in (model.Ticker, model.Insider, model.TradeType, model.TransactionFact):
+      table.__table__.create(bind=engine)
+    migrations.compact_transactions(engine)
+    migrations.ensure_indexes(engine)
+    migrations.ensure_view(engine)
+    migrate_seconds = time.perf_counter() - started
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+      conn.exec_driver_sql("VACUUM")
+      conn.exec_driver_sql("ANALYZE")
+    engine.dispose() # fresh connections, as a restarted server: no statement or schema cache of the legacy table
+    compact = {"sizes": sizes(engine, path), "ms_p50": latencies(args.repeat, legacy=False)}
+    engine.dispose()
+
+  ratio = lambda before, after: round(before / after, 2) if after else None
+  common.write_results({
+    "meta": common.run_metadata(),
+    "rows": args.rows,
+    "seed_seconds": round(seed_seconds, 2),
+    "migrate_seconds": round(migrate_seconds, 2),
+    "legacy": legacy,
+    "compact": compact,
+    "size_ratio": {key: ratio(legacy["sizes"][key], compact["sizes"][key]) for key in ("file_bytes", "table_bytes", "index_bytes", "transactions_bytes")},
+    "speedup": {key: ratio(legacy["ms_p50"][key], compact["ms_p50"][key]) for key in legacy["ms_p50"]},
+  }, args.output)
+
+if __name__ == "__main__":
+  main()
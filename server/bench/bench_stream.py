@@ -0,0 +1,71 @@
+"""
+Large result sets: format=ndjson (stream_transactions_async, yield_per batches of plain tuples) against what a client
+gets without it, every row loaded as ORM objects and dumped through the Pydantic models in one JSON body.
+Reports the rows per second, the time to the first byte and the peak Python memory (tracemalloc) of each.
+  python -m bench.bench_stream --db /tmp/load.db --rows 500000
+"""
+import argparse, asyncio, json, os, tempfile, time, tracemalloc
+from datetime import date
+from bench import common
+
+def measure(name: str, run) -> dict:
+  # timed and traced in two runs: tracemalloc slows down every allocation
+  start = time.perf_counter()
+  rows, first_byte, size = run()
+  seconds = time.perf_counter() - start
+  tracemalloc.start()
+  run()
+  _, peak = tracemalloc.get_traced_memory()
+  tracemalloc.stop()
+  return {"mode": name, "rows": rows, "seconds": round(seconds, 2), "rows_per_s": round(rows / seconds), "first_byte_ms": round(first_byte * 1000, 1), "mb_body": round(size / 2**20, 1), "mb_peak": round(peak / 2**20, 1)}
+
+def main():
+  arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  arg_parser.add_argument("--rows", type=int, default=500000)
+  arg_parser.add_argument("--db", default=None, help="database file, a temporary one by default (reused when it already has rows)")
+  arg_parser.add_argument("--from-date", type=date.fromisoformat, default=None, help="first trade date of the result, all the rows by default")
+  args = arg_parser.parse_args()
+
+  tmp = tempfile.TemporaryDirectory() if not args.db else None
+  path = os.path.abspath(args.db or os.path.join(tmp.name, "bench.db"))
+  os.environ["SQLALCHEMY_DATABASE_URL"] = f"sqlite:///{path}"
+  from pydantic import TypeAdapter
+  from sqlalchemy import inspect
+  from db import engine, async_engine, SessionLocal
+  from services import transaction as transact_mgr
+  from schemas import transaction as schema
+
+  if not inspect(engine).has_table("transactions"):
+    common.seed_transactions(engine, args.rows)
+  query = transact_mgr.transactions_query("", args.from_date)
+  adapter = TypeAdapter(list[schema.Transaction])
+
+  def stream():
+    async def consume():
+      rows = size = 0
+      first_byte = None
+      started = time.perf_counter()
+      async for chunk in transact_mgr.stream_transactions_async(query, "ndjson"):
+        first_byte = first_byte if first_byte is not None else time.perf_counter() - started
+        rows += chunk.count(b"\n")
+        size += len(chunk)
+      await async_engine.dispose()
+      return rows, first_byte, size
+    return asyncio.run(consume())
+
+  def materialize():
+    started = time.perf_counter()
+    with SessionLocal() as db:
+      transactions = db.scalars(common.view_query("", args.from_date)).all()
+      body = adapter.dump_json(adapter.validate_python(transactions))
+    return len(transactions), time.perf_counter() - started, len(body) # nothing is sent before the whole body is built
+
+  results = [measure("ndjson stream", stream)]
+  results.append(measure("ORM + Pydantic, one body", materialize))
+  engine.dispose()
+  if tmp:
+    tmp.cleanup()
+  print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,189 @@
+import json, os, platform, random, subprocess, sys
+from datetime import date, datetime, timedelta, UTC
+
+'''
+Shared helpers for the benchmarks, run them from the server directory: python -m bench.<name>
+Importing this module sets placeholder values for the environment variables that settings.py needs,
+so the benchmarks do not depend on a local .env (variables which are already set win).
+'''
+
+BENCH_ENV = {
+  "SQLALCHEMY_DATABASE_URL": "sqlite:///./bench.db",
+  "SECRET_KEY": "bench-secret",
+  "ALGORITHM": "HS256",
+  "ACCESS_TOKEN_EXPIRE_MINUTES": "30",
+  "BASE_URL": "http://127.0.0.1:8765/screener",
+  "DEFAULT_FILLING_DAYS": "1",
+  "TRADE_DATE_FILTER": "0",
+  "MAX_WORKERS": "3",
+  "OUTPUT_DIR": "out",
+  "MAX_ROWS": "5000",
+}
+for key, value in BENCH_ENV.items():
+  os.environ.setdefault(key, value)
+
+TRADE_TYPES = ["S - Sale", "S - Sale+OE", "P - Purchase"]
+TITLES = ["CEO", "CFO", "Dir", "10%", "Pres, COO", "SVP & GC"]
+
+def synthesize_page(num_rows: int, seed: int = 0, start: date = date(2024, 1, 1)) -> str:
+  '''
+  Build a screener page with the same markup as openinsider.com (tinytable, links, tooltips, extra columns).
+  '''
+  rnd = random.Random(seed)
+  rows = []
+  for i in range(num_rows):
+    trade_date = start + timedelta(days=rnd.randint(0, 27))
+    filing_date = datetime.combine(trade_date, datetime.min.time()) + timedelta(days=rnd.randint(0, 3), seconds=rnd.randint(0, 86399))
+    ticker = "".join(rnd.choice("ABCDEFGHIJKLMNOPQRSTUVWXYZ") for _ in range(rnd.randint(1, 4)))
+    price = rnd.uniform(1, 500)
+    qty = rnd.randint(1, 500000) * (-1 if rnd.random() < 0.7 else 1)
+    owned = rnd.randint(0, 5000000)
+    delta = rnd.choice(["New", ">999%", f"{rnd.randint(-100, 100):+d}%", ""])
+    rows.append(
+      f'<tr style="background:#{"ffffff" if i % 2 else "f4f4f4"}">'
+      f'<td align=right>{rnd.choice(["", "D", "M", "DM"])}</td>'
+      f'<td align=right><div><a href="http://www.sec.gov/Archives/edgar/data/{i}.xml" title="SEC Form 4">{filing_date:%Y-%m-%d %H:%M:%S}</a></div></td>'
+      f'<td align=right><div>{trade_date:%Y-%m-%d}</div></td>'
+      f'<td><b><a href="/{ticker}" onmouseover="Tip(\'&lt;img src=&quot;/chart/{ticker}&quot;&gt;\')" onmouseout="UnTip()">{ticker}</a></b></td>'
+      f'<td><a href="/{ticker}">{ticker} Holdings &amp; Co</a></td>'
+      f'<td><a href="/insider/{i}">Insider {i} Jr.</a></td>'
+      f'<td>{rnd.choice(TITLES).replace("&", "&amp;")}</td>'
+      f'<td>{rnd.choice(TRADE_TYPES)}</td>'
+      f'<td align=right>${price:,.2f}</td>'
+      f'<td align=right>{qty:+,d}</td>'
+      f'<td align=right>{owned:,d}</td>'
+      f'<td align=right>{delta}</td>'
+      f'<td align=right>{"-" if qty < 0 else "+"}${abs(qty) * price:,.0f}</td>'
+      f'<td></td><td></td><td></td><td></td>'
+      '</tr>\n'
+    )
+  return (
+    '<html><head><title>OpenInsider Screener</title></head><body>\n'
+    '<table class="header"><tr><td><a href="/">openinsider</a></td></tr></table>\n'
+    '<table width="100%" cellpadding="0" cellspacing="0" border="0" class="tinytable">\n'
+    '<thead><tr><th>X</th><th>Filing&nbsp;Date</th><th>Trade&nbsp;Date</th><th>Ticker</th><th>Company&nbsp;Name</th>'
+    '<th>Insider&nbsp;Name</th><th>Title</th><th>Trade&nbsp;Type</th><th>Price</th><th>Qty</th><th>Owned</th>'
+    '<th>&Delta;Own</th><th>Value</th><th>1d</th><th>1w</th><th>1m</th><th>6m</th></tr></thead>\n'
+    '<tbody>\n' + "".join(rows) + '</tbody>\n</table>\n</body></html>\n'
+  )
+
+# shape of the synthetic transactions: tickers T0000..T5000, insiders 0..50000, trades from FIRST_TRADE_DATE over TRADE_DAYS days
+TICKERS = 5000
+INSIDERS = 50000
+FIRST_TRADE_DATE = date(2013, 3, 1)
+TRADE_DAYS = 4500
+
+def synthetic_rows(n: int, seed: int = 0, tickers: int = TICKERS, batch_size: int = 10000):
+  '''
+  Generator of normalized rows, in loader.TRANSACTION_COLUMNS order, the same for the same n and seed.
+  Built a column of batch_size values at a time from precomputed pools (dates, tickers, names), which makes the
+  generation several times faster than the load itself: 50M rows are bound by SQLite, not by this generator.
+  '''
+  rnd = random.Random(seed)
+  days = [FIRST_TRADE_DATE + timedelta(days=i) for i in range(TRADE_DAYS + 1)]
+  midnights = [datetime.combine(day, datetime.min.time()) for day in days]
+  ticker_names = [f"T{i:04d}" for i in range(tickers + 1)]
+  insider_names = [f"Insider {i}" for i in range(INSIDERS + 1)]
+  deltas = [(f"{i:+d}%", float(i), None) for i in range(-100, 101)] + [("New", None, "new"), (">999%", 999.0, "capped")]
+  filing_delays = [timedelta(seconds=i) for i in range(0, 3 * 86400 + 1, 60)]
+  for offset in range(0, n, batch_size):
+    k = min(batch_size, n - offset)
+    day_index = rnd.choices(range(len(days)), k=k)
+    qtys = rnd.choices(range(1, 500001), k=k)
+    prices = [round(1 + 499 * rnd.random(), 2) for _ in range(k)]
+    delta_texts, delta_pcts, delta_flags = zip(*rnd.choices(deltas, k=k))
+    yield from zip(
+      rnd.choices(["", "D", "M"], k=k),
+      [midnights[i] + delay for i, delay in zip(day_index, rnd.choices(filing_delays, k=k))],
+      [days[i] for i in day_index],
+      rnd.choices(ticker_names, k=k),
+      ["Company Inc"] * k,
+      rnd.choices(insider_names, k=k),
+      rnd.choices(TITLES, k=k),
+      rnd.choices(TRADE_TYPES, k=k),
+      prices,
+      qtys,
+      rnd.choices(range(5000001), k=k),
+      delta_texts,
+      delta_pcts,
+      delta_flags,
+      [round(price * qty, 2) for price, qty in zip(prices, qtys)],
+    )
+
+def seed_transactions(engine, rows: int, seed: int = 0, tickers: int = TICKERS, commit_rows: int = 1000000) -> dict:
+  '''
+  Load synthetic rows without indexes, then build them through the migration path, like an upgraded production database.
+  Committed every commit_rows rows, so the WAL of a 50M rows load stays small, with the progress on stderr.
+  Returns: {rows, load_seconds, index_seconds, rows_per_sec}
+  '''
+  import time
+  from itertools import islice
+  import migrations
+  from models import transaction as model
+  from services.utils import loader
+  table = model.TransactionFact.__table__
+  for dimension in (model.Ticker, model.Insider, model.TradeType):
+    dimension.__table__.create(bind=engine, checkfirst=True)
+  table.create(bind=engine, checkfirst=True)
+  with engine.begin() as conn:
+    for index in table.indexes:
+      conn.exec_driver_sql(f"DROP INDEX IF EXISTS {index.name}")
+  started = time.perf_counter()
+  generated = synthetic_rows(rows, seed, tickers)
+  loaded = 0
+  while loaded < rows:
+    stats = loader.bulk_insert(engine, table, islice(generated, commit_rows), batch_size=20000)
+    loaded += stats.rows
+    print(f"Seeded {loaded}/{rows} rows ({loaded / (time.perf_counter() - started):.0f} rows/sec)", file=sys.stderr)
+  load_seconds = time.perf_counter() - started
+  migrations.upgrade(engine) # indexes, view and aggregate tables
+  return {
+    "rows": loaded,
+    "load_seconds": round(load_seconds, 2),
+    "index_seconds": round(time.perf_counter() - started - load_seconds, 2),
+    "rows_per_sec": round(loaded / load_seconds) if load_seconds else None,
+  }
+
+def view_query(ticker_id: str = "", from_date: date = None, to_date: date = None, trade_type: str = None):
+  '''
+  The rows of services.transaction.transactions_query (without cursor) as ORM objects of the transactions view, filtered on
+  its columns: the former read path, and the query of the legacy transactions table (same name and columns) in bench_storage.
+  '''
+  from sqlalchemy import select
+  from models import transaction as model
+  view = model.Transaction
+  query = select(view).where(view.trade_date <= (to_date or date.today()))
+  if ticker_id:
+    query = query.where(view.ticker == ticker_id)
+  if from_date:
+    query = query.where(view.trade_date >= from_date)
+  if trade_type:
+    query = query.where(view.trade_type == trade_type)
+  return query.order_by(view.trade_date.desc(), view.id.desc())
+
+def run_metadata() -> dict:
+  ''' What a result was measured on: commit (dirty when the tree has changes), time, Python and machine '''
+  def git(*args):
+    try:
+      return subprocess.run(["git", *args], capture_output=True, text=True, timeout=10, cwd=os.path.dirname(__file__)).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+      return ""
+  return {
+    "commit": git("rev-parse", "HEAD") or None,
+    "dirty": bool(git("status", "--porcelain", "--untracked-files=no")),
+    "measured_at": datetime.now(UTC).isoformat(timespec="seconds"),
+    "python": platform.python_version(),
+    "platform": platform.platform(),
+    "cpus": os.cpu_count(),
+  }
+
+def write_results(results, output: str = None):
+  ''' JSON results to output (a file, its directory created) or to stdout '''
+  body = json.dumps(results, indent=2, default=str)
+  if not output:
+    print(body)
+    return
+  os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+  with open(output, "w") as f:
+    f.write(body + "\n")
+  print(f"Results written to {output}", file=sys.stderr)
@@ -0,0 +1,66 @@
+"""
+Compare two bench.suite result files (base, then head): the change of every metric of the scenarios found in both,
+matched on (scenario, concurrency). Prints JSON; exits with 1 when a metric got worse by more than --threshold percent.
+  python -m bench.compare bench-results/base.json bench-results/head.json --threshold 10
+Higher is better for the *_per_sec metrics, lower for the seconds and ms_* ones; the others are not compared.
+"""
+import argparse, json, sys
+
+def direction(metric: str) -> int:
+  ''' 1: higher is better, -1: lower is better, 0: not compared '''
+  if metric.endswith("per_sec"):
+    return 1
+  if metric.endswith("seconds") or metric.startswith("ms_"):
+    return -1
+  return 0
+
+def key(result: dict) -> tuple:
+  return result["scenario"], result.get("concurrency")
+
+def compare(base: dict, head: dict, threshold: float) -> list[dict]:
+  base_results = {key(result): result for result in base["results"]}
+  changes = []
+  for result in head["results"]:
+    previous = base_results.get(key(result))
+    if previous is None:
+      continue
+    for metric, value in result.items():
+      sign = direction(metric)
+      old = previous.get(metric)
+      if not sign or not isinstance(value, (int, float)) or not isinstance(old, (int, float)) or not old:
+        continue
+      change = (value - old) / old * 100
+      changes.append({
+        "scenario": result["scenario"],
+        "concurrency": result.get("concurrency"),
+        "metric": metric,
+        "base": old,
+        "head": value,
+        "change_pct": round(change, 1),
+        "regression": change * sign < -threshold,
+      })
+  return changes
+
+def main():
+  arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  arg_parser.add_argument("base")
+  arg_parser.add_argument("head")
+  arg_parser.add_argument("--threshold", type=float, default=10, help="percent a metric may get worse before it counts as a regression")
+  args = arg_parser.parse_args()
+  with open(args.base) as f:
+    base = json.load(f)
+  with open(args.head) as f:
+    head = json.load(f)
+  changes = compare(base, head, args.threshold)
+  regressions = [change for change in changes if change["regression"]]
+  print(json.dumps({
+    "base": base.get("meta", {}).get("commit"),
+    "head": head.get("meta", {}).get("commit"),
+    "threshold_pct": args.threshold,
+    "regressions": len(regressions),
+    "changes": changes,
+  }, indent=2))
+  sys.exit(1 if regressions else 0)
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,35 @@
+"""
+Synthetic transactions database for the benchmarks, 1M to 50M rows: the same rows for the same --rows and --seed,
+loaded without indexes then indexed (and aggregated) through the migrations, committed every --commit-rows rows.
+  python -m bench.generate_data --db /tmp/bench-10m.db --rows 10000000
+The other benchmarks reuse a database passed with --db when it already has rows.
+"""
+import argparse, os
+from bench import common
+
+def main():
+  arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  arg_parser.add_argument("--db", required=True, help="database file, must not have a transactions table yet")
+  arg_parser.add_argument("--rows", type=int, default=1000000)
+  arg_parser.add_argument("--seed", type=int, default=0)
+  arg_parser.add_argument("--tickers", type=int, default=common.TICKERS, help="distinct tickers the rows are spread over")
+  arg_parser.add_argument("--commit-rows", type=int, default=1000000)
+  arg_parser.add_argument("--output", default=None, help="JSON file of the result, stdout by default")
+  args = arg_parser.parse_args()
+
+  path = os.path.abspath(args.db)
+  os.environ["SQLALCHEMY_DATABASE_URL"] = f"sqlite:///{path}"
+  from sqlalchemy import inspect
+  from db import Base, engine
+  from models import client, transaction # registered on Base.metadata
+
+  if inspect(engine).has_table("transactions"):
+    arg_parser.error(f"{path} already has a transactions table")
+  result = common.seed_transactions(engine, args.rows, args.seed, args.tickers, args.commit_rows)
+  Base.metadata.create_all(bind=engine)
+  engine.dispose()
+  result.update({"db": path, "seed": args.seed, "tickers": args.tickers, "mb": round(os.path.getsize(path) / 2**20, 1)})
+  common.write_results({"meta": common.run_metadata(), "dataset": result}, args.output)
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,143 @@
+"""
+Load test of the transaction endpoints: starts the app under uvicorn on a seeded database, then N concurrent clients
+request pages for a fixed duration, for each scenario and concurrency level. Reports the latency percentiles, throughput
+and status codes. The response cache is disabled so every request reaches the database.
+Scenarios: ticker (GET /insider_trades/{ticker}), date_range (GET /insider_trades?from_date&to_date, one week),
+mixed (70% ticker, 30% date range).
+--app-dir runs another checkout of the server (e.g. a `git worktree` of an older commit) on the same database,
+to compare before/after:
+  python -m bench.load_test --db /tmp/load.db --concurrency 50 --label after
+  python -m bench.load_test --db /tmp/load.db --concurrency 50 --label before --app-dir /tmp/before/server
+"""
+import argparse, asyncio, json, os, random, statistics, subprocess, sys, tempfile, time
+from collections import Counter
+from datetime import timedelta
+from bench import common
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def seed_clients(engine, count: int) -> list[str]:
+  ''' super_admin clients inserted directly (no bcrypt), so the rate limits do not cap the load '''
+  from sqlalchemy import insert
+  from models import client as model
+  ids = [f"load-test-{i}" for i in range(count)]
+  with engine.begin() as conn:
+    conn.execute(model.Client.__table__.delete().where(model.Client.id.like("load-test-%")))
+    conn.execute(insert(model.Client.__table__), [{"id": id, "hashed_secret": "", "is_active": True, "role": "super_admin"} for id in ids])
+  return ids
+
+def start_server(app_dir: str, port: int, env: dict) -> subprocess.Popen:
+  server = subprocess.Popen(
+    [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+    cwd=app_dir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+  )
+  import httpx
+  deadline = time.monotonic() + 60
+  while time.monotonic() < deadline:
+    try:
+      if httpx.get(f"http://127.0.0.1:{port}/docs", timeout=1).status_code == 200:
+        return server
+    except httpx.TransportError:
+      time.sleep(0.2)
+  server.kill()
+  raise RuntimeError("The server did not start")
+
+SCENARIOS = ("mixed", "ticker", "date_range")
+
+async def run_load(base_url: str, tokens: list[str], concurrency: int, duration: float, seed: int = 0, scenario: str = "mixed", tickers: int = common.TICKERS):
+  import httpx
+  latencies, statuses = [], Counter()
+  rnd = random.Random(seed)
+  deadline = time.monotonic() + duration
+
+  ticker_share = {"mixed": 0.7, "ticker": 1, "date_range": 0}[scenario]
+
+  def next_request():
+    if rnd.random() < ticker_share:
+      return f"/insider_trades/T{rnd.randint(0, tickers):04d}", {"limit": 100}
+    start = common.FIRST_TRADE_DATE + timedelta(days=rnd.randint(0, common.TRADE_DAYS - 10))
+    return "/insider_trades", {"from_date": str(start), "to_date": str(start + timedelta(days=7)), "limit": 100}
+
+  async def client(worker: int):
+    async with httpx.AsyncClient(base_url=base_url, timeout=60) as http:
+      i = worker
+      while time.monotonic() < deadline:
+        path, params = next_request()
+        headers = {"Authorization": f"Bearer {tokens[i % len(tokens)]}"}
+        i += concurrency
+        start = time.perf_counter()
+        try:
+          response = await http.get(path, params=params, headers=headers)
+          statuses[response.status_code] += 1
+        except httpx.HTTPError as e:
+          statuses[type(e).__name__] += 1
+        latencies.append(time.perf_counter() - start)
+
+  start = time.perf_counter()
+  await asyncio.gather(*(client(worker) for worker in range(concurrency)))
+  seconds = time.perf_counter() - start
+  latencies.sort()
+  percentile = lambda p: round(latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000, 1)
+  return {
+    "requests": len(latencies),
+    "requests_per_sec": round(len(latencies) / seconds, 1),
+    "ms_mean": round(statistics.fmean(latencies) * 1000, 1),
+    "ms_p50": percentile(0.50),
+    "ms_p95": percentile(0.95),
+    "ms_p99": percentile(0.99),
+    "ms_max": round(latencies[-1] * 1000, 1),
+    "statuses": {str(status): count for status, count in statuses.items()},
+  }
+
+def main():
+  arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  arg_parser.add_argument("--rows", type=int, default=500000)
+  arg_parser.add_argument("--db", default=None, help="database file, a temporary one by default (reused when it already has rows)")
+  arg_parser.add_argument("--app-dir", default=SERVER_DIR, help="server directory to run (default: this checkout)")
+  arg_parser.add_argument("--scenarios", nargs="+", default=["mixed"], choices=SCENARIOS)
+  arg_parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 10, 50])
+  arg_parser.add_argument("--duration", type=float, default=15, help="seconds per concurrency level")
+  arg_parser.add_argument("--port", type=int, default=8790)
+  arg_parser.add_argument("--label", default="")
+  arg_parser.add_argument("--output", default=None, help="JSON file of the results, stdout by default")
+  args = arg_parser.parse_args()
+
+  tmp = tempfile.TemporaryDirectory() if not args.db else None
+  path = os.path.abspath(args.db or os.path.join(tmp.name, "load.db"))
+  os.environ["SQLALCHEMY_DATABASE_URL"] = f"sqlite:///{path}"
+  from sqlalchemy import inspect, text
+  from db import engine, SessionLocal, Base
+  from models import client, transaction # registered on Base.metadata
+  from services.utils import token
+  import migrations
+
+  with SessionLocal() as db: # closed, an open read transaction would block the writes of the server
+    seeded = inspect(engine).has_table("transactions") and db.execute(text("SELECT 1 FROM transactions LIMIT 1")).first()
+  if not seeded:
+    common.seed_transactions(engine, args.rows)
+  Base.metadata.create_all(bind=engine)
+  migrations.upgrade(engine)
+  tokens = [token.create_access_token({"sub": id}, ["read"], timedelta(hours=2)) for id in seed_clients(engine, 2000)]
+  engine.dispose()
+
+  env = dict(os.environ, CACHE_ENABLED="false", OUTPUT_DIR=os.path.join(os.path.dirname(path), "out"), SUPER_ADMIN_ID="load-test-admin", SUPER_ADMIN_SECRET="load-test")
+  server = start_server(args.app_dir, args.port, env)
+  results = []
+  try:
+    for scenario in args.scenarios:
+      for concurrency in args.concurrency:
+        result = asyncio.run(run_load(f"http://127.0.0.1:{args.port}", tokens, concurrency, args.duration, scenario=scenario))
+        results.append({"label": args.label, "scenario": scenario, "concurrency": concurrency, **result})
+        print(json.dumps(results[-1]), file=sys.stderr)
+  finally:
+    server.terminate()
+    try:
+      server.wait(timeout=30)
+    except subprocess.TimeoutExpired: # the event loop is stuck, no graceful shutdown
+      server.kill()
+    if tmp:
+      tmp.cleanup()
+  common.write_results(results, args.output)
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,23 @@
+"""
+Query plan regression check for retrieve_transactions (tests/test_query_plan.py, run by pytest with the suite):
+seeds a synthetic database (multi-million rows by default), then asserts with EXPLAIN QUERY PLAN that every filter
+combination searches its index and never sorts in a temp B-tree. Exits with status 1 when a plan regresses.
+  python -m bench.query_plan --rows 2000000 --db /tmp/plan.db   (the database is reused when it already has rows)
+"""
+import argparse, os, sys
+import pytest
+
+TESTS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tests", "test_query_plan.py")
+
+def main():
+  arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  arg_parser.add_argument("--rows", type=int, default=2000000)
+  arg_parser.add_argument("--db", default=None, help="database file, a temporary one by default")
+  args = arg_parser.parse_args()
+  os.environ["QUERY_PLAN_ROWS"] = str(args.rows)
+  if args.db:
+    os.environ["QUERY_PLAN_DB"] = args.db
+  sys.exit(1 if pytest.main(["-q", TESTS]) else 0)
+
+if __name__ == "__main__":
+  main()
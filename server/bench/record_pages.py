@@ -0,0 +1,51 @@
+"""
+Record screener pages for the stub server to replay: one page per month from --start-year (through the fetcher, so
+within FETCH_CONCURRENCY / FETCH_RPS of the site), saved as openinsider_YYYY_MM_DD.html (first day of the range).
+  BASE_URL=http://openinsider.com/screener python -m bench.record_pages --start-year 2024 --pages-dir recorded/
+  python -m bench.stub_server --pages-dir recorded/
+Pages already in --pages-dir are kept, so an interrupted recording resumes where it stopped.
+"""
+import argparse, asyncio, os, sys
+from datetime import datetime
+from bench import common
+
+async def record(months: list[tuple[str, str]], pages_dir: str) -> dict:
+  from services import transaction as transact_mgr
+  from services.utils.fetcher import AsyncFetcher, FetchError
+  recorded, failed = 0, []
+  async def fetch(fetcher, start_date: str, end_date: str, path: str):
+    nonlocal recorded
+    try:
+      html = await fetcher.fetch(transact_mgr.build_screener_url(start_date, end_date))
+    except FetchError as e:
+      failed.append({"start_date": start_date, "error": str(e)})
+      return
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+      f.write(html)
+    os.replace(path + ".tmp", path)
+    recorded += 1
+    print(f"Recorded {path}", file=sys.stderr)
+
+  async with AsyncFetcher() as fetcher:
+    jobs = []
+    for start_date, end_date in months:
+      path = os.path.join(pages_dir, f"openinsider_{datetime.strptime(start_date, '%m/%d/%Y'):%Y_%m_%d}.html")
+      if not os.path.exists(path):
+        jobs.append(fetch(fetcher, start_date, end_date, path))
+    await asyncio.gather(*jobs) # the fetcher enforces the per-host limits
+    return {"months": len(months), "recorded": recorded, "kept": len(months) - len(jobs), "failed": failed, "fetch": fetcher.stats.summary()}
+
+def main():
+  arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  arg_parser.add_argument("--start-year", type=int, required=True)
+  arg_parser.add_argument("--pages-dir", required=True)
+  arg_parser.add_argument("--output", default=None, help="JSON file of the result, stdout by default")
+  args = arg_parser.parse_args()
+  from services import transaction as transact_mgr
+
+  os.makedirs(args.pages_dir, exist_ok=True)
+  result = asyncio.run(record(transact_mgr.month_ranges(args.start_year), args.pages_dir))
+  common.write_results(result, args.output)
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,87 @@
+"""
+Local stand-in for openinsider.com/screener, serving recorded pages or synthesized ones.
+  python -m bench.stub_server --port 8765 --pages-dir recorded/ --rows 500 --latency 0.05 --fail-rate 0.05
+Recorded pages are looked up by the first day of the requested filing range: openinsider_YYYY_MM_DD.html
+(the same naming as the CSV files), other ranges get a synthesized page of --rows rows.
+"""
+import argparse, os, random, threading, time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+from bench import common
+
+class ScreenerHandler(BaseHTTPRequestHandler):
+  protocol_version = "HTTP/1.1" # keep-alive, like the real site
+
+  def do_GET(self):
+    server = self.server
+    server.hits += 1
+    if server.latency:
+      time.sleep(server.latency)
+    if server.fail_rate and server.random.random() < server.fail_rate:
+      return self._send(503, b"Service Unavailable")
+    query = parse_qs(urlsplit(self.path).query)
+    try:
+      start_date = datetime.strptime(query["fdr"][0].split(" - ")[0], "%m/%d/%Y").date()
+    except (KeyError, ValueError):
+      return self._send(400, b"missing or invalid fdr")
+    page = server.page_for(start_date)
+    self._send(200, page.encode("utf-8"), "text/html; charset=utf-8")
+
+  def _send(self, status: int, body: bytes, content_type: str = "text/plain"):
+    self.send_response(status)
+    self.send_header("Content-Type", content_type)
+    self.send_header("Content-Length", str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, *args): # quiet
+    pass
+
+class StubScreenerServer(ThreadingHTTPServer):
+  daemon_threads = True
+
+  def __init__(self, host: str = "127.0.0.1", port: int = 0, pages_dir: str = None, rows: int = 100, latency: float = 0, fail_rate: float = 0, seed: int = 0):
+    super().__init__((host, port), ScreenerHandler)
+    self.pages_dir = pages_dir
+    self.rows = rows
+    self.latency = latency
+    self.fail_rate = fail_rate
+    self.random = random.Random(seed)
+    self.hits = 0
+    self._cache = {}
+
+  @property
+  def url(self) -> str:
+    return f"http://{self.server_address[0]}:{self.server_address[1]}/screener"
+
+  def page_for(self, start_date) -> str:
+    if start_date not in self._cache:
+      path = os.path.join(self.pages_dir, f"openinsider_{start_date:%Y_%m_%d}.html") if self.pages_dir else None
+      if path and os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+          self._cache[start_date] = f.read()
+      else:
+        self._cache[start_date] = common.synthesize_page(self.rows, seed=start_date.toordinal(), start=start_date)
+    return self._cache[start_date]
+
+  def start_in_thread(self):
+    thread = threading.Thread(target=self.serve_forever, daemon=True)
+    thread.start()
+    return thread
+
+def main():
+  arg_parser = argparse.ArgumentParser(description=__doc__)
+  arg_parser.add_argument("--host", default="127.0.0.1")
+  arg_parser.add_argument("--port", type=int, default=8765)
+  arg_parser.add_argument("--pages-dir", default=None)
+  arg_parser.add_argument("--rows", type=int, default=100, help="rows of a synthesized page")
+  arg_parser.add_argument("--latency", type=float, default=0, help="seconds added to every response")
+  arg_parser.add_argument("--fail-rate", type=float, default=0, help="fraction of requests answered with a 503")
+  args = arg_parser.parse_args()
+  server = StubScreenerServer(args.host, args.port, args.pages_dir, args.rows, args.latency, args.fail_rate)
+  print(f"Serving screener pages on {server.url}")
+  server.serve_forever()
+
+if __name__ == "__main__":
+  main()
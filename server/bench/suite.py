@@ -0,0 +1,89 @@
+"""
+Benchmark suite on an offline fixture (stub screener server, synthetic database): every scenario runs in a subprocess
+(its own settings and database), and the results go to one JSON file with the commit they were measured on.
+Compare two runs with bench.compare:
+  python -m bench.suite --profile small --output bench-results/$(git rev-parse --short HEAD).json
+  python -m bench.compare bench-results/<base>.json bench-results/<head>.json
+Scenarios:
+  bootstrap: full bootstrap from start_year against the stub server (pages of page_rows rows, latency seconds each)
+  daily_sync: daily syncs on the bootstrapped database, the first one loading today's filings (daily_sync_new),
+    the next ones finding them unchanged (daily_sync_unchanged, median)
+  ticker, date_range: GET /insider_trades/{ticker} and one week GET /insider_trades pages under uvicorn, at each
+    concurrency level, on a synthetic database of rows rows (--db reuses one, see bench.generate_data)
+"""
+import argparse, json, os, statistics, subprocess, sys, tempfile
+from datetime import date
+from bench import common
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCENARIOS = ("bootstrap", "daily_sync", "ticker", "date_range")
+PROFILES = {
+  "small": {"start_year": date.today().year - 1, "page_rows": 500, "latency": 0.02, "daily_syncs": 5, "rows": 200000, "concurrency": [1, 10, 50], "duration": 5},
+  "large": {"start_year": 2013, "page_rows": 2000, "latency": 0.05, "daily_syncs": 10, "rows": 5000000, "concurrency": [1, 10, 50, 100], "duration": 15},
+}
+
+def run_module(module: str, args: list[str], tmp: str):
+  ''' Run python -m module with --output, Returns: its JSON results '''
+  output = os.path.join(tmp, f"{module}.json")
+  command = [sys.executable, "-m", module, *map(str, args), "--output", output]
+  print(f"Running {' '.join(command[2:])}", file=sys.stderr)
+  subprocess.run(command, cwd=SERVER_DIR, check=True)
+  with open(output) as f:
+    return json.load(f)
+
+def ingest_results(result: dict) -> list[dict]:
+  summary = result["modes"]["direct"]
+  results = [{
+    "scenario": "bootstrap",
+    "months": summary["months"],
+    "rows": summary["rows"],
+    "seconds": summary["seconds"],
+    "rows_per_sec": summary["rows_per_sec"],
+    "network_bound_seconds": summary["network_bound_seconds"],
+    "fetch_p50_seconds": summary["fetch"]["p50"],
+  }]
+  syncs = result.get("daily_syncs", [])
+  if syncs:
+    results.append({"scenario": "daily_sync_new", "rows": syncs[0]["rows"], "seconds": syncs[0]["seconds"]})
+  if len(syncs) > 1:
+    results.append({"scenario": "daily_sync_unchanged", "runs": len(syncs) - 1, "seconds": statistics.median(sync["seconds"] for sync in syncs[1:])})
+  return results
+
+def query_results(results: list[dict]) -> list[dict]:
+  keys = ("scenario", "concurrency", "requests", "requests_per_sec", "ms_p50", "ms_p95", "ms_p99", "statuses")
+  return [{key: result[key] for key in keys} for result in results]
+
+def main():
+  arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  arg_parser.add_argument("--profile", default="small", choices=PROFILES)
+  arg_parser.add_argument("--scenarios", nargs="+", default=list(SCENARIOS), choices=SCENARIOS)
+  arg_parser.add_argument("--start-year", type=int, default=None)
+  arg_parser.add_argument("--rows", type=int, default=None, help="rows of the query database")
+  arg_parser.add_argument("--db", default=None, help="query database, reused when it already has rows")
+  arg_parser.add_argument("--concurrency", type=int, nargs="+", default=None)
+  arg_parser.add_argument("--duration", type=float, default=None, help="seconds per query scenario and concurrency level")
+  arg_parser.add_argument("--output", default=None, help="JSON file of the results, stdout by default")
+  args = arg_parser.parse_args()
+  profile = dict(PROFILES[args.profile])
+  for key in ("start_year", "rows", "concurrency", "duration"):
+    if getattr(args, key) is not None:
+      profile[key] = getattr(args, key)
+
+  results = []
+  with tempfile.TemporaryDirectory() as tmp:
+    if "bootstrap" in args.scenarios or "daily_sync" in args.scenarios:
+      result = run_module("bench.bench_bootstrap", [
+        "--start-year", profile["start_year"], "--rows", profile["page_rows"], "--latency", profile["latency"],
+        "--daily-syncs", profile["daily_syncs"] if "daily_sync" in args.scenarios else 0,
+      ], tmp)
+      results += [r for r in ingest_results(result) if r["scenario"].startswith(tuple(args.scenarios))]
+    queries = [scenario for scenario in args.scenarios if scenario in ("ticker", "date_range")]
+    if queries:
+      db = args.db or os.path.join(tmp, "query.db")
+      results += query_results(run_module("bench.load_test", [
+        "--db", db, "--rows", profile["rows"], "--scenarios", *queries, "--concurrency", *profile["concurrency"], "--duration", profile["duration"],
+      ], tmp))
+  common.write_results({"meta": common.run_metadata(), "profile": {"name": args.profile, **profile}, "results": results}, args.output)
+
+if __name__ == "__main__":
+  main()
@@ -1,4 +1,6 @@
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker 
 import settings
@@ -10,6 +12,15 @@ engine = create_engine(
 
 # Create a sessionmaker to interact with the database (each instance of the sessionLocal will be a database session)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# The same database through an asyncio driver, for the request handlers: a query awaits instead of blocking the event loop
+ASYNC_DRIVERS = {"sqlite": "sqlite+aiosqlite"}
+def async_database_url(url: str) -> str:
+  url = make_url(url)
+  return url.set(drivername=ASYNC_DRIVERS.get(url.drivername, url.drivername)).render_as_string(hide_password=False)
+
+async_engine = create_async_engine(async_database_url(settings.SQLALCHEMY_DATABASE_URL))
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
+
 # Create a base class for all database models when using SQLAlchemy's ORM (Object Relational Mapper)
 Base = declarative_base()
 
@@ -18,4 +29,8 @@ def get_db():
   try:
     yield db
   finally:
-    db.close()
\ No newline at end of file
+    db.close()
+
+async def get_async_db():
+  async with AsyncSessionLocal() as db:
+    yield db
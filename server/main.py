@@ -1,22 +1,38 @@
+import asyncio
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import RedirectResponse
 from routers.transaction import router as transact_router
 from routers.admin import router as admin_router
 from routers.auth import router as auth_router
-from db import engine, Base 
+from routers.metrics import router as metrics_router, RequestMetricsMiddleware
+from db import engine, async_engine, Base 
 from contextlib import asynccontextmanager
 from scheduler.scheduler import start_scheduler
 import settings
 from services.seeding import seed_super_admin
+import migrations
+from services import cache, jobs, metrics, redis_client
+from services.utils import log
+
+log.configure() # level and format of the logs of this process (LOG_LEVEL, LOG_FORMAT)
 
 # for handling lifespan events
 @asynccontextmanager
 async def lifespan(app: FastAPI):
   # Startup code
+  metrics.clear_snapshots() # the job worker processes of the last run are gone
+  await redis_client.startup() # connection pools of the process, and a first health check
   start_scheduler()
+  jobs.resume_jobs() # jobs interrupted by the last shutdown continue from their last completed month
+  await cache.poll_invalidations(async_engine) # from here, the imports of the job workers drop the entries of the in-process LRU
+  invalidations = asyncio.create_task(cache.watch_invalidations(async_engine))
   yield
   # Shutdown code if there is any
+  invalidations.cancel()
+  jobs.shutdown()
+  await redis_client.shutdown()
+  await async_engine.dispose()
 
 # Initialize the app with the lifespan context manager
 app = FastAPI(lifespan=lifespan, debug=False, title="Open Insider Trades API", version="1.0.0", description="API for tracking and analyzing insider trades data")
@@ -27,7 +43,10 @@ app.add_middleware(
   allow_credentials=True, # Allow Credentials (Authorization headers, Cookies, etc) to be included in the requests
   allow_methods=["GET","POST","PUT","DELETE","OPTIONS"], # Specify the allowed HTTP methods
   allow_headers=["*"], # Specify the allowed headers 
+  expose_headers=["X-Next-Cursor", "X-Cache"], # Let browsers read the pagination cursor and the cache status
 )
+if settings.METRICS_ENABLED:
+  app.add_middleware(RequestMetricsMiddleware) # request count and latency per route, served at /metrics
 
 # When accessing through the root path, redirect the users to Swagger
 # should it be to interactive docs via Swagger UI (/docs) OR ReDoc (/redoc).
@@ -39,9 +58,13 @@ async def redirect_to_docs():
 app.include_router(transact_router, prefix="/insider_trades")
 app.include_router(admin_router, prefix="/admin")
 app.include_router(auth_router, prefix="/auth")
+if settings.METRICS_ENABLED:
+  app.include_router(metrics_router)
 
 # Create all the tables (if it doesn't already exist) defined in the Base class'metadata within the connected database 
 Base.metadata.create_all(bind=engine) 
+# Bring an existing database up to date (indexes added after the tables were created)
+migrations.upgrade(engine)
 # Create necessary seeds for the database
 seed_super_admin()
 
@@ -0,0 +1,170 @@
+import argparse, logging, os, time
+from sqlalchemy import Table, inspect, select
+from sqlalchemy.engine import Engine
+from models import transaction as model
+from models import aggregate as aggregate_model
+from models import job as job_model
+from services import aggregate
+from services.utils import loader, normalizer
+
+'''
+Schema upgrades of an existing database, safe to run on every startup.
+Base.metadata.create_all only creates missing tables: the columns and indexes added later to an existing table are created here.
+Also a command, to upgrade a database ahead of a deployment (a large one takes a while) and reclaim the space freed:
+  python -m migrations --vacuum
+'''
+
+logger = logging.getLogger(__name__)
+
+def dedupe_transactions(conn, table_name: str = model.TransactionFact.__tablename__) -> int:
+  '''
+  Keep the first imported row of each natural key (see models.transaction.NATURAL_KEY), so the unique index can be built.
+  Returns: the number of rows deleted
+  '''
+  key = ", ".join(model.NATURAL_KEY)
+  result = conn.exec_driver_sql(f"DELETE FROM {table_name} WHERE rowid NOT IN (SELECT MIN(rowid) FROM {table_name} GROUP BY {key})")
+  return result.rowcount
+
+def ensure_indexes(engine: Engine):
+  '''
+  Create the indexes declared on the TransactionFact model which are missing from the database.
+  '''
+  table = model.TransactionFact.__table__
+  existing = {index["name"] for index in inspect(engine).get_indexes(table.name)}
+  missing = [index for index in table.indexes if index.name not in existing]
+  if not missing:
+    return
+  with engine.begin() as conn:
+    for index in missing:
+      if index.unique:
+        deleted = dedupe_transactions(conn)
+        if deleted:
+          logger.info("Deleted duplicated transactions", extra={"rows": deleted, "index": index.name})
+      logger.info("Creating index", extra={"index": index.name})
+      index.create(bind=conn)
+    conn.exec_driver_sql("ANALYZE") # refresh the planner statistics for the new indexes
+
+# columns added to the filing lines since their table was created, and the SQL filling them from the existing columns
+ADDED_COLUMNS = {
+  "delta_owned_pct": """CASE
+    WHEN delta_owned GLOB '[+-][0-9]*%' OR delta_owned GLOB '[0-9]*%' THEN CAST(REPLACE(REPLACE(delta_owned, '+', ''), '%', '') AS REAL)
+    WHEN delta_owned GLOB '>[0-9]*%' THEN CAST(REPLACE(REPLACE(delta_owned, '>', ''), '%', '') AS REAL)
+  END""",
+  "delta_owned_flag": f"""CASE
+    WHEN delta_owned = '{normalizer.DELTA_OWNED_NEW}' THEN '{normalizer.FLAG_NEW}'
+    WHEN delta_owned GLOB '>[0-9]*%' THEN '{normalizer.FLAG_CAPPED}'
+  END""",
+}
+
+def ensure_columns(engine: Engine, table: Table = model.TransactionFact.__table__):
+  '''
+  Add the columns of a model (TransactionFact by default) which are missing from the database, filled from the existing
+  rows (see ADDED_COLUMNS) or left NULL.
+  '''
+  if not inspect(engine).has_table(table.name): # created whole by create_all
+    return
+  existing = {column["name"] for column in inspect(engine).get_columns(table.name)}
+  missing = [column for column in table.columns if column.name not in existing]
+  if not missing:
+    return
+  with engine.begin() as conn:
+    for column in missing:
+      logger.info("Adding column", extra={"column": column.name})
+      conn.exec_driver_sql(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(dialect=conn.dialect)}")
+      if column.name in ADDED_COLUMNS:
+        result = conn.exec_driver_sql(f"UPDATE {table.name} SET {column.name} = {ADDED_COLUMNS[column.name]}")
+        logger.info("Filled column", extra={"column": column.name, "rows": result.rowcount})
+
+LEGACY_TABLE = "transactions" # one wide row per filing line: UUID key, names as text, NUMERIC money; the name of the view now
+
+def compact_transactions(engine: Engine) -> int:
+  '''
+  Move the rows of the legacy transactions table to the compact layout of models/transaction.py, in one transaction:
+  the names go to the dimension tables, the lines to transaction_facts (in their import order, money in cents), then the
+  legacy table is dropped and its name is taken by the view (ensure_view). The ids of the lines change, so do the page cursors.
+  The indexes of transaction_facts are built afterwards, on the final rows (ensure_indexes).
+  The file only shrinks once vacuumed (python -m migrations --vacuum).
+  Returns: the number of rows moved, 0 if the database has no legacy table
+  '''
+  if LEGACY_TABLE not in inspect(engine).get_table_names():
+    return 0
+  facts = model.TransactionFact.__table__
+  legacy_columns = {column["name"] for column in inspect(engine).get_columns(LEGACY_TABLE)}
+  derived = {name: name if name in legacy_columns else sql for name, sql in ADDED_COLUMNS.items()}
+  started = time.perf_counter()
+  logger.info("Moving the transactions to the compact layout")
+  with engine.connect() as conn, loader.bulk_load_pragmas(conn):
+    if conn.execute(select(facts.c.id).limit(1)).first():
+      raise RuntimeError(f"Both the legacy {LEGACY_TABLE} table and rows in {facts.name}, remove one of them.")
+    for index in facts.indexes: # built on the final rows
+      conn.exec_driver_sql(f"DROP INDEX IF EXISTS {index.name}")
+    # the company name of a ticker is the one of its last imported line
+    conn.exec_driver_sql(f"""INSERT OR IGNORE INTO {model.Ticker.__tablename__} (ticker, company_name)
+      SELECT ticker, company_name FROM (SELECT ticker, company_name, MAX(rowid) FROM {LEGACY_TABLE} WHERE ticker IS NOT NULL GROUP BY ticker)""")
+    conn.exec_driver_sql(f"INSERT OR IGNORE INTO {model.Insider.__tablename__} (name) SELECT DISTINCT insider_name FROM {LEGACY_TABLE} WHERE insider_name IS NOT NULL")
+    conn.exec_driver_sql(f"INSERT OR IGNORE INTO {model.TradeType.__tablename__} (trade_type) SELECT DISTINCT trade_type FROM {LEGACY_TABLE} WHERE trade_type IS NOT NULL")
+    result = conn.exec_driver_sql(f"""INSERT INTO {facts.name} (x, filing_date, trade_date, ticker_id, insider_id, insider_title, trade_type_id,
+        price_cents, qty, owned, delta_owned, delta_owned_pct, delta_owned_flag, value_cents)
+      SELECT t.x, t.filing_date, t.trade_date, k.id, i.id, t.insider_title, tt.id,
+        CAST(ROUND(t.price * 100) AS INTEGER), t.qty, t.owned, t.delta_owned, {derived["delta_owned_pct"]}, {derived["delta_owned_flag"]},
+        CAST(ROUND(t.value * 100) AS INTEGER)
+      FROM {LEGACY_TABLE} t
+      LEFT JOIN {model.Ticker.__tablename__} k ON k.ticker = t.ticker
+      LEFT JOIN {model.Insider.__tablename__} i ON i.name = t.insider_name
+      LEFT JOIN {model.TradeType.__tablename__} tt ON tt.trade_type = t.trade_type
+      ORDER BY t.rowid""")
+    conn.exec_driver_sql(f"DROP TABLE {LEGACY_TABLE}")
+    conn.commit()
+  logger.info("Moved the transactions to the compact layout", extra={"rows": result.rowcount, "seconds": round(time.perf_counter() - started, 3)})
+  return result.rowcount
+
+def ensure_view(engine: Engine):
+  ''' Create the transactions view over the compact layout (models.transaction.TRANSACTIONS_VIEW) '''
+  with engine.begin() as conn:
+    conn.exec_driver_sql(model.TRANSACTIONS_VIEW)
+
+def ensure_aggregates(engine: Engine):
+  '''
+  Fill the aggregate tables (see services/aggregate.py) of a database which has transactions imported before they existed.
+  '''
+  for table in (aggregate.ticker_daily, aggregate.insider_daily):
+    table.create(bind=engine, checkfirst=True)
+  with engine.connect() as conn:
+    missing = conn.execute(select(model.Transaction.id).limit(1)).first() and not conn.execute(select(aggregate_model.TickerDailyStats.ticker).limit(1)).first()
+  if not missing:
+    return
+  logger.info("Building the aggregate tables")
+  with engine.begin() as conn:
+    aggregate.rebuild(conn)
+
+def upgrade(engine: Engine):
+  compact_transactions(engine)
+  ensure_columns(engine)
+  ensure_columns(engine, job_model.Job.__table__)
+  ensure_indexes(engine)
+  ensure_view(engine)
+  ensure_aggregates(engine)
+
+def main():
+  arg_parser = argparse.ArgumentParser(description="Upgrade the schema of the database of SQLALCHEMY_DATABASE_URL.")
+  arg_parser.add_argument("--vacuum", action="store_true", help="then rebuild the file, to give back the space freed (needs as much free disk space as the database)")
+  args = arg_parser.parse_args()
+  from db import Base, engine
+  from services.utils import log
+  log.configure()
+  path = engine.url.database
+  size = lambda: os.path.getsize(path) if path and os.path.exists(path) else None
+  before = size()
+  Base.metadata.create_all(bind=engine, tables=[table for table in Base.metadata.sorted_tables if table.name in (
+    model.Ticker.__tablename__, model.Insider.__tablename__, model.TradeType.__tablename__, model.TransactionFact.__tablename__,
+  )])
+  upgrade(engine)
+  if args.vacuum:
+    logger.info("Vacuuming the database")
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+      conn.exec_driver_sql("VACUUM")
+      conn.exec_driver_sql("PRAGMA wal_checkpoint(TRUNCATE)") # the rebuilt pages are in the WAL until checkpointed
+  logger.info("Upgraded the database", extra={"path": path, "bytes_before": before, "bytes_after": size()})
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,38 @@
+from db import Base
+from sqlalchemy import Column, Date, Float, Integer, String, Index
+
+'''
+Aggregates of the transactions table, kept up to date by every import (see services/aggregate.py).
+One row per ticker, trade date and trade type (and insider): the analytics endpoints read a few rows per day
+instead of every filing line. Monthly and windowed figures are sums over the daily rows.
+'''
+
+class TickerDailyStats(Base):
+  __tablename__ = 'ticker_daily_stats'
+  __table_args__ = (
+    # top tickers over a window: covering, the ranking reads the index alone
+    Index("ix_ticker_daily_stats_trade_date", "trade_date", "trade_type", "ticker", "trades", "qty", "value"),
+  )
+
+  ticker = Column(String(10), primary_key=True)
+  trade_date = Column(Date, primary_key=True)
+  trade_type = Column(String(20), primary_key=True)
+  company_name = Column(String)
+  trades = Column(Integer)
+  qty = Column(Integer)
+  value = Column(Float) # signed as on openinsider.com: purchases positive, sales negative
+
+class InsiderDailyStats(Base):
+  __tablename__ = 'insider_daily_stats'
+  __table_args__ = (
+    Index("ix_insider_daily_stats_trade_date", "trade_date", "trade_type", "ticker", "insider_name"), # distinct insiders over a window
+  )
+
+  ticker = Column(String(10), primary_key=True)
+  trade_date = Column(Date, primary_key=True)
+  trade_type = Column(String(20), primary_key=True)
+  insider_name = Column(String, primary_key=True)
+  insider_title = Column(String)
+  trades = Column(Integer)
+  qty = Column(Integer)
+  value = Column(Float)
@@ -0,0 +1,14 @@
+from db import Base
+from sqlalchemy import Column, DateTime, Integer, Text
+from datetime import datetime, UTC
+
+class CacheInvalidation(Base):
+  '''
+  Invalidations of the response cache by the imports, which run in the job worker processes: every API process reads
+  the new ones to drop the entries of its in-process LRU tier, which a worker cannot reach (see services/cache.py).
+  '''
+  __tablename__ = 'cache_invalidations'
+
+  id = Column(Integer, primary_key=True)
+  tags = Column(Text) # one tag per line, "*" for every entry
+  created_at = Column(DateTime, default=lambda: datetime.now(UTC))
@@ -0,0 +1,40 @@
+from db import Base
+from sqlalchemy import Boolean, Column, Date, DateTime, ForeignKey, Integer, String, Float, Text, Index
+from sqlalchemy.orm import relationship
+from datetime import datetime, UTC
+import uuid
+
+class Job(Base):
+  __tablename__ = 'jobs'
+
+  id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
+  kind = Column(String(20)) # values: bootstrap, refresh, daily_sync, export
+  start_year = Column(Integer)
+  as_of = Column(Date) # the day the job was submitted, its date ranges end there (the day scraped by a daily sync)
+  status = Column(String(20), default="queued") # values: queued, running, succeeded, failed, cancelled
+  cancel_requested = Column(Boolean, default=False)
+  pid = Column(Integer) # process owning the job (the API process which queued it, then its worker), to tell a job orphaned by a restart from a live one
+  error = Column(Text)
+  created_at = Column(DateTime, default=lambda: datetime.now(UTC))
+  started_at = Column(DateTime)
+  finished_at = Column(DateTime)
+
+  months = relationship("JobMonth", back_populates="job", order_by="JobMonth.start_date", cascade="all, delete-orphan")
+
+class JobMonth(Base):
+  __tablename__ = 'job_months'
+  __table_args__ = (
+    Index("uq_job_months_job_id_start_date", "job_id", "start_date", unique=True),
+  )
+
+  id = Column(Integer, primary_key=True)
+  job_id = Column(String, ForeignKey("jobs.id"))
+  start_date = Column(Date) # filing date range of the month
+  end_date = Column(Date)
+  status = Column(String(20), default="pending") # values: pending, skipped (already imported), loaded, empty, unchanged, failed, cancelled (see services.pipeline.MonthResult)
+  rows = Column(Integer, default=0)
+  seconds = Column(Float) # time spent in the fetch, parse, normalize and load stages
+  error = Column(Text)
+  finished_at = Column(DateTime)
+
+  job = relationship("Job", back_populates="months")
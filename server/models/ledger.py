@@ -0,0 +1,19 @@
+from db import Base
+from sqlalchemy import Column, Date, DateTime, Integer, String, Float, Text
+
+class IngestionLedger(Base):
+  '''
+  Last import of each scraped filing date range (a month, or a single day for the daily sync):
+  a bootstrap skips the ranges already imported which can no longer change (see services/ledger.py).
+  '''
+  __tablename__ = 'ingestion_ledger'
+
+  start_date = Column(Date, primary_key=True)
+  end_date = Column(Date, primary_key=True)
+  status = Column(String(20)) # values: loaded, empty, unchanged, failed (see services.pipeline.MonthResult)
+  rows = Column(Integer, default=0) # rows of the page when it was last loaded
+  content_hash = Column(String(64)) # sha256 of the parsed rows
+  fetched_at = Column(DateTime)
+  fetch_seconds = Column(Float)
+  loaded_at = Column(DateTime) # last time the rows were written (unchanged fetches leave it as is)
+  error = Column(Text)
@@ -1,21 +1,96 @@
 from db import Base
-from sqlalchemy import Column, Integer, String, Date, Numeric, TIMESTAMP
-import uuid
+from sqlalchemy import Column, Integer, String, Date, Float, TIMESTAMP, Index, MetaData, Table, DDL, event
 
-class Transaction(Base):
-  __tablename__ = 'transactions'
+'''
+Storage of the filing lines: one narrow row per line in transaction_facts, with an integer rowid key, integer ids of the
+tickers, insiders and trade types (dimension tables, each name stored once) and money in integer cents.
+The transactions view joins them back to the columns the API serves (see TRANSACTIONS_VIEW); the pages are read from
+transaction_facts first and join the names of their rows only (services.transaction.transactions_query).
+'''
+
+class Ticker(Base):
+  __tablename__ = 'tickers'
+
+  id = Column(Integer, primary_key=True)
+  ticker = Column(String(10), nullable=False, unique=True)
+  company_name = Column(String) # as on the last imported line of the ticker
+
+class Insider(Base):
+  __tablename__ = 'insiders'
+
+  id = Column(Integer, primary_key=True)
+  name = Column(String, nullable=False, unique=True)
+
+class TradeType(Base):
+  __tablename__ = 'trade_types'
 
-  id = Column(String, primary_key=True, index=True, default=lambda: str(uuid.uuid4()))
+  id = Column(Integer, primary_key=True) # the code stored on the lines, assigned on first import
+  trade_type = Column(String(20), nullable=False, unique=True)
+
+# columns identifying a filing line: re-importing the same line updates it instead of duplicating it
+# (SQLite treats NULLs as distinct in a unique index, so lines with a NULL in the key can't be deduplicated)
+NATURAL_KEY = ("ticker_id", "trade_date", "insider_id", "filing_date", "trade_type_id", "qty", "price_cents")
+
+class TransactionFact(Base):
+  __tablename__ = 'transaction_facts'
+  __table_args__ = (
+    Index("uq_transaction_facts_natural_key", *NATURAL_KEY, unique=True),
+    # one index per retrieve_transactions filter, SQLite appends the rowid (id) to every index entry:
+    # each one ends with the (trade_date, id) page key, so ORDER BY trade_date, id needs no sort and a page cursor is an index seek
+    Index("ix_transaction_facts_ticker_trade_date", "ticker_id", "trade_date"),
+    Index("ix_transaction_facts_trade_date", "trade_date"),
+    Index("ix_transaction_facts_trade_type_trade_date", "trade_type_id", "trade_date"),
+  )
+
+  id = Column(Integer, primary_key=True) # the rowid
   x = Column(String(1))
   filing_date = Column(TIMESTAMP)
   trade_date = Column(Date)
-  ticker = Column(String(10), index=True)
-  company_name = Column(String)
-  insider_name = Column(String)
+  ticker_id = Column(Integer) # tickers.id
+  insider_id = Column(Integer) # insiders.id
   insider_title = Column(String)
-  trade_type = Column(String(20))
-  price = Column(Numeric(10, 2))
+  trade_type_id = Column(Integer) # trade_types.id
+  price_cents = Column(Integer)
   qty = Column(Integer)
   owned = Column(Integer)
-  delta_owned = Column(String(20))
-  value = Column(Numeric(15, 2))
\ No newline at end of file
+  delta_owned = Column(String(20)) # as scraped: "+5%", "-100%", ">999%", "New"
+  delta_owned_pct = Column(Float) # delta_owned as a number, NULL for "New"
+  delta_owned_flag = Column(String(8)) # "new", "capped" (">999%": delta_owned_pct is a lower bound) or NULL
+  value_cents = Column(Integer)
+
+# the filing lines as the API serves them; the LEFT JOINs keep the lines without ticker, insider or trade type,
+# and a filter on a name (ticker = ?) turns into a seek of its dimension, then of the index of its id
+TRANSACTIONS_VIEW = f"""CREATE VIEW IF NOT EXISTS transactions AS
+SELECT f.id AS id, f.x AS x, f.filing_date AS filing_date, f.trade_date AS trade_date,
+  k.ticker AS ticker, k.company_name AS company_name, i.name AS insider_name, f.insider_title AS insider_title,
+  tt.trade_type AS trade_type, f.price_cents / 100.0 AS price, f.qty AS qty, f.owned AS owned,
+  f.delta_owned AS delta_owned, f.delta_owned_pct AS delta_owned_pct, f.delta_owned_flag AS delta_owned_flag,
+  f.value_cents / 100.0 AS value
+FROM {TransactionFact.__tablename__} f
+LEFT JOIN {Ticker.__tablename__} k ON k.id = f.ticker_id
+LEFT JOIN {Insider.__tablename__} i ON i.id = f.insider_id
+LEFT JOIN {TradeType.__tablename__} tt ON tt.id = f.trade_type_id"""
+# created with the table by create_all (a no-op while a legacy transactions table exists, see migrations.compact_transactions)
+event.listen(TransactionFact.__table__, "after_create", DDL(TRANSACTIONS_VIEW))
+
+class Transaction(Base):
+  # the transactions view, read only: in a MetaData of its own so create_all does not create it as a table
+  __table__ = Table(
+    'transactions', MetaData(),
+    Column("id", Integer, primary_key=True),
+    Column("x", String(1)),
+    Column("filing_date", TIMESTAMP),
+    Column("trade_date", Date),
+    Column("ticker", String(10)),
+    Column("company_name", String),
+    Column("insider_name", String),
+    Column("insider_title", String),
+    Column("trade_type", String(20)),
+    Column("price", Float),
+    Column("qty", Integer),
+    Column("owned", Integer),
+    Column("delta_owned", String(20)),
+    Column("delta_owned_pct", Float),
+    Column("delta_owned_flag", String(8)),
+    Column("value", Float),
+  )
@@ -1,52 +1,129 @@
 from fastapi import APIRouter, Depends, Security
+from fastapi.responses import FileResponse
+from fastapi.concurrency import run_in_threadpool
 from schemas import transaction as schema
 from schemas import auth as authSchema
-from services import transaction as transact_mgr
 from services import auth as auth_mgr
-from sqlalchemy.orm import Session 
-from db import get_db
+from services import cache, jobs, export, redis_client
+from sqlalchemy.ext.asyncio import AsyncSession
+from db import get_async_db, AsyncSessionLocal
 from datetime import datetime
+import logging
 import routers.utils.exceptions as exceptions
 from routers.auth import get_current_client
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
 
 @router.get("/generate_client_id", response_model=authSchema.ClientCreate, tags=["Admin"])# admin api endpoint
-async def generate_client_id(current_user: authSchema.Client = Security(get_current_client, scopes=["admin"]),db: Session = Depends(get_db)):
+async def generate_client_id(current_user: authSchema.Client = Security(get_current_client, scopes=["admin"]),db: AsyncSession = Depends(get_async_db)):
   try:
-    client_id = auth_mgr.generate_client_id(db)
+    client_id = await auth_mgr.generate_client_id_async(db)
     return client_id
-  except Exception as e:
-    print(e)
+  except Exception:
+    logger.exception("Admin request failed")
     raise exceptions.internal_server_exception(detail="A generic error occurred on the server.")
 
+@router.post("/deactivate_client/{client_id}", response_model=authSchema.Client, tags=["Admin"]) # admin api endpoint
+async def deactivate_client(client_id: str, current_user: authSchema.Client = Security(get_current_client, scopes=["admin"]), db: AsyncSession = Depends(get_async_db)):
+  ''' Refuse the client's logins and tokens from now on (its cached tokens are dropped) '''
+  if client_id == current_user.client_id:
+    raise exceptions.bad_request_exception("A client cannot deactivate itself.")
+  client = await auth_mgr.set_client_active_async(db, client_id, False)
+  if client is None:
+    raise exceptions.not_found_exception("Client not found.")
+  return client
+
 @router.get("/bootstrap", tags=["Admin"]) # admin api endpoint
-async def bootstrap(current_user: authSchema.Client = Security(get_current_client, scopes=["admin"]),data_params: schema.DataParams = Depends(), db: Session = Depends(get_db)):
+async def bootstrap(current_user: authSchema.Client = Security(get_current_client, scopes=["admin"]),data_params: schema.DataParams = Depends(), db: AsyncSession = Depends(get_async_db)):
+  '''
+  Queue a bootstrap job from start_year and return it at once, its progress is at GET /admin/jobs/{id}
+  The months already imported are skipped, unless force is set (refresh job)
+  '''
   try:
-    start_year = data_params.start_year  # Extract the start_year from the validated Pydantic model
-    transact_mgr.force_refresh(db, data_params.start_year) # Call the force_refresh function
-  except Exception as e:
+    job = await jobs.submit_job(db, "refresh" if data_params.force else "bootstrap", data_params.start_year)
+    return jobs.job_summary(job)
+  except ValueError as e: # start_year in the future
+    raise exceptions.bad_request_exception(str(e))
+  except Exception:
+    logger.exception("Admin request failed")
     raise exceptions.internal_server_exception(detail="A generic error occurred on the server.")
 
-@router.get("/daily_sync", tags=["Admin"]) # admin api endpoint (for testing purpose)
-async def daily_sync(db: Session = Depends(get_db)):
-  print(f"Running daily sync at {datetime.now()}")
+@router.get("/jobs", tags=["Admin"]) # admin api endpoint
+async def list_jobs(current_user: authSchema.Client = Security(get_current_client, scopes=["admin"]), db: AsyncSession = Depends(get_async_db)):
+  return [jobs.job_summary(job) for job in await jobs.list_jobs(db)]
+
+@router.get("/jobs/{job_id}", tags=["Admin"]) # admin api endpoint
+async def get_job(job_id: str, current_user: authSchema.Client = Security(get_current_client, scopes=["admin"]), db: AsyncSession = Depends(get_async_db)):
+  '''
+  Status of a job: per-month progress, rows ingested, throughput and errors
+  '''
+  job = await jobs.get_job(db, job_id)
+  if job is None:
+    raise exceptions.not_found_exception("Job not found.")
+  return jobs.job_summary(job)
+
+@router.post("/jobs/{job_id}/cancel", tags=["Admin"]) # admin api endpoint
+async def cancel_job(job_id: str, current_user: authSchema.Client = Security(get_current_client, scopes=["admin"]), db: AsyncSession = Depends(get_async_db)):
+  '''
+  Cancel a job: a queued job never starts, a running one stops before its next month
+  '''
+  job = await jobs.cancel_job(db, job_id)
+  if job is None:
+    raise exceptions.not_found_exception("Job not found.")
+  return jobs.job_summary(job)
+
+@router.get("/cache_stats", tags=["Admin"]) # admin api endpoint
+async def cache_stats(current_user: authSchema.Client = Security(get_current_client, scopes=["admin"])):
+  return cache.stats.summary() # counters of this worker process
+
+@router.get("/redis_stats", tags=["Admin"]) # admin api endpoint
+async def redis_stats(current_user: authSchema.Client = Security(get_current_client, scopes=["admin"])):
+  return redis_client.summary() # circuit breaker, round trips and connection pools of this worker process
+
+@router.post("/export", tags=["Admin"]) # admin api endpoint
+async def export_all(current_user: authSchema.Client = Security(get_current_client, scopes=["admin"]), db: AsyncSession = Depends(get_async_db)):
+  '''
+  Queue a job rewriting the whole Parquet export (with EXPORT_ENABLED, the ingestion jobs keep the months they touch up to date)
+  '''
+  return jobs.job_summary(await jobs.submit_job(db, "export", None))
+
+@router.get("/export", tags=["Admin"]) # admin api endpoint
+async def list_export(current_user: authSchema.Client = Security(get_current_client, scopes=["admin"])):
+  '''
+  Exported months (rows, bytes, last update), each one downloadable from /admin/export/{year}/{month}
+  '''
+  return await run_in_threadpool(export.list_partitions) # reads the footer of every file
+
+@router.get("/export/{year}/{month}", tags=["Admin"]) # admin api endpoint
+async def download_export(year: int, month: int, current_user: authSchema.Client = Security(get_current_client, scopes=["admin"])):
+  '''
+  Parquet file of the transactions traded in a month, streamed from disk (Range requests supported)
+  '''
+  path = export.find_partition(year, month) if 1 <= month <= 12 else None
+  if path is None:
+    raise exceptions.not_found_exception("No export for this month.")
+  return FileResponse(path, media_type="application/vnd.apache.parquet", filename=f"transactions_{year:04d}_{month:02d}.parquet")
+
+@router.get("/daily_sync", tags=["Admin"]) # admin api endpoint
+async def daily_sync(current_user: authSchema.Client = Security(get_current_client, scopes=["admin"]), db: AsyncSession = Depends(get_async_db)):
+  '''
+  Queue a daily sync job now (it also runs every day at DAILY_SYNC_HOUR) and return it at once, its progress is at GET /admin/jobs/{id}
+  '''
+  logger.info("Running daily sync")
   try:
     current_year = datetime.now().year # Get the current year
-    transact_mgr.bootstrap_data(db, current_year, True) # Call the bootstrap_data function
-  except Exception as e:
+    job = await jobs.submit_job(db, "daily_sync", current_year)
+    return jobs.job_summary(job)
+  except Exception:
+    logger.exception("Admin request failed")
     raise exceptions.internal_server_exception(detail="A generic error occurred on the server.")
   
 async def daily_sync_schedule():
-  print(f"Running daily sync at {datetime.now()}")
-  db = next(get_db()) # Start running the get_db() generator until it yields something, and give me that yielded value.
-  try:
-    current_year = datetime.now().year # Get the current year
-    transact_mgr.bootstrap_data(db, current_year, True) # Call the bootstrap_data function
-  except Exception as e:
-    raise exceptions.internal_server_exception(detail="A generic error occurred on the server.")
-  finally:
-    db.close() # we manually close the DB session since we created it outside of a request context
-  
-  
-
+  logger.info("Running daily sync")
+  async with AsyncSessionLocal() as db: # created outside of a request context
+    try:
+      current_year = datetime.now().year # Get the current year
+      await jobs.submit_job(db, "daily_sync", current_year) # runs in a worker process, not on the event loop of the app
+    except Exception as e:
+      logger.error("Failed to queue the daily sync", extra={"error": str(e)})
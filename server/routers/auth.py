@@ -2,17 +2,17 @@ from fastapi import APIRouter, Response, Header, Cookie, Depends
 from fastapi.security import OAuth2PasswordRequestForm, SecurityScopes
 from schemas import auth as auth_schema
 from services import auth as auth_mgr
+from services import principal
 from typing import Annotated
 from routers.utils import exceptions
 import settings
-from sqlalchemy.orm import Session
-from db import get_db
+from sqlalchemy.ext.asyncio import AsyncSession
+from db import get_async_db
 
 router = APIRouter()
-refresh_tokens_store = {}  # {refresh_token: user_id} -- in-memory store for refresh tokens, but it should be cached in redis
 
 @router.post("/token", response_model=auth_schema.Token, tags=["auth"], include_in_schema=False) # return bearer token
-async def login(form_data: Annotated[OAuth2PasswordRequestForm, Depends()], response: Response, db: Session=Depends(get_db)) -> auth_schema.Token:
+async def login(form_data: Annotated[OAuth2PasswordRequestForm, Depends()], response: Response, db: AsyncSession=Depends(get_async_db)) -> auth_schema.Token:
   '''
   this function will be called for authentication, when the user login with username and password
   the username and password will be passed to the form_data
@@ -20,7 +20,7 @@ async def login(form_data: Annotated[OAuth2PasswordRequestForm, Depends()], resp
   if the username and password are correct, return the access token
   if the username and password are incorrect, raise an exception
   '''
-  user = auth_mgr.authenticate_client(db, form_data.username, form_data.password)
+  user = await auth_mgr.authenticate_client_async(db, form_data.username, form_data.password)
   if not user:
       raise exceptions.auth_exception("Incorrect username or password")
   scopes = ["read", "write", "admin"] if user.role == "super_admin" else ["read"]
@@ -30,7 +30,7 @@ async def login(form_data: Annotated[OAuth2PasswordRequestForm, Depends()], resp
   # Set the new csrf token as a NonHttpOnly, Secure cookie
   set_csrf_token_cookie(user, response)
   # Set the new refresh token as an HttpOnly, Secure cookie
-  set_refresh_token_cookie(user, response, refresh_token)
+  await set_refresh_token_cookie(user, response)
   # return access token and token type
   return auth_schema.Token(access_token=access_token, token_type="bearer") 
 
@@ -38,21 +38,20 @@ async def login(form_data: Annotated[OAuth2PasswordRequestForm, Depends()], resp
 # refresh_token = request.cookies.get("refresh_token")  # Get the refresh token from the cookie
 async def refresh_token(
   response: Response, 
-  db: Session=Depends(get_db),
+  db: AsyncSession=Depends(get_async_db),
   refresh_token: str = Cookie(None),
   csrf_cookie: str = Cookie(None, alias="csrf_token"),
   csrf_header: str = Header(None, alias="X-CSRF-TOKEN")
   ) -> auth_schema.Token:
 
-  # print(f"csrf_cookie: {csrf_cookie}, csrf_header: {csrf_header}, refresh_token: {refresh_token}")
   if not csrf_cookie or not csrf_header or csrf_cookie != csrf_header:
     raise exceptions.forbidden_exception("CSRF token mismatch")
   
-  user_id = refresh_tokens_store.get(refresh_token)
+  user_id = await auth_mgr.consume_refresh_token_async(refresh_token) if refresh_token else None # single use
   if not user_id:
     raise exceptions.auth_exception("Invalid refresh token.")
   
-  user = auth_mgr.get_client_by_id(db, user_id)
+  user = await auth_mgr.get_client_by_id_async(db, user_id)
   if not user:
     raise exceptions.auth_exception("User not found with the provided refresh token.")
   scopes = ["read", "write", "admin"] if user.role == "super_admin" else ["read"]
@@ -61,15 +60,14 @@ async def refresh_token(
   # Set the new csrf token as a NonHttpOnly, Secure cookie
   set_csrf_token_cookie(user, response)
   # Set the new refresh token as an HttpOnly, Secure cookie
-  del refresh_tokens_store[refresh_token]
-  set_refresh_token_cookie(user, response, refresh_token)
+  await set_refresh_token_cookie(user, response)
   # return access token and token type
   return auth_schema.Token(access_token=access_token, token_type="bearer") 
 
 @router.post("/logout", include_in_schema=True) 
 async def logout(token: str = Depends(auth_mgr.oauth2_scheme)):
     # revoke the token access (it will expire by default in 30 mins anyway)
-    auth_mgr.revoke_access_token(token)
+    await auth_mgr.revoke_access_token_async(token)
 
 def set_csrf_token_cookie(user, response: Response):
     csrf_token = auth_mgr.create_token()  # Generate a new CSRF token
@@ -84,36 +82,42 @@ def set_csrf_token_cookie(user, response: Response):
         samesite="None"
     )
 
-def set_refresh_token_cookie(user, response: Response, refresh_token: str):
-  refresh_token = auth_mgr.create_token()
-  refresh_tokens_store[refresh_token] = user.client_id  # Store the refresh token in memory (or use a more persistent store like Redis)
+async def set_refresh_token_cookie(user, response: Response):
+  refresh_token = await auth_mgr.create_refresh_token_async(user.client_id)  # Stored in the token-state backend until it expires or is used
   response.set_cookie(
       key="refresh_token",
       value=refresh_token,
-      max_age=7 * 24 * 60 * 60,  # 7 days
+      max_age=int(settings.REFRESH_TOKEN_EXPIRE_DAYS * 24 * 60 * 60),
       path="/",  # Set the path to root so it is sent with every request
       secure=settings.COOKIE_SECURE,
       httponly=True,
       samesite="None"
   )
 
-async def get_current_client(security_scopes: SecurityScopes, token: Annotated[str, Depends(auth_mgr.oauth2_scheme)], db: Session = Depends(get_db)):
+async def get_current_client(security_scopes: SecurityScopes, token: Annotated[str, Depends(auth_mgr.oauth2_scheme)], db: AsyncSession = Depends(get_async_db)):
     '''
     this function will be called for authorization, similar to @app.get("/protected")
     but this is faciliated with FastAPI: Depends(get_current_client)
     oath2_scheme is used to get the Bearer token from the request header
     if the token is invalid, missing or the user is not found, throw an exception
     '''
-    token_data = auth_mgr.decode_access_token(token) # get the token data
-    if token_data is None:
-        raise exceptions.auth_exception("Token has expired.", headers={"WWW-Authenticate": f'Bearer scope="{security_scopes.scope_str}"'})
-    
+    # a token verified by an earlier request is served from the principal cache (no JWT verification, no client lookup)
+    cached = await principal.get_async(token)
+    if cached is not None:
+        client, token_scopes = cached
+    else:
+        token_data = auth_mgr.decode_access_token(token) # get the token data
+        if token_data is None or await auth_mgr.is_access_token_revoked_async(token):
+            raise exceptions.auth_exception("Token has expired.", headers={"WWW-Authenticate": f'Bearer scope="{security_scopes.scope_str}"'})
+        # get the client_id from the token sub data if authorization is successful
+        client = await auth_mgr.get_client_by_id_async(db, client_id=token_data.sub) # {"sub": client_id}
+        if client is None or not client.is_active:
+            raise exceptions.auth_exception()
+        token_scopes = token_data.scopes or []
+        if not await principal.put_async(token, client, token_scopes, token_data.exp): # revoked while it was verified
+            raise exceptions.auth_exception("Token has expired.", headers={"WWW-Authenticate": f'Bearer scope="{security_scopes.scope_str}"'})
+
     for scope in security_scopes.scopes:
-        if scope not in token_data.scopes:
+        if scope not in token_scopes:
             raise exceptions.forbidden_exception("Not enough permissions", headers={"WWW-Authenticate": f'Bearer scope="{security_scopes.scope_str}"'})
-
-    # get the client_id from the token sub data if authorization is successful
-    client = auth_mgr.get_client_by_id(db, client_id=token_data.sub) # {"sub": client_id}
-    if client is None:
-        raise exceptions.auth_exception
     return client # client_id, is_active, role
@@ -0,0 +1,48 @@
+import logging
+from time import perf_counter
+from fastapi import APIRouter
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import PlainTextResponse
+from services import metrics
+
+router = APIRouter()
+logger = logging.getLogger(__name__)
+
+REQUESTS = metrics.Counter("http_requests_total", "HTTP requests, by route, method and status", ["route", "method", "status"])
+REQUEST_SECONDS = metrics.Histogram("http_request_duration_seconds", "Time to serve an HTTP request (streamed body included), by route and method", ["route", "method"])
+
+class RequestMetricsMiddleware:
+  '''
+  ASGI middleware timing every HTTP request, labelled by the template of its route (/insider_trades/{ticker_id}) rather than
+  its path, so the number of series stays bounded; the requests matching no route share the "unmatched" label.
+  A plain ASGI middleware: no extra task nor response wrapping per request, and a streamed body is timed to its last chunk.
+  '''
+  def __init__(self, app):
+    self.app = app
+
+  async def __call__(self, scope, receive, send):
+    if scope["type"] != "http":
+      await self.app(scope, receive, send)
+      return
+    started = perf_counter()
+    status = 500 # unless the app sends a response
+    async def send_status(message):
+      nonlocal status
+      if message["type"] == "http.response.start":
+        status = message["status"]
+      await send(message)
+    try:
+      await self.app(scope, receive, send_status)
+    finally:
+      seconds = perf_counter() - started
+      route = scope.get("route") # set by the router on a match
+      path = route.path if route is not None else "unmatched"
+      REQUESTS.labels(path, scope["method"], str(status)).inc()
+      REQUEST_SECONDS.labels(path, scope["method"]).observe(seconds)
+      if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Request", extra={"method": scope["method"], "route": path, "status": status, "ms": round(seconds * 1000, 2)})
+
+@router.get("/metrics", include_in_schema=False)
+async def get_metrics():
+  ''' Prometheus scrape endpoint: the metrics of this process and of the job workers (services/metrics.py) '''
+  return PlainTextResponse(await run_in_threadpool(metrics.render), media_type="text/plain; version=0.0.4; charset=utf-8")
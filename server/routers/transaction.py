@@ -1,87 +1,200 @@
-import redis
+import redis.asyncio
+import settings
 from services import redis_client 
-from fastapi import APIRouter, Depends, Security
+from fastapi import APIRouter, Depends, Security, Response
+from fastapi.responses import StreamingResponse
 from schemas import transaction as tranact_schema
+from schemas import aggregate as aggregate_schema
 from schemas import auth as authSchema
 from services import transaction as transact_mgr
 from services import rate_limiter as rate_limiter
-from sqlalchemy.orm import Session 
-from db import get_db
+from sqlalchemy.ext.asyncio import AsyncSession
+from db import get_async_db
 from routers.auth import get_current_client
 from routers.utils import exceptions
 
 router = APIRouter()
 
+def page_response(body: str, next_cursor: str, cache_hit: bool) -> Response:
+  # the body is already serialized (and validated against the response_model) by transact_mgr.retrieve_page_async
+  headers = {"X-Cache": "HIT" if cache_hit else "MISS"}
+  if next_cursor:
+    headers["X-Next-Cursor"] = next_cursor
+  return Response(content=body, media_type="application/json", headers=headers)
+
+# the response headers of a page, declared for the OpenAPI docs: the body stays a plain list of transactions
+PAGE_HEADERS = {
+  "X-Next-Cursor": {"description": "cursor of the next page, pass it as the cursor parameter (absent on the last page)", "schema": {"type": "string"}},
+  "X-Cache": {"description": "HIT when the page was served from the response cache, MISS otherwise", "schema": {"type": "string", "enum": ["HIT", "MISS"]}},
+}
+PAGE_RESPONSES = {200: {"headers": PAGE_HEADERS}}
+
+STREAM_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+async def stream_response(db: AsyncSession, ticker_id: str, params) -> StreamingResponse:
+  # format=ndjson|csv: every row after the cursor, not cached; the errors are raised before the first byte is sent
+  try:
+    query = transact_mgr.transactions_query(ticker_id, params.from_date, params.to_date, params.transaction_type, params.cursor)
+  except ValueError as e: # malformed cursor
+    raise exceptions.bad_request_exception(str(e))
+  if ticker_id and not await transact_mgr.retrieve_by_ticker_async(db, ticker_id):
+    raise exceptions.not_found_exception("No data found, symbol may be delisted.")
+  return StreamingResponse(
+    transact_mgr.stream_transactions_async(query, params.format.value),
+    media_type=STREAM_MEDIA_TYPES[params.format.value],
+  )
+
+'''
+Rank the tickers by insider activity over a window
+params: by (value, qty, trades or insiders), window (e.g. 30d, 12w, 6m, 1y) ending on to_date (default: today), transaction_type, limit
+response: list of tickers with their trades, qty, net and gross value and distinct insiders, best first
+permission: read
+dependencies: get_current_client, get_async_db, get_async_redis_client
+note: declared before /{ticker_id}, which would match /top otherwise; served from the aggregate tables and the response cache
+'''
+@router.get("/top", response_model=list[aggregate_schema.TopTicker])
+async def retrieve_top(
+  params: aggregate_schema.TopParams = Depends(),
+  current_user: authSchema.Client = Security(get_current_client, scopes=["read"]),
+  db: AsyncSession=Depends(get_async_db),
+  redis_client: redis.asyncio.Redis = Depends(redis_client.get_async_redis_client)
+  ):
+
+  # rate limit validation
+  try:
+    await rate_limiter.validate_rate_limit_async(current_user, redis_client)
+  except rate_limiter.RateLimitExceededException as e:
+    raise exceptions.too_many_requests_exception("Rate limit exceeded. Please try again later.", e.retry_after)
+
+  if not 1 <= params.limit <= settings.MAX_PAGE_SIZE:
+    raise exceptions.bad_request_exception(f"limit must be between 1 and {settings.MAX_PAGE_SIZE}.")
+  try:
+    body, cache_hit = await transact_mgr.retrieve_top_async(db, params.by.value, params.window, params.to_date, params.transaction_type, params.limit)
+  except ValueError as e: # malformed window
+    raise exceptions.bad_request_exception(str(e))
+  return page_response(body, None, cache_hit)
+
 '''
 Retrieve insider transactions by ticker
-params: from_date, to_date, transaction_type
-response: list of transactions
+params: from_date, to_date, transaction_type, cursor, limit, format
+response: list of transactions, most recent first; the X-Next-Cursor header holds the cursor of the next page (absent on the last page)
+  format=ndjson or csv streams every transaction after the cursor instead (one line each, limit ignored)
 permission: read
-dependencies: get_current_client, get_db, get_redis_client
+dependencies: get_current_client, get_async_db, get_async_redis_client
+cache: served from the response cache (X-Cache: HIT or MISS) until an import changes the page
 '''
-@router.get("/{ticker_id}", response_model=list[tranact_schema.Transaction]) 
+@router.get("/{ticker_id}", response_model=list[tranact_schema.Transaction], responses=PAGE_RESPONSES)
 async def retrieve_by_ticker(ticker_id: str,
   params: tranact_schema.TransactionParams = Depends(), 
   current_user: authSchema.Client = Security(get_current_client, scopes=["read"]), 
-  db: Session=Depends(get_db),
-  redis_client: redis.Redis = Depends(redis_client.get_redis_client)
+  db: AsyncSession=Depends(get_async_db),
+  redis_client: redis.asyncio.Redis = Depends(redis_client.get_async_redis_client)
   ):
 
   # rate limit validation
   try:
-    rate_limiter.validate_rate_limit(current_user, db, redis_client)
-  except rate_limiter.RateLimitExceededException:
-    raise exceptions.too_many_requests_exception("Rate limit exceeded. Please try again later.")
+    await rate_limiter.validate_rate_limit_async(current_user, redis_client)
+  except rate_limiter.RateLimitExceededException as e:
+    raise exceptions.too_many_requests_exception("Rate limit exceeded. Please try again later.", e.retry_after)
 
   # from_date and to_date check
   if params.from_date and params.to_date and params.from_date  > params.to_date : 
     raise exceptions.bad_request_exception("from_date cannot be after to_date.")
+  if not 1 <= params.limit <= settings.MAX_PAGE_SIZE:
+    raise exceptions.bad_request_exception(f"limit must be between 1 and {settings.MAX_PAGE_SIZE}.")
 
-  # the ticker input validation
   ticker_id = ticker_id.upper()
-  existing_ticker = transact_mgr.retrieve_by_ticker(db, ticker_id)
-  if not existing_ticker:
+  if params.format != tranact_schema.ResponseFormat.json:
+    return await stream_response(db, ticker_id, params)
+
+  # the ticker input validation happens in retrieve_page, only when the page is empty
+  try:
+    page = await transact_mgr.retrieve_page_async(
+      db, 
+      ticker_id,
+      params.from_date,
+      params.to_date,
+      params.transaction_type,
+      params.cursor,
+      params.limit
+    )
+  except ValueError as e: # malformed cursor
+    raise exceptions.bad_request_exception(str(e))
+  if page is None:
     raise exceptions.not_found_exception("No data found, symbol may be delisted.")
-  
-  transactions = transact_mgr.retrieve_transactions(
-    db, 
-    ticker_id,
-    params.from_date,
-    params.to_date,
-    params.transaction_type
-  )
-  return transactions or []
+  return page_response(*page)
 
 '''
 Retrieve insider transactions by date range
-params: from_date, to_date, transaction_type
-response: list of transactions
+params: from_date, to_date, transaction_type, cursor, limit, format
+response: list of transactions, most recent first; the X-Next-Cursor header holds the cursor of the next page (absent on the last page)
+  format=ndjson or csv streams every transaction after the cursor instead (one line each, limit ignored)
 permission: read
-dependencies: get_current_client, get_db, get_redis_client
+dependencies: get_current_client, get_async_db, get_async_redis_client
+cache: served from the response cache (X-Cache: HIT or MISS) until an import changes the page
 '''
-@router.get("", response_model=list[tranact_schema.Transaction]) 
+@router.get("", response_model=list[tranact_schema.Transaction], responses=PAGE_RESPONSES)
 async def retrieve_by_date_range(
   params: tranact_schema.TransactionDateRange = Depends(), 
   current_user: authSchema.Client = Security(get_current_client, scopes=["read"]), 
-  db: Session=Depends(get_db),
-  redis_client: redis.Redis = Depends(redis_client.get_redis_client)
+  db: AsyncSession=Depends(get_async_db),
+  redis_client: redis.asyncio.Redis = Depends(redis_client.get_async_redis_client)
   ):
 
   # rate limit validation
   try:
-    rate_limiter.validate_rate_limit(current_user, db, redis_client)
-  except rate_limiter.RateLimitExceededException:
-    raise exceptions.too_many_requests_exception("Rate limit exceeded. Please try again later.")
+    await rate_limiter.validate_rate_limit_async(current_user, redis_client)
+  except rate_limiter.RateLimitExceededException as e:
+    raise exceptions.too_many_requests_exception("Rate limit exceeded. Please try again later.", e.retry_after)
   
   # from_date and to_date check
   if params.from_date and params.to_date and params.from_date  > params.to_date : 
     raise exceptions.bad_request_exception("from_date cannot be after to_date.")
+  if not 1 <= params.limit <= settings.MAX_PAGE_SIZE:
+    raise exceptions.bad_request_exception(f"limit must be between 1 and {settings.MAX_PAGE_SIZE}.")
+  if params.format != tranact_schema.ResponseFormat.json:
+    return await stream_response(db, "", params)
 
-  transactions = transact_mgr.retrieve_transactions(
-    db, 
-    "",
-    params.from_date,
-    params.to_date,
-    params.transaction_type
-  )
-  return transactions or []
+  try:
+    page = await transact_mgr.retrieve_page_async(
+      db, 
+      "",
+      params.from_date,
+      params.to_date,
+      params.transaction_type,
+      params.cursor,
+      params.limit
+    )
+  except ValueError as e: # malformed cursor
+    raise exceptions.bad_request_exception(str(e))
+  return page_response(*page)
+
+'''
+Summarize the insider activity of a ticker
+params: from_date, to_date (default: all its history)
+response: trades, distinct insiders, buyers and sellers, buy, sell and net value, per trade type, per month and top insiders
+permission: read
+dependencies: get_current_client, get_async_db, get_async_redis_client
+note: served from the aggregate tables and the response cache, dropped by the imports of the ticker
+'''
+@router.get("/{ticker_id}/summary", response_model=aggregate_schema.TickerSummary)
+async def retrieve_summary(ticker_id: str,
+  params: aggregate_schema.SummaryParams = Depends(),
+  current_user: authSchema.Client = Security(get_current_client, scopes=["read"]),
+  db: AsyncSession=Depends(get_async_db),
+  redis_client: redis.asyncio.Redis = Depends(redis_client.get_async_redis_client)
+  ):
+
+  # rate limit validation
+  try:
+    await rate_limiter.validate_rate_limit_async(current_user, redis_client)
+  except rate_limiter.RateLimitExceededException as e:
+    raise exceptions.too_many_requests_exception("Rate limit exceeded. Please try again later.", e.retry_after)
+
+  if params.from_date and params.to_date and params.from_date > params.to_date:
+    raise exceptions.bad_request_exception("from_date cannot be after to_date.")
+  summary = await transact_mgr.retrieve_summary_async(db, ticker_id.upper(), params.from_date, params.to_date)
+  if summary is None:
+    raise exceptions.not_found_exception("No data found, symbol may be delisted.")
+  body, cache_hit = summary
+  return page_response(body, None, cache_hit)
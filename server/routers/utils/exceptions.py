@@ -1,4 +1,5 @@
 from fastapi import HTTPException, status
+import math
 
 def bad_request_exception(detail="Malformed request"):
   return HTTPException(
@@ -14,10 +15,11 @@ def auth_exception(detail="Could not validate credentials",headers=None):
       headers=headers if headers else {"WWW-Authenticate": "Bearer"},
   )
 
-def forbidden_exception(detail="You do not have permission to access this resource"):
+def forbidden_exception(detail="You do not have permission to access this resource", headers=None):
   return HTTPException(
     status_code=status.HTTP_403_FORBIDDEN,
-    detail=detail
+    detail=detail,
+    headers=headers,
   )
 
 def not_found_exception(detail="Item not found"):
@@ -32,10 +34,11 @@ def teapot_exception(detail="I'm just a teapot"):
       detail=detail
   )
 
-def too_many_requests_exception(detail="Too many requests, try again later"):
+def too_many_requests_exception(detail="Too many requests, try again later", retry_after=None):
     return HTTPException(
         status_code=status.HTTP_429_TOO_MANY_REQUESTS,
-        detail=detail
+        detail=detail,
+        headers={"Retry-After": str(math.ceil(retry_after))} if retry_after else None,
     )
 
 def internal_server_exception(detail="Internal server error"):
@@ -0,0 +1,65 @@
+from typing import Optional
+from pydantic import BaseModel
+from datetime import date
+from enum import Enum
+from schemas.transaction import TransactionType
+
+class TopBy(Enum):
+  value = "value" # traded value, buys and sales alike
+  qty = "qty"
+  trades = "trades"
+  insiders = "insiders" # distinct insiders, e.g. cluster buys with transaction_type P
+
+class SummaryParams(BaseModel):
+  from_date: Optional[date] = None
+  to_date: Optional[date] = None
+
+class TopParams(BaseModel):
+  by: TopBy = TopBy.value
+  window: str = "30d" # days, weeks, months or years ending on to_date: 30d, 12w, 6m, 1y
+  to_date: Optional[date] = None # today by default
+  transaction_type: Optional[TransactionType] = None
+  limit: int = 20
+
+class TradeTypeStats(BaseModel):
+  trade_type: str
+  trades: int
+  qty: int
+  value: float
+  insiders: int
+
+class MonthStats(TradeTypeStats):
+  month: str # YYYY-MM
+
+class InsiderStats(BaseModel):
+  insider_name: str
+  insider_title: Optional[str]
+  trades: int
+  qty: int
+  value: float
+
+class TickerSummary(BaseModel):
+  ticker: str
+  company_name: Optional[str]
+  from_date: Optional[date]
+  to_date: Optional[date]
+  trades: int
+  insiders: int
+  buyers: int
+  sellers: int
+  buy_value: float
+  sell_value: float # absolute amount
+  net_value: float # buy_value - sell_value
+  by_trade_type: list[TradeTypeStats]
+  monthly: list[MonthStats]
+  top_insiders: list[InsiderStats]
+
+class TopTicker(BaseModel):
+  ticker: str
+  company_name: Optional[str]
+  trades: int
+  qty: int # shares traded, buys and sales alike
+  buy_value: float
+  sell_value: float # absolute amount
+  net_value: float # buy_value - sell_value
+  insiders: int
@@ -20,4 +20,5 @@ class Token(BaseModel):
 
 class TokenData(BaseModel):
     sub: str | None = None  # sub
-    scopes: list[str] | None = None # scopes
\ No newline at end of file
+    scopes: list[str] | None = None # scopes
+    exp: int | None = None # expiry, seconds since the epoch
\ No newline at end of file
@@ -1,28 +1,43 @@
 from typing import Optional
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict
 from datetime import date, datetime
 from enum import Enum 
+import settings
 
 class TransactionType(Enum):
   S = "S - Sale"
   SOE = "S - Sale+OE"
   P = "P - Purchase"
 
+class ResponseFormat(Enum):
+  json = "json" # one page, cached
+  ndjson = "ndjson" # every matching row streamed, one JSON object per line
+  csv = "csv" # every matching row streamed, with a header line
+
 class TransactionParams(BaseModel):
   from_date: Optional[date] = None
   to_date: Optional[date] = None
   transaction_type: Optional[TransactionType] = None 
+  cursor: Optional[str] = None # next_cursor of the previous page (X-Next-Cursor response header)
+  limit: int = settings.DEFAULT_PAGE_SIZE # ignored by the ndjson and csv formats
+  format: ResponseFormat = ResponseFormat.json
 
 class TransactionDateRange(BaseModel):
   from_date: date
   to_date: date
   transaction_type: Optional[TransactionType] = None 
+  cursor: Optional[str] = None # next_cursor of the previous page (X-Next-Cursor response header)
+  limit: int = settings.DEFAULT_PAGE_SIZE # ignored by the ndjson and csv formats
+  format: ResponseFormat = ResponseFormat.json
 
 class DataParams(BaseModel):
     start_year: int
+    force: bool = False # refresh: fetch and load every month again, even the ones already imported
 
 class Transaction(BaseModel):
-  id: str   
+  model_config = ConfigDict(from_attributes=True, coerce_numbers_to_str=True) # validates ORM objects (the read endpoints encode plain rows, see services.transaction.serialize_page)
+
+  id: str # the integer rowid as a string, as the UUIDs it replaced
   x: Optional[str] 
   filing_date: Optional[datetime]
   trade_date: date
@@ -37,6 +52,3 @@ class Transaction(BaseModel):
   delta_owned: Optional[str]
   value: Optional[float]
 
-class Config:
-  from_attribute = True  # Important to tell Pydantic to convert ORM objects to Pydantic models
-
@@ -0,0 +1,212 @@
+import re
+from datetime import date, timedelta
+from typing import Iterable, Optional
+from sqlalchemy import Column, Date, MetaData, String, Table, case, func, select, tuple_
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.schema import CreateTable
+from models import aggregate as model
+from models import transaction as transaction_model
+
+'''
+Analytics over the aggregate tables (see models/aggregate.py).
+An import refreshes the aggregates of the (ticker, trade date) pairs it touched, in its own transaction (refresh):
+they are recomputed from the filing lines (transaction_facts) rather than incremented, so importing the same rows again (upsert)
+does not count them twice. A refresh of the whole table rebuilds them (rebuild).
+'''
+
+BUY_TYPES = ("P - Purchase",)
+SELL_TYPES = ("S - Sale", "S - Sale+OE")
+TOP_BY = ("value", "qty", "trades", "insiders")
+WINDOW_UNITS = {"d": 1, "w": 7, "m": 30, "y": 365}
+TOP_INSIDERS = 10
+
+facts = transaction_model.TransactionFact.__table__
+tickers = transaction_model.Ticker.__table__
+insiders = transaction_model.Insider.__table__
+trade_types = transaction_model.TradeType.__table__
+ticker_daily = model.TickerDailyStats.__table__
+insider_daily = model.InsiderDailyStats.__table__
+# (ticker, trade_date) pairs touched by an import, joined by the refresh queries (one per connection, emptied after use)
+touched_days = Table(
+  "touched_days", MetaData(),
+  Column("ticker", String, primary_key=True),
+  Column("trade_date", Date, primary_key=True),
+  prefixes=["TEMPORARY"],
+)
+
+# ============================
+# Maintenance (ingestion side)
+# ============================
+def aggregate_queries(days: Optional[Table] = None) -> dict:
+  '''
+  Returns: {aggregate table: SELECT of its rows from the filing lines}, restricted to the pairs in days if given
+  The lines are grouped on their ticker id and the names of their trade type and insider (joined from their ids):
+  a missing trade type or insider name is grouped as ''. The lines without ticker or trade date are left out.
+  '''
+  f = facts
+  if days is None:
+    known = (f.c.trade_date.is_not(None),) # the lines without ticker are left out by the join of their ticker
+  else: # IN rather than a join: SQLite then seeks the (ticker_id, trade_date) index once per pair instead of scanning it
+    known = (tuple_(f.c.ticker_id, f.c.trade_date).in_(
+      select(tickers.c.id, days.c.trade_date).join(tickers, tickers.c.ticker == days.c.ticker)
+    ),)
+  lines = f.join(tickers, tickers.c.id == f.c.ticker_id).outerjoin(trade_types, trade_types.c.id == f.c.trade_type_id)
+  trade_type = func.coalesce(trade_types.c.trade_type, "")
+  insider_name = func.coalesce(insiders.c.name, "")
+  totals = (func.count(), func.coalesce(func.sum(f.c.qty), 0), func.coalesce(func.sum(f.c.value_cents), 0) / 100.0)
+  return {
+    ticker_daily: select(tickers.c.ticker, f.c.trade_date, trade_type, func.max(tickers.c.company_name), *totals)
+      .select_from(lines).where(*known).group_by(f.c.ticker_id, f.c.trade_date, trade_type),
+    insider_daily: select(tickers.c.ticker, f.c.trade_date, trade_type, insider_name, func.max(f.c.insider_title), *totals)
+      .select_from(lines.outerjoin(insiders, insiders.c.id == f.c.insider_id)).where(*known)
+      .group_by(f.c.ticker_id, f.c.trade_date, trade_type, insider_name),
+  }
+
+def refresh(conn: Connection, days: Iterable[tuple]) -> int:
+  '''
+  Recompute the aggregates of the (ticker, trade_date) pairs in days, in the transaction of conn.
+  Returns: the number of pairs refreshed
+  '''
+  keys = [{"ticker": ticker, "trade_date": trade_date} for ticker, trade_date in days if ticker and trade_date]
+  if not keys:
+    return 0
+  conn.execute(CreateTable(touched_days, if_not_exists=True))
+  conn.execute(touched_days.insert(), keys)
+  touched = select(touched_days.c.ticker, touched_days.c.trade_date)
+  for table, query in aggregate_queries(touched_days).items():
+    conn.execute(table.delete().where(tuple_(table.c.ticker, table.c.trade_date).in_(touched)))
+    conn.execute(table.insert().from_select([column.name for column in table.columns], query))
+  conn.execute(touched_days.delete())
+  return len(keys)
+
+def rebuild(conn: Connection):
+  ''' Recompute all the aggregates from the filing lines, in the transaction of conn '''
+  for table, query in aggregate_queries().items():
+    conn.execute(table.delete())
+    conn.execute(table.insert().from_select([column.name for column in table.columns], query))
+
+# ============================
+# Analytics (API side)
+# ============================
+def window_range(window: str, to_date: Optional[date] = None) -> tuple[date, date]:
+  '''
+  window: a number of days, weeks, months (30 days) or years (365 days) ending on to_date (today by default): 30d, 12w, 6m, 1y
+  Returns: (from_date, to_date), both included
+  Raises: ValueError for a malformed window
+  '''
+  match = re.fullmatch(r"(\d+)([dwmy])", window.strip().lower())
+  if not match or int(match.group(1)) < 1:
+    raise ValueError(f"Invalid window '{window}', expected a number followed by d, w, m or y (e.g. 30d).")
+  to_date = to_date or date.today()
+  return to_date - timedelta(days=int(match.group(1)) * WINDOW_UNITS[match.group(2)] - 1), to_date
+
+def date_filters(table: Table, from_date: Optional[date], to_date: Optional[date]) -> list:
+  filters = []
+  if from_date:
+    filters.append(table.c.trade_date >= from_date)
+  if to_date:
+    filters.append(table.c.trade_date <= to_date)
+  return filters
+
+def ticker_summary(db: Session, ticker_id: str, from_date: Optional[date] = None, to_date: Optional[date] = None) -> Optional[dict]:
+  '''
+  Trading activity of a ticker between from_date and to_date (all its history by default):
+  totals, buy and sell value, distinct insiders, per trade type, per month, and its top insiders by traded value.
+  The values per trade type, month and insider are signed as imported (sales are negative on openinsider.com),
+  buy_value and sell_value are absolute amounts and net_value = buy_value - sell_value.
+  Returns: a dict shaped as schemas.aggregate.TickerSummary, None if the ticker has no transactions at all
+  '''
+  days, company_name = db.execute(select(func.count(), func.max(ticker_daily.c.company_name)).where(ticker_daily.c.ticker == ticker_id)).one()
+  if not days:
+    return None
+  td, idaily = ticker_daily, insider_daily
+  td_where = [td.c.ticker == ticker_id, *date_filters(td, from_date, to_date)]
+  id_where = [idaily.c.ticker == ticker_id, *date_filters(idaily, from_date, to_date)]
+  insiders = func.count(func.distinct(idaily.c.insider_name))
+  month = func.strftime("%Y-%m", td.c.trade_date)
+  insider_month = func.strftime("%Y-%m", idaily.c.trade_date)
+
+  by_type = {trade_type: {"trade_type": trade_type, "trades": trades, "qty": qty, "value": value, "insiders": 0}
+    for trade_type, trades, qty, value in db.execute(
+      select(td.c.trade_type, func.sum(td.c.trades), func.sum(td.c.qty), func.sum(td.c.value)).where(*td_where).group_by(td.c.trade_type)
+    )}
+  for trade_type, count in db.execute(select(idaily.c.trade_type, insiders).where(*id_where).group_by(idaily.c.trade_type)):
+    by_type[trade_type]["insiders"] = count
+
+  monthly = {(m, trade_type): {"month": m, "trade_type": trade_type, "trades": trades, "qty": qty, "value": value, "insiders": 0}
+    for m, trade_type, trades, qty, value in db.execute(
+      select(month, td.c.trade_type, func.sum(td.c.trades), func.sum(td.c.qty), func.sum(td.c.value))
+        .where(*td_where).group_by(month, td.c.trade_type).order_by(month, td.c.trade_type)
+    )}
+  for m, trade_type, count in db.execute(select(insider_month, idaily.c.trade_type, insiders).where(*id_where).group_by(insider_month, idaily.c.trade_type)):
+    monthly[(m, trade_type)]["insiders"] = count
+
+  distinct_of = lambda trade_types: func.count(func.distinct(case((idaily.c.trade_type.in_(trade_types), idaily.c.insider_name))))
+  total_insiders, buyers, sellers = db.execute(select(insiders, distinct_of(BUY_TYPES), distinct_of(SELL_TYPES)).where(*id_where)).one()
+
+  gross = func.sum(func.abs(idaily.c.value))
+  top_insiders = [
+    {"insider_name": name, "insider_title": title, "trades": trades, "qty": qty, "value": value}
+    for name, title, trades, qty, value, _ in db.execute(
+      select(idaily.c.insider_name, func.max(idaily.c.insider_title), func.sum(idaily.c.trades), func.sum(idaily.c.qty), func.sum(idaily.c.value), gross)
+        .where(*id_where).group_by(idaily.c.insider_name).order_by(gross.desc(), idaily.c.insider_name).limit(TOP_INSIDERS)
+    )
+  ]
+  buy_value = sum(abs(stats["value"] or 0) for trade_type, stats in by_type.items() if trade_type in BUY_TYPES)
+  sell_value = sum(abs(stats["value"] or 0) for trade_type, stats in by_type.items() if trade_type in SELL_TYPES)
+  return {
+    "ticker": ticker_id,
+    "company_name": company_name,
+    "from_date": from_date,
+    "to_date": to_date,
+    "trades": sum(stats["trades"] for stats in by_type.values()),
+    "insiders": total_insiders,
+    "buyers": buyers,
+    "sellers": sellers,
+    "buy_value": buy_value,
+    "sell_value": sell_value,
+    "net_value": buy_value - sell_value,
+    "by_trade_type": sorted(by_type.values(), key=lambda stats: stats["trade_type"]),
+    "monthly": list(monthly.values()),
+    "top_insiders": top_insiders,
+  }
+
+def top_tickers(db: Session, by: str = "value", from_date: Optional[date] = None, to_date: Optional[date] = None, trade_type: Optional[str] = None, limit: int = 20) -> list[dict]:
+  '''
+  Tickers ranked by traded value or quantity (absolute, buys and sales alike), number of trades or distinct insiders
+  between from_date and to_date, e.g. by=insiders with trade_type "P - Purchase" for the cluster buys.
+  Returns: [dict shaped as schemas.aggregate.TopTicker], best first
+  Raises: ValueError for an unknown by
+  '''
+  if by not in TOP_BY:
+    raise ValueError(f"Invalid by '{by}', expected one of {', '.join(TOP_BY)}.")
+  td, idaily = ticker_daily, insider_daily
+  td_where = date_filters(td, from_date, to_date) + ([td.c.trade_type == trade_type] if trade_type else [])
+  id_where = date_filters(idaily, from_date, to_date) + ([idaily.c.trade_type == trade_type] if trade_type else [])
+  insiders = func.count(func.distinct(idaily.c.insider_name))
+  if by == "insiders":
+    ranked = select(idaily.c.ticker).where(*id_where).group_by(idaily.c.ticker).order_by(insiders.desc(), idaily.c.ticker).limit(limit)
+  else:
+    key = {"value": func.sum(func.abs(td.c.value)), "qty": func.sum(func.abs(td.c.qty)), "trades": func.sum(td.c.trades)}[by]
+    ranked = select(td.c.ticker).where(*td_where).group_by(td.c.ticker).order_by(key.desc(), td.c.ticker).limit(limit)
+  tickers = list(db.scalars(ranked))
+  if not tickers:
+    return []
+
+  value_of = lambda trade_types: func.coalesce(func.sum(case((td.c.trade_type.in_(trade_types), func.abs(td.c.value)))), 0)
+  stats = {ticker: {"ticker": ticker, "company_name": company_name, "trades": trades, "qty": qty, "buy_value": buy_value, "sell_value": sell_value, "net_value": buy_value - sell_value, "insiders": 0}
+    for ticker, company_name, trades, qty, buy_value, sell_value in db.execute(
+      select(td.c.ticker, func.max(td.c.company_name), func.sum(td.c.trades), func.sum(func.abs(td.c.qty)), value_of(BUY_TYPES), value_of(SELL_TYPES))
+        .where(td.c.ticker.in_(tickers), *td_where).group_by(td.c.ticker)
+    )}
+  for ticker, count in db.execute(select(idaily.c.ticker, insiders).where(idaily.c.ticker.in_(tickers), *id_where).group_by(idaily.c.ticker)):
+    stats[ticker]["insiders"] = count
+  return [stats[ticker] for ticker in tickers]
+
+async def ticker_summary_async(db: AsyncSession, ticker_id: str, from_date: Optional[date] = None, to_date: Optional[date] = None) -> Optional[dict]:
+  return await db.run_sync(ticker_summary, ticker_id, from_date, to_date)
+
+async def top_tickers_async(db: AsyncSession, by: str = "value", from_date: Optional[date] = None, to_date: Optional[date] = None, trade_type: Optional[str] = None, limit: int = 20) -> list[dict]:
+  return await db.run_sync(top_tickers, by, from_date, to_date, trade_type, limit)
@@ -1,10 +1,15 @@
 from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.orm import Session 
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
 from passlib.context import CryptContext
 import services.utils.token as jwtoken
 import uuid, secrets
 from models import client as model
 from schemas import auth as schema
+from services import principal, token_state
+import settings
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto") # password-hash before storing
 oauth2_scheme = OAuth2PasswordBearer(
@@ -28,6 +33,20 @@ def generate_client_id(db: Session) -> schema.ClientCreate:
     )
   return None
 
+async def generate_client_id_async(db: AsyncSession) -> schema.ClientCreate:
+  client_id = str(uuid.uuid4())
+  client_secret, hashed_secret = await run_in_threadpool(generate_client_secret) # bcrypt takes ~0.2s of CPU, off the event loop
+  db_client = model.Client(id=client_id, hashed_secret=hashed_secret, is_active=True)
+  db.add(db_client)
+  await db.commit()
+  await db.refresh(db_client)
+  return schema.ClientCreate(
+    client_id=db_client.id, 
+    client_secret=client_secret, 
+    is_active=db_client.is_active, 
+    role=db_client.role
+  )
+
 def generate_client_secret():
   # Generate a random string as client secret
   secret = secrets.token_urlsafe(32)  # 32 bytes of random data, URL-safe base64 encoded
@@ -44,14 +63,41 @@ def get_client_by_id(db: Session, client_id: str) -> schema.Client:
     return schema.Client(client_id=client.id, is_active=client.is_active, role=client.role)
   return None
 
+async def get_client_async(db: AsyncSession, client_id: str):
+  return (await db.scalars(select(model.Client).where(model.Client.id == client_id))).first()
+
+async def get_client_by_id_async(db: AsyncSession, client_id: str) -> schema.Client:
+  client = await get_client_async(db, client_id)
+  if client:
+    return schema.Client(client_id=client.id, is_active=client.is_active, role=client.role)
+  return None
+
+async def set_client_active_async(db: AsyncSession, client_id: str, is_active: bool) -> schema.Client:
+  ''' Activate or deactivate a client, its cached tokens are dropped. Returns: the client, None if not found '''
+  client = await get_client_async(db, client_id)
+  if not client:
+    return None
+  client.is_active = is_active
+  await db.commit()
+  await principal.invalidate_client_async(client_id)
+  return schema.Client(client_id=client.id, is_active=client.is_active, role=client.role)
+
 def authenticate_client(db: Session, username: str, password: str):
   client = get_client_by_id(db, client_id=username)
   if not client:
     return False
   db_client = get_client(db, client.client_id)
-  if not client.is_active and not pwd_context.verify(password, db_client.hashed_secret):
+  if not client.is_active or not pwd_context.verify(password, db_client.hashed_secret):
     return False
   return client # return the client with id, status and role
+
+async def authenticate_client_async(db: AsyncSession, username: str, password: str):
+  db_client = await get_client_async(db, username)
+  if not db_client or not db_client.is_active:
+    return False
+  if not await run_in_threadpool(pwd_context.verify, password, db_client.hashed_secret): # bcrypt, off the event loop
+    return False
+  return schema.Client(client_id=db_client.id, is_active=db_client.is_active, role=db_client.role)
  
 def create_access_token(data: dict, scopes: list[str], expires_delta: int = None):
   return jwtoken.create_access_token(data, scopes, expires_delta)
@@ -59,8 +105,24 @@ def create_access_token(data: dict, scopes: list[str], expires_delta: int = None
 def decode_access_token(token: str):
   return jwtoken.decode_access_token(token)
 
-def revoke_access_token(token: str):  
-  jwtoken.revoke_token(token)
+async def revoke_access_token_async(token: str):
+  token_data = decode_access_token(token)
+  if token_data is None or not token_data.exp: # invalid or expired already
+    return
+  await token_state.backend.revoke(token, token_data.exp)
+  await principal.revoke_async(token) # verified again by the next request, and refused
+
+async def is_access_token_revoked_async(token: str) -> bool:
+  return await token_state.backend.is_revoked(token)
+
+async def create_refresh_token_async(client_id: str) -> str:
+  refresh_token = create_token()
+  await token_state.backend.add_refresh_token(refresh_token, client_id, settings.REFRESH_TOKEN_EXPIRE_DAYS * 24 * 60 * 60)
+  return refresh_token
+
+async def consume_refresh_token_async(refresh_token: str) -> str:
+  ''' Returns: the client id of a refresh token (which can not be used again), None if unknown or expired '''
+  return await token_state.backend.pop_refresh_token(refresh_token)
 
 def create_token():
   return jwtoken.create_token()
\ No newline at end of file
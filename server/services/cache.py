@@ -0,0 +1,312 @@
+import asyncio, logging, threading, time
+from collections import OrderedDict
+from datetime import datetime, timedelta, UTC
+from typing import Iterable, Optional
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.engine import Connection
+from sqlalchemy.ext.asyncio import AsyncEngine
+import settings
+from models.cache import CacheInvalidation
+from services import metrics, redis_client
+
+'''
+Read-through cache of pre-serialized API responses.
+Entries live in Redis (shared by every worker, expiring after REDIS_EX seconds) and fall back to an in-process LRU while Redis is down
+(see the circuit breaker of redis_client).
+Every entry is stored with tags (e.g. "ticker:AAPL", "month:2024-01"): invalidate(tags) drops all the entries carrying one of them,
+so an import only evicts the responses built from the tickers and months it touched.
+The imports run in the job worker processes, which cannot reach the LRU of the API processes: they also record their
+invalidations in the database (record_invalidation, in the transaction of the rows), and every API process applies the
+new ones to its LRU every CACHE_INVALIDATION_POLL seconds (watch_invalidations), whether Redis is up or not.
+A response read from the database just before an import commits must not be stored once the import has invalidated its
+tags: get returns the version of the tags along with the lookup (a generation per tag in Redis, bumped by invalidate,
+and a generation of the LRU, bumped by any of its invalidations), and put only stores the entry if it did not change
+(atomically: a Lua script in Redis, under the lock in the LRU).
+'''
+
+KEY_PREFIX = "cache:"
+TAG_PREFIX = "cache-tag:"
+GENERATION_PREFIX = "cache-gen:" # counter of the invalidations of a tag, ALL_TAGS for clear
+ALL_TAGS = "*" # the tags of an invalidation dropping every entry (see clear)
+
+logger = logging.getLogger(__name__)
+invalidations = CacheInvalidation.__table__
+last_invalidation: Optional[int] = None # id of the last invalidation applied to the LRU of this process, None before the first poll
+
+class CacheStats:
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.hits = self.misses = self.fallback_hits = self.sets = self.stale_sets = self.invalidations = 0
+
+  def incr(self, name: str, value: int = 1):
+    with self.lock:
+      setattr(self, name, getattr(self, name) + value)
+
+  def summary(self) -> dict:
+    lookups = self.hits + self.misses
+    return {
+      "hits": self.hits,
+      "misses": self.misses,
+      "hit_ratio": round(self.hits / lookups, 3) if lookups else None,
+      "fallback_hits": self.fallback_hits, # hits served by the in-process LRU
+      "sets": self.sets,
+      "stale_sets": self.stale_sets, # responses not stored, an import invalidated them while they were read
+      "invalidations": self.invalidations, # entries evicted by an import
+      "redis_errors": redis_client.stats.errors, # of every Redis user of the process, see redis_client.summary
+      "backend": "redis" if settings.REDIS_URL and redis_client.breaker.state == "closed" else "lru",
+      "lru_entries": len(lru),
+    }
+
+class LRUCache:
+  ''' Bounded, thread-safe dict of key -> (expires_at, tags, value), least recently used entries are evicted first '''
+  def __init__(self, maxsize: int, ttl: float):
+    self.maxsize = maxsize
+    self.ttl = ttl
+    self.entries = OrderedDict()
+    self.lock = threading.Lock()
+    self.generation = 0 # bumped by every invalidate and clear
+
+  def __len__(self):
+    return len(self.entries)
+
+  def get(self, key: str) -> Optional[str]:
+    with self.lock:
+      entry = self.entries.get(key)
+      if entry is None:
+        return None
+      if entry[0] < time.monotonic():
+        del self.entries[key]
+        return None
+      self.entries.move_to_end(key)
+      return entry[2]
+
+  def set(self, key: str, value: str, tags: Iterable[str], ttl: Optional[float] = None, generation: Optional[int] = None) -> bool:
+    ''' generation: the one read before the value was built, the entry is not stored if an invalidation happened since '''
+    with self.lock:
+      if generation is not None and generation != self.generation:
+        return False
+      self.entries[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), frozenset(tags), value)
+      self.entries.move_to_end(key)
+      while len(self.entries) > self.maxsize:
+        self.entries.popitem(last=False)
+      return True
+
+  def delete(self, key: str) -> bool:
+    with self.lock:
+      return self.entries.pop(key, None) is not None
+
+  def invalidate(self, tags: set) -> int:
+    with self.lock:
+      self.generation += 1
+      stale = [key for key, (_, entry_tags, _) in self.entries.items() if entry_tags & tags]
+      for key in stale:
+        del self.entries[key]
+      return len(stale)
+
+  def clear(self):
+    with self.lock:
+      self.generation += 1
+      self.entries.clear()
+
+stats = CacheStats()
+lru = LRUCache(settings.CACHE_LRU_SIZE, settings.REDIS_EX)
+
+# (generation of the LRU, [generation of each tag and of ALL_TAGS in Redis] or None if Redis was unavailable)
+Version = tuple[int, Optional[list[str]]]
+
+# KEYS: the entry, its generation keys (ARGV[3] of them), its tag sets; ARGV: value, ttl, generations read by get
+PUT_SCRIPT = '''
+local generations = tonumber(ARGV[3])
+for i = 1, generations do
+  if (redis.call('GET', KEYS[1 + i]) or '0') ~= ARGV[3 + i] then
+    return 0
+  end
+end
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+for i = 2 + generations, #KEYS do
+  redis.call('SADD', KEYS[i], KEYS[1])
+  redis.call('EXPIRE', KEYS[i], ARGV[2] * 2)
+end
+return 1
+'''
+
+def generation_keys(tags: list[str]) -> list[str]:
+  return [GENERATION_PREFIX + tag for tag in tags + [ALL_TAGS]]
+
+def queue_get(pipe, key: str, tags: list[str]):
+  pipe.get(KEY_PREFIX + key)
+  pipe.mget(generation_keys(tags))
+
+def lookup(results: Optional[list], key: str, generation: int) -> tuple[Optional[str], Version]:
+  ''' The value read from Redis if found, else from the LRU, and the version of its tags '''
+  if results is None:
+    value, generations = lru.get(key), None
+    if value is not None:
+      stats.incr("fallback_hits")
+  else:
+    value, generations = results[0], [value or "0" for value in results[1]]
+  stats.incr("hits" if value is not None else "misses")
+  return value, (generation, generations)
+
+def put_args(key: str, value: str, tags: list[str], generations: list[str]) -> list:
+  keys = [KEY_PREFIX + key] + generation_keys(tags) + [TAG_PREFIX + tag for tag in tags]
+  return [PUT_SCRIPT, len(keys), *keys, value, settings.REDIS_EX, len(generations), *generations]
+
+def get(key: str, tags: Iterable[str]) -> tuple[Optional[str], Optional[Version]]:
+  '''
+  Returns: (the cached value or None, the version of tags, to pass to put when the value is built on a miss)
+  '''
+  if not settings.CACHE_ENABLED:
+    return None, None
+  generation = lru.generation # before Redis: an LRU invalidation meanwhile only costs a skipped put
+  return lookup(redis_client.execute(lambda pipe: queue_get(pipe, key, list(tags))), key, generation)
+
+def put(key: str, value: str, tags: Iterable[str], version: Version):
+  ''' Store a value built after get returned version, unless one of its tags was invalidated since '''
+  if not settings.CACHE_ENABLED:
+    return
+  tags = list(tags)
+  generation, generations = version
+  if generations is not None:
+    stored, result = redis_client.call(lambda client: client.eval(*put_args(key, value, tags, generations)))
+    if stored:
+      stats.incr("sets" if result else "stale_sets")
+      return
+  stats.incr("sets" if lru.set(key, value, tags, generation=generation) else "stale_sets")
+
+async def get_async(key: str, tags: Iterable[str]) -> tuple[Optional[str], Optional[Version]]:
+  ''' get for the request handlers, through the asyncio Redis client '''
+  if not settings.CACHE_ENABLED:
+    return None, None
+  generation = lru.generation
+  return lookup(await redis_client.execute_async(lambda pipe: queue_get(pipe, key, list(tags))), key, generation)
+
+async def put_async(key: str, value: str, tags: Iterable[str], version: Version):
+  ''' put for the request handlers, through the asyncio Redis client '''
+  if not settings.CACHE_ENABLED:
+    return
+  tags = list(tags)
+  generation, generations = version
+  if generations is not None:
+    stored, result = await redis_client.call_async(lambda client: client.eval(*put_args(key, value, tags, generations)))
+    if stored:
+      stats.incr("sets" if result else "stale_sets")
+      return
+  stats.incr("sets" if lru.set(key, value, tags, generation=generation) else "stale_sets")
+
+def invalidate(tags: Iterable[str]) -> int:
+  '''
+  Drop the entries carrying any of the tags, from Redis and from the in-process LRU (which may hold entries from a Redis outage).
+  Returns: the number of entries dropped
+  '''
+  tags = set(tags)
+  if not tags:
+    return 0
+  dropped = lru.invalidate(tags)
+  def queue_bump(pipe): # in one transaction: an entry put before is listed in its tag sets, one put after is refused
+    for tag in tags:
+      pipe.incr(GENERATION_PREFIX + tag)
+      pipe.expire(GENERATION_PREFIX + tag, settings.REDIS_EX * 2) # outlives the versions read by get
+    for tag in tags:
+      pipe.smembers(TAG_PREFIX + tag)
+  results = redis_client.execute(queue_bump, transaction=True)
+  if results is not None: # else the Redis entries expire on their own after REDIS_EX seconds
+    keys = set().union(*results[2 * len(tags):])
+    def queue_delete(pipe):
+      if keys:
+        pipe.delete(*keys)
+      pipe.delete(*[TAG_PREFIX + tag for tag in tags])
+    results = redis_client.execute(queue_delete)
+    if results is not None and keys:
+      dropped += results[0]
+  stats.incr("invalidations", dropped)
+  return dropped
+
+def clear() -> int:
+  '''
+  Drop every entry, e.g. when the whole transactions table is replaced.
+  Returns: the number of entries dropped
+  '''
+  dropped = len(lru)
+  lru.clear()
+  def delete_all(client) -> int:
+    client.incr(GENERATION_PREFIX + ALL_TAGS) # first: the entries put from now on are refused
+    client.expire(GENERATION_PREFIX + ALL_TAGS, settings.REDIS_EX * 2)
+    deleted = 0
+    keys = list(client.scan_iter(KEY_PREFIX + "*", count=1000))
+    for start in range(0, len(keys), 1000):
+      deleted += client.delete(*keys[start:start + 1000])
+    for key in client.scan_iter(TAG_PREFIX + "*", count=1000):
+      client.delete(key)
+    return deleted
+  _, deleted = redis_client.call(delete_all)
+  dropped += deleted or 0
+  stats.incr("invalidations", dropped)
+  return dropped
+
+def record_invalidation(conn: Connection, tags: Iterable[str]):
+  '''
+  Record an invalidation for the LRU of the API processes (poll_invalidations), in the transaction of conn: it is seen
+  once the rows it invalidates are committed. Those older than twice the lifetime of an entry are pruned.
+  tags: as for invalidate, [ALL_TAGS] to drop every entry
+  '''
+  tags = sorted(set(tags))
+  if not tags:
+    return
+  now = datetime.now(UTC)
+  conn.execute(insert(invalidations).values(tags="\n".join(tags), created_at=now))
+  conn.execute(delete(invalidations).where(invalidations.c.created_at < now - timedelta(seconds=settings.REDIS_EX * 2)))
+
+def apply_invalidations(records: Iterable[tuple[int, str]]) -> int:
+  ''' Drop the LRU entries of the recorded invalidations, (id, tags) in id order. Returns: the number of entries dropped '''
+  global last_invalidation
+  dropped = 0
+  for invalidation_id, tags in records:
+    tags = set(tags.split("\n"))
+    if ALL_TAGS in tags:
+      dropped += len(lru)
+      lru.clear()
+    else:
+      dropped += lru.invalidate(tags)
+    last_invalidation = invalidation_id
+  stats.incr("invalidations", dropped)
+  return dropped
+
+async def poll_invalidations(engine: AsyncEngine) -> int:
+  '''
+  Apply the invalidations recorded since the last poll to the LRU of this process.
+  The first poll only takes the position: the LRU of a process which just started holds nothing older.
+  Returns: the number of entries dropped
+  '''
+  global last_invalidation
+  async with engine.connect() as conn:
+    if last_invalidation is None:
+      last_invalidation = (await conn.execute(select(func.coalesce(func.max(invalidations.c.id), 0)))).scalar()
+      return 0
+    records = (await conn.execute(
+      select(invalidations.c.id, invalidations.c.tags).where(invalidations.c.id > last_invalidation).order_by(invalidations.c.id)
+    )).all()
+  return apply_invalidations(records)
+
+async def watch_invalidations(engine: AsyncEngine, interval: float = settings.CACHE_INVALIDATION_POLL):
+  ''' Background task of an API process: poll_invalidations every interval seconds, until cancelled '''
+  while True:
+    await asyncio.sleep(interval)
+    try:
+      await poll_invalidations(engine)
+    except Exception as e: # e.g. the database is locked by a long import: the next poll catches up
+      logger.warning("Failed to read the cache invalidations", extra={"error": str(e)})
+
+def collect_metrics():
+  ''' metrics collector: the counters of stats '''
+  yield "response_cache_lookups_total", "counter", "Response cache lookups, by result (fallback: hit in the in-process LRU)", [
+    ({"result": "hit"}, stats.hits - stats.fallback_hits), ({"result": "fallback_hit"}, stats.fallback_hits), ({"result": "miss"}, stats.misses),
+  ]
+  lookups = stats.hits + stats.misses
+  yield "response_cache_hit_ratio", "gauge", "Response cache hits / lookups since the start", [({}, stats.hits / lookups if lookups else 0)]
+  yield "response_cache_sets_total", "counter", "Responses stored in the cache", [({}, stats.sets)]
+  yield "response_cache_stale_sets_total", "counter", "Responses not stored, invalidated by an import while they were read", [({}, stats.stale_sets)]
+  yield "response_cache_invalidations_total", "counter", "Cached responses dropped by an import", [({}, stats.invalidations)]
+  yield "response_cache_lru_entries", "gauge", "Responses held by the in-process LRU", [({}, len(lru))]
+
+metrics.REGISTRY.add_collector(collect_metrics)
@@ -0,0 +1,132 @@
+import logging, os, re, time
+from datetime import date, datetime, UTC
+from typing import Callable, Optional
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sqlalchemy.engine import Connection, Engine
+import settings
+from models import transaction as model
+
+'''
+Columnar export of the transactions table: one Parquet file per trade month,
+  {EXPORT_DIR}/transactions/year=YYYY/month=MM/transactions.parquet
+(hive partitioning: the directory is a dataset for pyarrow.dataset, pandas, DuckDB, Spark...).
+With EXPORT_ENABLED, every ingestion job is followed by an export job rewriting the partitions of the trade months it
+touched (see services/jobs.py), export_all rebuilds all of them (after a refresh, or for the first export of an existing
+database).
+A partition is written to a temporary file and renamed, so a reader never gets a partial file.
+'''
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = pa.schema([
+  ("id", pa.string()),
+  ("x", pa.string()),
+  ("filing_date", pa.timestamp("us")),
+  ("trade_date", pa.date32()),
+  ("ticker", pa.string()),
+  ("company_name", pa.string()),
+  ("insider_name", pa.string()),
+  ("insider_title", pa.string()),
+  ("trade_type", pa.string()),
+  ("price", pa.float64()),
+  ("qty", pa.int64()),
+  ("owned", pa.int64()),
+  ("delta_owned", pa.string()),
+  ("delta_owned_pct", pa.float64()),
+  ("delta_owned_flag", pa.string()),
+  ("value", pa.float64()),
+])
+SELECT_COLUMNS = {"id": "CAST(id AS TEXT) AS id"} # the integer key, written as text like the API serves it
+FILE_NAME = "transactions.parquet"
+PARTITION_PATTERN = re.compile(r"year=(\d{4})/month=(\d{2})")
+
+def dataset_dir() -> str:
+  return os.path.join(settings.EXPORT_DIR, model.Transaction.__table__.name)
+
+def partition_path(year: int, month: int) -> str:
+  return os.path.join(dataset_dir(), f"year={year:04d}", f"month={month:02d}", FILE_NAME)
+
+def month_table(conn: Connection, year: int, month: int) -> pa.Table:
+  ''' The transactions traded in a month, ordered by (trade_date, id) like the API pages '''
+  start = date(year, month, 1)
+  end = date(year + 1, 1, 1) if month == 12 else date(year, month + 1, 1)
+  rows = conn.exec_driver_sql(
+    f"SELECT {', '.join(SELECT_COLUMNS.get(name, name) for name in SCHEMA.names)} FROM {model.Transaction.__table__.name} WHERE trade_date >= ? AND trade_date < ? ORDER BY trade_date, id",
+    (start.isoformat(), end.isoformat()), # dates are stored as ISO strings by SQLite, and converted by Arrow below
+  ).fetchall()
+  columns = list(zip(*rows)) or [[] for _ in SCHEMA]
+  arrays = []
+  for field, values in zip(SCHEMA, columns):
+    if pa.types.is_temporal(field.type):
+      arrays.append(pa.array(values, pa.string()).cast(field.type))
+    else:
+      arrays.append(pa.array(values, field.type))
+  return pa.Table.from_arrays(arrays, schema=SCHEMA)
+
+def write_month(conn: Connection, year: int, month: int) -> int:
+  '''
+  (Re)write the partition of a month, removed when the month has no transaction any more.
+  Returns: the number of rows written
+  '''
+  path = partition_path(year, month)
+  table = month_table(conn, year, month)
+  if not table.num_rows:
+    if os.path.exists(path):
+      os.remove(path)
+    return 0
+  os.makedirs(os.path.dirname(path), exist_ok=True)
+  tmp = f"{path}.{os.getpid()}.tmp"
+  pq.write_table(table, tmp, compression=settings.EXPORT_COMPRESSION)
+  os.replace(tmp, path)
+  return table.num_rows
+
+def export_all(engine: Engine, should_stop: Callable[[], bool] = None) -> dict:
+  '''
+  Rewrite every partition from the transactions table, and remove the ones of months without transactions.
+  should_stop is checked between two months.
+  Returns: {months, rows, seconds, cancelled}
+  '''
+  started = time.perf_counter()
+  with engine.connect() as conn:
+    months = [tuple(map(int, m.split("-"))) for (m,) in conn.exec_driver_sql(
+      f"SELECT DISTINCT strftime('%Y-%m', trade_date) FROM {model.Transaction.__table__.name} WHERE trade_date IS NOT NULL ORDER BY 1"
+    )]
+  for partition in list_partitions():
+    if (partition["year"], partition["month"]) not in months:
+      os.remove(partition_path(partition["year"], partition["month"]))
+  rows, done = 0, 0
+  with engine.connect() as conn:
+    for year, month in months:
+      if should_stop and should_stop():
+        break
+      rows += write_month(conn, year, month)
+      done += 1
+  seconds = time.perf_counter() - started
+  logger.info("Exported the transactions", extra={"rows": rows, "months": done, "directory": dataset_dir(), "seconds": round(seconds, 3)})
+  return {"months": done, "rows": rows, "seconds": round(seconds, 3), "cancelled": done < len(months)}
+
+def list_partitions() -> list[dict]:
+  ''' Returns: [{year, month, rows, bytes, modified_at}] of the exported months, oldest first '''
+  partitions = []
+  root = dataset_dir()
+  if not os.path.isdir(root):
+    return partitions
+  for directory, _, files in os.walk(root):
+    match = PARTITION_PATTERN.search(directory.replace(os.sep, "/"))
+    if not match or FILE_NAME not in files:
+      continue
+    path = os.path.join(directory, FILE_NAME)
+    stat = os.stat(path)
+    partitions.append({
+      "year": int(match.group(1)),
+      "month": int(match.group(2)),
+      "rows": pq.read_metadata(path).num_rows,
+      "bytes": stat.st_size,
+      "modified_at": datetime.fromtimestamp(stat.st_mtime, UTC),
+    })
+  return sorted(partitions, key=lambda partition: (partition["year"], partition["month"]))
+
+def find_partition(year: int, month: int) -> Optional[str]:
+  path = partition_path(year, month)
+  return path if os.path.exists(path) else None
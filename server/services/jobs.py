@@ -0,0 +1,313 @@
+import calendar, logging, multiprocessing, os, time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, date, UTC
+from typing import Optional
+from sqlalchemy import select, update
+from sqlalchemy.orm import selectinload
+from sqlalchemy.ext.asyncio import AsyncSession
+import settings
+from db import SessionLocal
+from models import job as model
+from services import transaction as transact_mgr, ledger, export, metrics
+from services.pipeline import MonthResult
+from services.utils import log
+
+'''
+Background ingestion jobs (bootstrap, refresh, daily sync) and full Parquet exports.
+A job is a row of the jobs table, run by a pool of worker processes (JOB_WORKERS), so a multi-hour scrape neither holds an
+HTTP request open nor competes with the event loop that serves the API.
+The outcome of every month is written to job_months as soon as it is known: it is the progress reported by
+GET /admin/jobs/{id}, and the checkpoint a job resumes from (the months already loaded are not scraped again)
+when the server restarts in the middle of it.
+Cancellation is a flag on the job, checked by the worker before each month is fetched.
+The pid of a job is the process which owns it: the API process which queued it, then the worker which runs it. Every
+change of owner is claimed with a conditional UPDATE (see claim_job), so with several API processes
+(uvicorn --workers N) an interrupted job is resumed by one of them only, and run by one worker only.
+A bootstrap also skips the months imported by earlier jobs (ingestion ledger, see services/ledger.py), a refresh
+reloads every month into a shadow table swapped in when the job succeeds (see transaction.refresh_data).
+With EXPORT_ENABLED, an ingestion job is followed by an export job rewriting the Parquet partitions of the trade months it
+loaded (every month after a refresh), run by the same worker once the rows are committed: a failed export fails the
+export job only.
+'''
+
+ACTIVE_STATUSES = ("queued", "running")
+DONE_MONTH_STATUSES = ("loaded", "empty", "unchanged", "skipped") # months skipped when a job resumes
+
+_executor: Optional[ProcessPoolExecutor] = None
+logger = logging.getLogger(__name__)
+
+def get_executor() -> ProcessPoolExecutor:
+  global _executor
+  if _executor is None: # spawn: forking a process which runs threads and an event loop is unsafe
+    _executor = ProcessPoolExecutor(max_workers=settings.JOB_WORKERS, mp_context=multiprocessing.get_context("spawn"), initializer=log.configure)
+  return _executor
+
+def shutdown():
+  ''' Stop taking jobs, the running ones finish in their worker process (or resume at the next start if it dies) '''
+  global _executor
+  if _executor is not None:
+    _executor.shutdown(wait=False, cancel_futures=True)
+    _executor = None
+
+def parse_month_date(value: str) -> date:
+  return datetime.strptime(value, "%m/%d/%Y").date()
+
+# ============================
+# API side (async, on the event loop)
+# ============================
+async def submit_job(db: AsyncSession, kind: str, start_year: int) -> model.Job:
+  '''
+  Record a job and hand it to the worker processes.
+  Parameters: kind (bootstrap, refresh, daily_sync or export), start_year (not used by an export)
+  Raises: ValueError if start_year is in the future
+  '''
+  as_of = datetime.now().date() # a job resumed on a later day still scrapes the ranges it was submitted for
+  if kind != "export":
+    transact_mgr.month_ranges(start_year, kind == "daily_sync", as_of) # validate before queuing
+  job = model.Job(kind=kind, start_year=start_year, as_of=as_of, pid=os.getpid()) # not resumed by the other API processes while this one lives
+  db.add(job)
+  await db.commit()
+  get_executor().submit(run_job, job.id)
+  return await get_job(db, job.id)
+
+async def get_job(db: AsyncSession, job_id: str) -> Optional[model.Job]:
+  query = select(model.Job).where(model.Job.id == job_id).options(selectinload(model.Job.months)).execution_options(populate_existing=True)
+  return (await db.scalars(query)).first()
+
+async def list_jobs(db: AsyncSession, limit: int = 20) -> list[model.Job]:
+  query = select(model.Job).order_by(model.Job.created_at.desc()).limit(limit).options(selectinload(model.Job.months))
+  return list((await db.scalars(query)).all())
+
+async def cancel_job(db: AsyncSession, job_id: str) -> Optional[model.Job]:
+  '''
+  A queued job is cancelled at once, a running one stops before its next month (the months in flight are still loaded).
+  Returns: the job, None if not found
+  '''
+  job = await get_job(db, job_id)
+  if job is None or job.status not in ACTIVE_STATUSES:
+    return job
+  job.cancel_requested = True
+  if job.status == "queued":
+    job.status = "cancelled"
+    job.finished_at = datetime.now(UTC)
+  await db.commit()
+  return await get_job(db, job_id)
+
+def job_summary(job: model.Job) -> dict:
+  counts = {}
+  for month in job.months:
+    counts[month.status] = counts.get(month.status, 0) + 1
+  rows = sum(month.rows or 0 for month in job.months)
+  started_at = job.started_at.replace(tzinfo=UTC) if job.started_at else None
+  finished_at = job.finished_at.replace(tzinfo=UTC) if job.finished_at else datetime.now(UTC)
+  seconds = (finished_at - started_at).total_seconds() if started_at else None
+  return {
+    "id": job.id,
+    "kind": job.kind,
+    "start_year": job.start_year,
+    "as_of": job.as_of,
+    "status": job.status,
+    "cancel_requested": job.cancel_requested,
+    "created_at": job.created_at,
+    "started_at": job.started_at,
+    "finished_at": job.finished_at,
+    "months_total": len(job.months),
+    "months_done": sum(count for status, count in counts.items() if status != "pending"),
+    "statuses": counts,
+    "rows": rows,
+    "seconds": round(seconds, 1) if seconds is not None else None,
+    "rows_per_sec": round(rows / seconds, 1) if seconds else None,
+    "error": job.error,
+    "errors": [{"start_date": m.start_date, "end_date": m.end_date, "error": m.error} for m in job.months if m.status == "failed"],
+    "months": [{"start_date": m.start_date, "end_date": m.end_date, "status": m.status, "rows": m.rows, "seconds": m.seconds} for m in job.months],
+  }
+
+def resume_jobs() -> list[str]:
+  '''
+  Resubmit the jobs left queued or running by a previous server process (at startup).
+  A job whose owner process is still alive is left alone, the others are claimed one by one: when the API processes
+  start together, each job is resumed by the one whose claim lands first.
+  Returns: the ids of the resumed jobs
+  '''
+  db = SessionLocal()
+  try:
+    resumed = []
+    for job in db.execute(select(model.Job.id, model.Job.status, model.Job.pid).where(model.Job.status.in_(ACTIVE_STATUSES))).all():
+      if job.pid and pid_alive(job.pid):
+        continue
+      if claim_job(db, job.id, (job.status, job.pid), "queued"):
+        resumed.append(job.id)
+  finally:
+    db.close()
+  for job_id in resumed:
+    logger.info("Resuming job", extra={"job_id": job_id})
+    get_executor().submit(run_job, job_id)
+  return resumed
+
+def claim_job(db, job_id: str, current: tuple[str, Optional[int]], status: str) -> bool:
+  '''
+  Move a job from its current (status, pid) to status, owned by this process, in one conditional UPDATE.
+  Returns: False if the job changed since it was read (claimed by another process, cancelled)
+  '''
+  result = db.execute(update(model.Job).where(
+    model.Job.id == job_id, model.Job.status == current[0], model.Job.pid.is_not_distinct_from(current[1])
+  ).values(status=status, pid=os.getpid()))
+  db.commit()
+  return result.rowcount == 1
+
+def pid_alive(pid: int) -> bool:
+  if pid == os.getpid():
+    return False
+  try:
+    os.kill(pid, 0)
+    return True
+  except ProcessLookupError:
+    return False
+  except PermissionError: # exists, owned by another user
+    return True
+
+# ============================
+# Worker side (in a worker process)
+# ============================
+def run_job(job_id: str):
+  trade_months, export_after = set(), False
+  db = SessionLocal()
+  try:
+    job = db.get(model.Job, job_id)
+    if job is None or job.status != "queued": # finished, cancelled, or run by another worker
+      return
+    if job.cancel_requested:
+      finish_job(db, job, "cancelled")
+      return
+    if not claim_job(db, job_id, (job.status, job.pid), "running"):
+      return
+    db.refresh(job)
+    job.started_at = job.started_at or datetime.now(UTC)
+    if job.kind == "export":
+      db.commit()
+      if job.months: # the trade months of an ingestion job (see export_job)
+        cancelled = export_months(db, job)
+      else:
+        cancelled = export.export_all(db.get_bind(), should_stop=lambda: cancel_requested(job_id))["cancelled"]
+      finish_job(db, job, "cancelled" if cancelled else "succeeded")
+      return
+    daily_sync = job.kind == "daily_sync"
+    done = {month.start_date for month in job.months if month.status in DONE_MONTH_STATUSES}
+    months = [(start, end) for start, end in transact_mgr.month_ranges(job.start_year, daily_sync, job.as_of) if parse_month_date(start) not in done]
+    skipped = []
+    if job.kind != "refresh":
+      months, skipped, _ = ledger.plan(db, months)
+    known = {month.start_date: month for month in job.months}
+    for (start, end), status in [(m, "pending") for m in months] + [(m, "skipped") for m in skipped]: # every month is listed up front, so the progress has a total
+      month = known.get(parse_month_date(start))
+      if month is None:
+        job.months.append(model.JobMonth(start_date=parse_month_date(start), end_date=parse_month_date(end), status=status))
+      else:
+        month.status, month.error = status, None
+    db.commit()
+    logger.info("Job started", extra={"job_id": job_id, "kind": job.kind, "start_year": job.start_year, "months": len(months), "done": len(done), "skipped": len(skipped)})
+
+    hooks = dict(on_month=lambda month: record_month(job_id, month), should_stop=lambda: cancel_requested(job_id))
+    if job.kind == "refresh": # built aside and swapped in at the end, resumed from the shadow table after a restart
+      report = transact_mgr.refresh_data(db, job.start_year, months=months, resume=bool(done), **hooks)
+    else:
+      report = transact_mgr.extract_data(db, job.start_year, daily_sync, months=months, trade_months=trade_months, **hooks)
+    logger.info("Job summary", extra={"job_id": job_id, "summary": report.summary()})
+    db.refresh(job)
+    if any(month.status == "cancelled" for month in report.months) or job.cancel_requested:
+      finish_job(db, job, "cancelled")
+    elif report.failed:
+      finish_job(db, job, "failed", f"{len(report.failed)} month(s) failed")
+    else:
+      finish_job(db, job, "succeeded")
+    export_after = settings.EXPORT_ENABLED and (job.status == "succeeded" if job.kind == "refresh" else bool(trade_months))
+  except Exception as e:
+    logger.exception("Job failed", extra={"job_id": job_id})
+    db.rollback()
+    job = db.get(model.Job, job_id)
+    if job is not None:
+      finish_job(db, job, "failed", f"{type(e).__name__}: {e}")
+  finally:
+    db.close()
+    flush_metrics()
+  if export_after:
+    export_job(job_id, trade_months or None) # a refresh loads a shadow table, exported whole once swapped in
+
+def export_job(job_id: str, trade_months: Optional[set]):
+  '''
+  Run an export job after the ingestion job job_id, in this worker: the partitions of trade_months, or all of them.
+  A failure to record the export job is logged, the ingestion job is already finished.
+  '''
+  db = SessionLocal()
+  try:
+    job = model.Job(kind="export", pid=os.getpid(), months=[
+      model.JobMonth(start_date=date(year, month, 1), end_date=date(year, month, calendar.monthrange(year, month)[1]))
+      for year, month in sorted(trade_months or ())
+    ])
+    db.add(job)
+    db.commit()
+    export_id = job.id
+  except Exception:
+    logger.exception("Failed to queue the export", extra={"job_id": job_id})
+    return
+  finally:
+    db.close()
+  logger.info("Exporting the imported months", extra={"job_id": export_id, "after": job_id, "months": len(trade_months) if trade_months else "all"})
+  run_job(export_id)
+
+def export_months(db, job: model.Job) -> bool:
+  '''
+  Rewrite the partitions of the months of an export job, each one recorded like an ingested month (resumed after a restart).
+  Returns: True if the job was cancelled
+  '''
+  with db.get_bind().connect() as conn:
+    for month in job.months:
+      if month.status != "pending":
+        continue
+      if cancel_requested(job.id):
+        return True
+      started = time.perf_counter()
+      month.rows = export.write_month(conn, month.start_date.year, month.start_date.month)
+      month.status, month.seconds, month.finished_at = "loaded", round(time.perf_counter() - started, 3), datetime.now(UTC)
+      db.commit()
+  return False
+
+def finish_job(db, job: model.Job, status: str, error: str = None):
+  job.status = status
+  job.error = error
+  job.finished_at = datetime.now(UTC)
+  db.commit()
+
+def record_month(job_id: str, result: MonthResult):
+  ''' Checkpoint of a month (pipeline on_month hook, called in the load thread with its own session) '''
+  db = SessionLocal()
+  try:
+    month = db.scalars(select(model.JobMonth).where(
+      model.JobMonth.job_id == job_id, model.JobMonth.start_date == parse_month_date(result.start_date)
+    )).first()
+    if month is None:
+      month = model.JobMonth(job_id=job_id, start_date=parse_month_date(result.start_date), end_date=parse_month_date(result.end_date))
+      db.add(month)
+    month.status = result.status
+    month.rows = result.rows
+    month.seconds = round(sum(result.timings.values()), 3)
+    month.error = result.error
+    month.finished_at = datetime.now(UTC)
+    db.commit()
+  finally:
+    db.close()
+  flush_metrics()
+
+def flush_metrics():
+  ''' Publish the metrics of this worker process to the API process (see services/metrics.py), a failure does not fail the job '''
+  try:
+    metrics.flush()
+  except OSError as e:
+    logger.warning("Failed to write the metrics snapshot", extra={"error": str(e)})
+
+def cancel_requested(job_id: str) -> bool:
+  db = SessionLocal()
+  try:
+    return bool(db.scalar(select(model.Job.cancel_requested).where(model.Job.id == job_id)))
+  finally:
+    db.close()
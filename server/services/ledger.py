@@ -0,0 +1,79 @@
+import hashlib
+from datetime import date, datetime, timedelta, UTC
+from typing import Optional
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+import settings
+from db import SessionLocal
+from models import ledger as model
+from services.pipeline import MonthResult
+
+'''
+Ingestion ledger: the outcome of the last import of every filing date range (see models/ledger.py).
+The screener is queried by filing date, so a range which ended more than LEDGER_REFETCH_DAYS ago does not change any more:
+once imported it is skipped by the next bootstraps. The recent and failed ranges are fetched again, and the content hash
+of their rows tells the pipeline whether they changed since their last import (an unchanged range is not loaded again).
+'''
+
+DONE_STATUSES = ("loaded", "empty", "unchanged")
+
+def parse_range_date(value: str) -> date:
+  return datetime.strptime(value, "%m/%d/%Y").date() # MM/DD/YYYY, as built by transaction.month_ranges
+
+def fingerprint(rows: list) -> str:
+  ''' sha256 of the parsed rows of a page, independent of the markup around them '''
+  digest = hashlib.sha256()
+  for row in rows:
+    digest.update("\x1f".join(cell or "" for cell in row).encode())
+    digest.update(b"\x1e")
+  return digest.hexdigest()
+
+def entries(db: Session, months: list[tuple[str, str]]) -> dict:
+  ''' Returns: {(start_date, end_date): IngestionLedger} of the ranges already in the ledger '''
+  if not months:
+    return {}
+  starts = [parse_range_date(start) for start, _ in months]
+  query = select(model.IngestionLedger).where(model.IngestionLedger.start_date.between(min(starts), max(starts)))
+  return {(entry.start_date, entry.end_date): entry for entry in db.scalars(query)}
+
+def plan(db: Session, months: list[tuple[str, str]], refetch_days: int = settings.LEDGER_REFETCH_DAYS, today: Optional[date] = None):
+  '''
+  Split the ranges of a bootstrap into the ones to fetch and the ones to skip.
+  Returns: (months to fetch, months skipped, known_hashes {start_date: content hash} of the months to fetch)
+  '''
+  cutoff = (today or date.today()) - timedelta(days=refetch_days)
+  ledger = entries(db, months)
+  to_fetch, skipped, known_hashes = [], [], {}
+  for start, end in months:
+    entry = ledger.get((parse_range_date(start), parse_range_date(end)))
+    done = entry is not None and entry.status in DONE_STATUSES
+    if done and entry.end_date < cutoff:
+      skipped.append((start, end))
+      continue
+    to_fetch.append((start, end))
+    if done and entry.content_hash:
+      known_hashes[start] = entry.content_hash
+  return to_fetch, skipped, known_hashes
+
+def record(result: MonthResult):
+  ''' Write the outcome of a range (pipeline on_month hook, called in the load thread with its own session) '''
+  if result.status not in DONE_STATUSES + ("failed",):
+    return # cancelled: nothing happened
+  db = SessionLocal()
+  try:
+    key = (parse_range_date(result.start_date), parse_range_date(result.end_date))
+    entry = db.get(model.IngestionLedger, key)
+    if entry is None:
+      entry = model.IngestionLedger(start_date=key[0], end_date=key[1])
+      db.add(entry)
+    entry.status = result.status
+    entry.fetched_at = result.fetched_at or entry.fetched_at
+    entry.fetch_seconds = result.timings.get("fetch")
+    entry.error = result.error
+    if result.status in ("loaded", "empty"): # the last good import: a failure keeps it, unchanged means it is still right
+      entry.rows = result.rows
+      entry.content_hash = result.content_hash
+      entry.loaded_at = datetime.now(UTC)
+    db.commit()
+  finally:
+    db.close()
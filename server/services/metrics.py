@@ -0,0 +1,254 @@
+import bisect, json, math, os, threading, uuid
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from time import perf_counter
+from typing import Callable, Iterable
+import settings
+
+'''
+Metrics of the service in the Prometheus text format (GET /metrics), without the client library: counters and histograms
+with labels, used like the prometheus_client ones (METRIC.labels(*values).inc() / .observe(seconds)).
+Values only known when scraped (Redis breaker and pools, cache counters) come from collectors, called by render.
+The jobs run in worker processes of their own (services/jobs.py): flush writes the metrics of such a process to
+METRICS_DIR, one JSON snapshot per process, and the API process adds the snapshots to its own metrics when it renders,
+so the ingestion metrics show up next to the request ones. The snapshots are dropped when the API process starts.
+A snapshot is named after a random id of its process, not its pid: a pid reused by a later worker would overwrite the
+snapshot of the dead one, and the summed counters would go backwards.
+'''
+
+# seconds, for request handlers and queries
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# seconds, for the stages of a scraped month
+SLOW_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+class Metric(ABC):
+  kind = "untyped"
+
+  def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (), registry: "Registry" = None):
+    self.name = name
+    self.documentation = documentation
+    self.labelnames = tuple(labelnames)
+    self.children = {} # label values -> child
+    self.lock = threading.Lock()
+    (registry or REGISTRY).register(self)
+
+  def labels(self, *values: str):
+    ''' The child of the label values (strings, in labelnames order), created on first use '''
+    child = self.children.get(values)
+    if child is None:
+      if len(values) != len(self.labelnames):
+        raise ValueError(f"{self.name} expects the labels {self.labelnames}, got {values}")
+      with self.lock:
+        child = self.children.setdefault(values, self.new_child())
+    return child
+
+  @abstractmethod
+  def new_child(self):
+    ''' A child of the metric, for one set of label values '''
+
+  def definition(self) -> dict:
+    return {"kind": self.kind, "help": self.documentation, "labelnames": list(self.labelnames)}
+
+  def state(self) -> list:
+    ''' [[label values, value]] of the children '''
+    with self.lock:
+      children = list(self.children.items())
+    return [[list(key), child.state()] for key, child in children]
+
+class CounterChild:
+  def __init__(self, lock: threading.Lock):
+    self.lock = lock
+    self.value = 0.0
+
+  def inc(self, amount: float = 1):
+    with self.lock:
+      self.value += amount
+
+  def state(self) -> float:
+    return self.value
+
+class Counter(Metric):
+  kind = "counter"
+
+  def new_child(self) -> CounterChild:
+    return CounterChild(self.lock)
+
+  def inc(self, amount: float = 1):
+    self.labels().inc(amount)
+
+class HistogramChild:
+  def __init__(self, lock: threading.Lock, buckets: tuple):
+    self.lock = lock
+    self.buckets = buckets
+    self.counts = [0] * (len(buckets) + 1) # per bucket (not cumulative), the last one is +Inf
+    self.sum = 0.0
+
+  def observe(self, value: float):
+    index = bisect.bisect_left(self.buckets, value) # the first bucket whose upper bound is >= value
+    with self.lock:
+      self.counts[index] += 1
+      self.sum += value
+
+  @contextmanager
+  def time(self):
+    started = perf_counter()
+    try:
+      yield
+    finally:
+      self.observe(perf_counter() - started)
+
+  def state(self) -> list:
+    with self.lock:
+      return self.counts + [self.sum]
+
+class Histogram(Metric):
+  kind = "histogram"
+
+  def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (), buckets: Iterable[float] = DEFAULT_BUCKETS, registry: "Registry" = None):
+    self.buckets = tuple(sorted(buckets))
+    super().__init__(name, documentation, labelnames, registry)
+
+  def new_child(self) -> HistogramChild:
+    return HistogramChild(self.lock, self.buckets)
+
+  def observe(self, value: float):
+    self.labels().observe(value)
+
+  def time(self):
+    return self.labels().time()
+
+  def definition(self) -> dict:
+    return {**super().definition(), "buckets": list(self.buckets)}
+
+# a collector returns [(name, kind, help, [(labels dict, value)])], kind: counter or gauge
+Collector = Callable[[], Iterable[tuple[str, str, str, list[tuple[dict, float]]]]]
+
+class Registry:
+  def __init__(self):
+    self.metrics: dict[str, Metric] = {}
+    self.collectors: list[Collector] = []
+
+  def register(self, metric: Metric):
+    if metric.name in self.metrics:
+      raise ValueError(f"Metric {metric.name} is already registered.")
+    self.metrics[metric.name] = metric
+
+  def add_collector(self, collector: Collector):
+    self.collectors.append(collector)
+
+  def snapshot(self) -> dict:
+    ''' {name: {kind, help, labelnames, (buckets,) samples: [[label values, value]]}}, JSON serializable '''
+    return {name: {**metric.definition(), "samples": metric.state()} for name, metric in self.metrics.items()}
+
+REGISTRY = Registry()
+
+# ============================
+# Worker process snapshots
+# ============================
+_process_id = None # (pid, id)
+
+def process_id() -> str:
+  ''' Unique to this process, the pid and a random part (drawn again in a forked child) '''
+  global _process_id
+  if _process_id is None or _process_id[0] != os.getpid():
+    _process_id = (os.getpid(), f"{os.getpid()}-{uuid.uuid4().hex}")
+  return _process_id[1]
+
+def snapshot_path(process: str) -> str:
+  return os.path.join(settings.METRICS_DIR, f"{process}.json")
+
+def flush(registry: Registry = REGISTRY):
+  ''' Write the metrics of this process to METRICS_DIR (called by the job workers, after every month) '''
+  if not settings.METRICS_ENABLED:
+    return
+  os.makedirs(settings.METRICS_DIR, exist_ok=True)
+  path = snapshot_path(process_id())
+  with open(path + ".tmp", "w") as f:
+    json.dump(registry.snapshot(), f)
+  os.replace(path + ".tmp", path) # the API process never reads a partial file
+
+def clear_snapshots():
+  ''' Drop the snapshots of the worker processes (main.lifespan: their counters restart with the server) '''
+  if not os.path.isdir(settings.METRICS_DIR):
+    return
+  for name in os.listdir(settings.METRICS_DIR):
+    if name.endswith((".json", ".tmp")):
+      os.remove(os.path.join(settings.METRICS_DIR, name))
+
+def read_snapshots() -> list[dict]:
+  ''' The snapshots of the other processes, an unreadable one is skipped '''
+  if not os.path.isdir(settings.METRICS_DIR):
+    return []
+  own = os.path.basename(snapshot_path(process_id()))
+  snapshots = []
+  for name in os.listdir(settings.METRICS_DIR):
+    if not name.endswith(".json") or name == own:
+      continue
+    try:
+      with open(os.path.join(settings.METRICS_DIR, name)) as f:
+        snapshots.append(json.load(f))
+    except (OSError, ValueError):
+      continue
+  return snapshots
+
+def merge(snapshots: list[dict]) -> dict:
+  ''' Sum the samples of the same metric and labels across snapshots '''
+  merged = {}
+  for snapshot in snapshots:
+    for name, metric in snapshot.items():
+      target = merged.setdefault(name, {**metric, "samples": {}})
+      for labels, value in metric["samples"]:
+        key = tuple(labels)
+        previous = target["samples"].get(key)
+        if previous is None:
+          target["samples"][key] = value
+        elif isinstance(value, list):
+          target["samples"][key] = [a + b for a, b in zip(previous, value)]
+        else:
+          target["samples"][key] = previous + value
+  return merged
+
+# ============================
+# Text exposition format
+# ============================
+def format_value(value: float) -> str:
+  if value == math.inf:
+    return "+Inf"
+  if float(value).is_integer():
+    return str(int(value))
+  return repr(float(value))
+
+def escape(value: str) -> str:
+  return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def format_labels(labels: dict) -> str:
+  if not labels:
+    return ""
+  return "{" + ",".join(f'{name}="{escape(value)}"' for name, value in labels.items()) + "}"
+
+def render_metric(name: str, metric: dict) -> list[str]:
+  lines = [f"# HELP {name} {metric['help']}", f"# TYPE {name} {metric['kind']}"]
+  for key, value in sorted(metric["samples"].items()):
+    labels = dict(zip(metric["labelnames"], key))
+    if metric["kind"] != "histogram":
+      lines.append(f"{name}{format_labels(labels)} {format_value(value)}")
+      continue
+    *counts, total = value
+    cumulative = 0
+    for bound, count in zip(list(metric["buckets"]) + [math.inf], counts):
+      cumulative += count
+      lines.append(f"{name}_bucket{format_labels({**labels, 'le': format_value(bound)})} {cumulative}")
+    lines.append(f"{name}_sum{format_labels(labels)} {format_value(total)}")
+    lines.append(f"{name}_count{format_labels(labels)} {cumulative}")
+  return lines
+
+def render(registry: Registry = REGISTRY) -> str:
+  ''' The metrics of this process, the snapshots of the job workers and the collectors, in the text exposition format '''
+  lines = []
+  for name, metric in merge([registry.snapshot()] + read_snapshots()).items():
+    lines += render_metric(name, metric)
+  for collector in registry.collectors:
+    for name, kind, documentation, samples in collector():
+      lines += [f"# HELP {name} {documentation}", f"# TYPE {name} {kind}"]
+      lines += [f"{name}{format_labels(labels)} {format_value(value)}" for labels, value in samples]
+  return "\n".join(lines) + "\n"
@@ -0,0 +1,281 @@
+import asyncio, logging, time
+from datetime import datetime, UTC
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Optional
+import settings
+from services import metrics
+from services.utils.fetcher import AsyncFetcher, FetchError
+
+'''
+Extraction pipeline: fetch -> parse -> normalize -> load, one item per month.
+The stages are joined by bounded queues, so months are downloaded concurrently (within the fetcher's politeness budget)
+while the earlier months are already being parsed and loaded. A full queue makes the upstream stage wait (back-pressure),
+which keeps at most a few pages in memory whatever the number of months.
+  - fetch: AsyncFetcher (async, fetch concurrency)
+  - parse, normalize: worker threads (parse_workers). With a stream_parser, a page is parsed while it downloads
+    (AsyncFetcher.fetch_stream: each chunk is fed to the parser in a worker thread) and is never held whole, only its rows
+  - load: a single thread, so the database only ever has one writer
+  - archive (optional side sink): the parsed rows are also handed to a separate thread (e.g. to write the CSV archive),
+    it runs beside the load (only holding the pipeline back when it falls queue_size months behind)
+    and an archive failure does not fail the month
+A failing month is recorded in the report and does not stop the other months.
+fingerprint(raw rows) -> str hashes the content of a parsed month: a month whose hash is the one in known_hashes
+({start_date: hash}) has not changed since its last import, it is not normalized nor loaded again (status unchanged).
+on_month is called (in the load thread) with every month reaching its final status, e.g. to persist the progress of a job;
+should_stop is checked before each fetch: once it returns True, the remaining months are cancelled and the months
+already fetched go through the end of the pipeline.
+'''
+
+_DONE = object() # end of stream marker
+
+class ParseFailed(Exception):
+  ''' An error of a stream parser (its __cause__), raised through the fetcher, which only retries the transport errors '''
+
+logger = logging.getLogger(__name__)
+MONTHS = metrics.Counter("scrape_months_total", "Months through the extraction pipeline, by final status", ["status"])
+STAGE_SECONDS = metrics.Histogram("scrape_stage_duration_seconds", "Time of a month in each pipeline stage (fetch, parse, normalize, load, archive)", ["stage"], buckets=metrics.SLOW_BUCKETS)
+
+@dataclass
+class MonthResult:
+  start_date: str
+  end_date: str
+  status: str = "pending" # values: pending, loaded, empty, unchanged, failed, cancelled
+  rows: int = 0
+  fetched_at: Optional[datetime] = None
+  content_hash: Optional[str] = None
+  error: Optional[str] = None
+  archive_error: Optional[str] = None
+  timings: dict = field(default_factory=dict) # {stage: seconds}
+
+@dataclass
+class PipelineReport:
+  months: list[MonthResult] = field(default_factory=list)
+  seconds: float = 0
+  fetch_stats: dict = field(default_factory=dict)
+
+  @property
+  def rows(self) -> int:
+    return sum(m.rows for m in self.months)
+
+  @property
+  def failed(self) -> list[MonthResult]:
+    return [m for m in self.months if m.status == "failed"]
+
+  def summary(self) -> dict:
+    counts = {}
+    for m in self.months:
+      counts[m.status] = counts.get(m.status, 0) + 1
+    return {
+      "months": len(self.months),
+      "statuses": counts,
+      "rows": self.rows,
+      "seconds": round(self.seconds, 3),
+      "rows_per_sec": round(self.rows / self.seconds, 1) if self.seconds else None,
+      "failed": [{"start_date": m.start_date, "end_date": m.end_date, "error": m.error} for m in self.failed],
+      "archive_errors": sum(1 for m in self.months if m.archive_error),
+      "fetch": self.fetch_stats,
+    }
+
+async def run_pipeline(
+  months: list[tuple[str, str]],
+  build_url: Callable[[str, str], str],
+  parse: Callable[[str], list],
+  normalize: Callable[[MonthResult, list], Any],
+  load: Callable[[MonthResult, Any], int],
+  archive: Callable[[MonthResult, list], Any] = None,
+  fetcher: AsyncFetcher = None,
+  parse_workers: int = settings.PARSE_WORKERS,
+  queue_size: int = settings.PIPELINE_QUEUE_SIZE,
+  on_month: Callable[[MonthResult], Any] = None,
+  should_stop: Callable[[], bool] = None,
+  fingerprint: Callable[[list], str] = None,
+  known_hashes: dict = None,
+  stream_parser: Callable[[], Any] = None,
+) -> PipelineReport:
+  '''
+  months: [(start_date, end_date)], build_url turns one into the page url
+  parse(html) -> raw rows, normalize(month, raw rows) -> batch, load(month, batch) -> number of rows loaded
+  archive(month, raw rows), on_month(month), should_stop(), fingerprint(raw rows) and known_hashes are optional
+  stream_parser() -> a parser of one page, fed its chunks with feed(chunk), close() -> raw rows: used instead of parse
+  '''
+  report = PipelineReport(months=[MonthResult(start, end) for start, end in months])
+  started = time.perf_counter()
+  loop = asyncio.get_running_loop()
+  own_fetcher = fetcher is None
+  fetcher = fetcher or AsyncFetcher()
+
+  month_q = asyncio.Queue()
+  parse_q = asyncio.Queue(maxsize=queue_size)
+  load_q = asyncio.Queue(maxsize=queue_size)
+  archive_q = asyncio.Queue(maxsize=queue_size)
+  for month in report.months:
+    month_q.put_nowait(month)
+
+  def fail(month: MonthResult, stage: str, e: Exception):
+    month.status = "failed"
+    month.error = f"{stage}: {type(e).__name__}: {e}"
+    logger.warning(
+      "Month failed", extra={"start_date": month.start_date, "end_date": month.end_date, "stage": stage, "error": str(e)},
+      exc_info=not isinstance(e, (ValueError, IOError, FetchError)), # unexpected, keep the stack trace
+    )
+
+  def record(stage: str, month: MonthResult, seconds: float):
+    month.timings[stage] = seconds
+    STAGE_SECONDS.labels(stage).observe(seconds)
+
+  async def finished(month: MonthResult):
+    MONTHS.labels(month.status).inc()
+    if not on_month:
+      return
+    try:
+      await loop.run_in_executor(load_executor, on_month, month)
+    except Exception as e:
+      logger.error("Failed to record the progress of a month", extra={"start_date": month.start_date, "end_date": month.end_date, "error": str(e)})
+
+  async def fetch_worker():
+    while True:
+      try:
+        month = month_q.get_nowait()
+      except asyncio.QueueEmpty:
+        return
+      if should_stop and should_stop():
+        month.status = "cancelled"
+        await finished(month)
+        continue
+      stage_start = time.perf_counter()
+      try:
+        url = build_url(month.start_date, month.end_date)
+        page = await fetcher.fetch_stream(url, lambda chunks: parse_chunks(month, chunks)) if stream_parser else await fetcher.fetch(url)
+      except Exception as e:
+        fail(month, *(("parse", e.__cause__) if isinstance(e, ParseFailed) else ("fetch", e)))
+        await finished(month)
+        continue
+      finally:
+        record("fetch", month, time.perf_counter() - stage_start)
+      month.fetched_at = datetime.now(UTC)
+      await parse_q.put((month, page))
+
+  async def parse_chunks(month: MonthResult, chunks) -> list:
+    ''' Raw rows of a page read in chunks, fed to a new stream_parser (on every attempt of the fetcher) '''
+    parser, seconds = stream_parser(), 0
+    async def call(func, *args):
+      nonlocal seconds
+      call_start = time.perf_counter()
+      try:
+        return await loop.run_in_executor(parse_executor, func, *args)
+      except Exception as e:
+        raise ParseFailed() from e
+      finally:
+        seconds += time.perf_counter() - call_start
+    try:
+      async for chunk in chunks:
+        await call(parser.feed, chunk)
+      return await call(parser.close)
+    finally:
+      record("parse", month, seconds) # also counted in the fetch stage, which it overlaps
+
+  def timed(stage: str, month: MonthResult, func, *args):
+    stage_start = time.perf_counter()
+    try:
+      return func(*args)
+    finally:
+      record(stage, month, time.perf_counter() - stage_start)
+
+  async def parse_worker():
+    while True:
+      item = await parse_q.get()
+      if item is _DONE:
+        return
+      month, page = item
+      stage = "parse"
+      try:
+        rows = page if stream_parser else await loop.run_in_executor(parse_executor, timed, stage, month, parse, page)
+        if rows and fingerprint:
+          month.content_hash = await loop.run_in_executor(parse_executor, fingerprint, rows)
+          if known_hashes and known_hashes.get(month.start_date) == month.content_hash:
+            month.status = "unchanged"
+            await finished(month)
+            continue
+        if rows:
+          stage = "normalize"
+          batch = await loop.run_in_executor(parse_executor, timed, stage, month, normalize, month, rows)
+      except Exception as e:
+        fail(month, stage, e)
+        await finished(month)
+        continue
+      if not rows:
+        month.status = "empty"
+        logger.info("No data found for the month", extra={"start_date": month.start_date, "end_date": month.end_date})
+        await finished(month)
+        continue
+      if archive:
+        await archive_q.put((month, rows))
+      await load_q.put((month, batch))
+
+  def load_month(month: MonthResult, batch):
+    month.rows = timed("load", month, load, month, batch)
+    month.status = "loaded"
+
+  async def load_worker():
+    while True:
+      item = await load_q.get()
+      if item is _DONE:
+        return
+      month, batch = item
+      try:
+        await loop.run_in_executor(load_executor, load_month, month, batch)
+      except Exception as e:
+        fail(month, "load", e)
+      await finished(month)
+
+  async def archive_worker():
+    while True:
+      item = await archive_q.get()
+      if item is _DONE:
+        return
+      month, rows = item
+      try:
+        await loop.run_in_executor(archive_executor, timed, "archive", month, archive, month, rows)
+      except Exception as e:
+        month.archive_error = f"{type(e).__name__}: {e}"
+        logger.warning("Failed to archive a month", extra={"start_date": month.start_date, "end_date": month.end_date, "error": month.archive_error})
+
+  parse_executor = ThreadPoolExecutor(max_workers=parse_workers, thread_name_prefix="pipeline-parse")
+  load_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pipeline-load")
+  archive_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pipeline-archive")
+  try:
+    if own_fetcher:
+      await fetcher.__aenter__()
+    loader = asyncio.create_task(load_worker())
+    archiver = asyncio.create_task(archive_worker())
+    parsers = [asyncio.create_task(parse_worker()) for _ in range(parse_workers)]
+    await asyncio.gather(*(fetch_worker() for _ in range(fetcher.concurrency)))
+    for _ in parsers:
+      await parse_q.put(_DONE)
+    await asyncio.gather(*parsers)
+    await load_q.put(_DONE)
+    await archive_q.put(_DONE)
+    await loader
+    await archiver
+  finally:
+    if own_fetcher:
+      await fetcher.__aexit__(None, None, None)
+    parse_executor.shutdown(wait=True)
+    load_executor.shutdown(wait=True)
+    archive_executor.shutdown(wait=True)
+  report.seconds = time.perf_counter() - started
+  report.fetch_stats = fetcher.stats.summary()
+  return report
+
+def run_pipeline_sync(*args, **kwargs) -> PipelineReport:
+  '''
+  Run the pipeline from synchronous code (a job worker process, a thread of the threadpool).
+  Raises: RuntimeError when called from a thread running an event loop, which the whole pipeline would block:
+    await run_pipeline(...) there instead
+  '''
+  try:
+    asyncio.get_running_loop()
+  except RuntimeError:
+    return asyncio.run(run_pipeline(*args, **kwargs))
+  raise RuntimeError("run_pipeline_sync called from a running event loop, await run_pipeline() instead.")
@@ -0,0 +1,90 @@
+import hashlib, json, time
+from typing import Optional
+import settings
+from schemas import auth as schema
+from services import cache, metrics, redis_client, token_state
+
+'''
+Cache of the verified access tokens: token -> (client, scopes), so an authenticated request skips the JWT verification
+and the client lookup (see routers.auth.get_current_client).
+Two tiers, like the response cache: an in-process LRU (a dict lookup, AUTH_CACHE_TTL seconds at most) in front of Redis,
+shared by the workers and keyed by a hash of the token. No entry outlives its token.
+revoke and invalidate_client drop the entries from Redis and from the LRU of this process, the LRU of the other workers
+may still hold them for AUTH_CACHE_TTL seconds.
+'''
+
+KEY_PREFIX = "principal:"
+CLIENT_PREFIX = "principal-client:" # set of the keys of a client, for invalidate_client
+
+lru = cache.LRUCache(settings.AUTH_CACHE_SIZE, settings.AUTH_CACHE_TTL)
+LOOKUPS = metrics.Counter("auth_cache_lookups_total", "Verified access token cache lookups, by tier of the hit or miss", ["result"])
+LOCAL_HIT, REDIS_HIT, MISS = LOOKUPS.labels("local_hit"), LOOKUPS.labels("redis_hit"), LOOKUPS.labels("miss")
+
+def redis_key(token: str) -> str:
+  return KEY_PREFIX + hashlib.sha256(token.encode()).hexdigest()
+
+def client_tag(client_id: str) -> str:
+  return f"client:{client_id}"
+
+async def get_async(token: str) -> Optional[tuple[schema.Client, list[str]]]:
+  ''' Returns: (client, scopes) of a token verified before, None if it is not cached '''
+  if not settings.AUTH_CACHE_ENABLED:
+    return None
+  principal = lru.get(token)
+  if principal is not None:
+    LOCAL_HIT.inc()
+    return principal
+  _, value = await redis_client.call_async(lambda client: client.get(redis_key(token)))
+  if value is None:
+    MISS.inc()
+    return None
+  REDIS_HIT.inc()
+  entry = json.loads(value)
+  principal = (schema.Client(**entry["client"]), entry["scopes"])
+  lru.set(token, principal, [client_tag(principal[0].client_id)], min(settings.AUTH_CACHE_TTL, entry["exp"] - time.time()))
+  return principal
+
+async def put_async(token: str, client: schema.Client, scopes: list[str], exp: Optional[int]) -> bool:
+  '''
+  Cache a verified token until exp (seconds since the epoch).
+  A revocation landing between the caller's check and the put would be cached over for the lifetime of the token: the
+  token is checked again once stored (a revocation is recorded before its entry is dropped), and dropped if revoked.
+  Returns: False if the token was revoked in the meantime
+  '''
+  if not settings.AUTH_CACHE_ENABLED or not exp:
+    return True
+  ttl = exp - time.time()
+  if ttl <= 0:
+    return True
+  lru.set(token, (client, scopes), [client_tag(client.client_id)], min(settings.AUTH_CACHE_TTL, ttl))
+  key = redis_key(token)
+  def queue_put(pipe):
+    pipe.set(key, json.dumps({"client": client.model_dump(), "scopes": scopes, "exp": exp}), ex=max(1, int(ttl)))
+    pipe.sadd(CLIENT_PREFIX + client.client_id, key)
+    pipe.expire(CLIENT_PREFIX + client.client_id, max(int(ttl), int(float(settings.ACCESS_TOKEN_EXPIRE_MINUTES) * 60)))
+  await redis_client.execute_async(queue_put)
+  if await token_state.backend.is_revoked(token):
+    await revoke_async(token)
+    return False
+  return True
+
+async def revoke_async(token: str):
+  ''' Drop a token, e.g. on logout: the next request with it is verified again (and refused) '''
+  lru.delete(token)
+  await redis_client.call_async(lambda client: client.delete(redis_key(token)))
+
+async def invalidate_client_async(client_id: str) -> int:
+  '''
+  Drop every token of a client, e.g. when it is deactivated or its role changes.
+  Returns: the number of entries dropped
+  '''
+  dropped = lru.invalidate({client_tag(client_id)})
+  _, keys = await redis_client.call_async(lambda client: client.smembers(CLIENT_PREFIX + client_id))
+  if keys is None: # Redis unavailable, its entries expire with their tokens
+    return dropped
+  def queue_delete(pipe):
+    if keys:
+      pipe.delete(*keys)
+    pipe.delete(CLIENT_PREFIX + client_id)
+  results = await redis_client.execute_async(queue_delete)
+  return dropped + (results[0] if results and keys else 0)
@@ -1,76 +1,163 @@
-from fastapi import Depends, HTTPException
-from sqlalchemy.orm import Session
-from datetime import datetime, timedelta, UTC
-import redis, json, time
+from typing import Optional
+import redis, redis.asyncio, os, secrets, threading, time, zlib
 
-from models import client as model
 import settings
+from services import metrics, redis_client as redis_connections
+
+DECISIONS = metrics.Counter("rate_limit_decisions_total", "Rate limiter decisions, by backend (redis: shared sliding window, local: in-process fallback)", ["backend", "decision"])
+REDIS_ALLOWED, REDIS_REJECTED = DECISIONS.labels("redis", "allowed"), DECISIONS.labels("redis", "rejected")
+LOCAL_ALLOWED, LOCAL_REJECTED = DECISIONS.labels("local", "allowed"), DECISIONS.labels("local", "rejected")
 
 class RateLimitExceededException(Exception):
-  pass
+  def __init__(self, retry_after: Optional[float] = None):
+    super().__init__("Rate limit exceeded")
+    self.retry_after = retry_after # seconds until the next request is allowed
+
+'''
+Sliding window log in one atomic round trip: the sorted set of a client holds the timestamps (ms, Redis server clock) of its
+requests in the last window. Old ones are trimmed, and the request is recorded only if the window is not full.
+Returns: {1, 0} when allowed, {0, ms until the oldest request leaves the window} when rejected
+'''
+SLIDING_WINDOW_LUA = """
+local now = redis.call('TIME')
+local now_ms = tonumber(now[1]) * 1000 + math.floor(tonumber(now[2]) / 1000)
+local window_ms = tonumber(ARGV[1])
+local limit = tonumber(ARGV[2])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], 0, now_ms - window_ms)
+if redis.call('ZCARD', KEYS[1]) < limit then
+  redis.call('ZADD', KEYS[1], now_ms, now_ms .. '-' .. ARGV[3])
+  redis.call('PEXPIRE', KEYS[1], window_ms)
+  return {1, 0}
+end
+local oldest = redis.call('ZRANGE', KEYS[1], 0, 0, 'WITHSCORES')
+return {0, tonumber(oldest[2]) + window_ms - now_ms}
+"""
+
+_script = _async_script = None
+# members of the sorted set must be unique for two requests in the same millisecond, from any worker or host
+_member_prefix = f"{os.getpid()}-{secrets.token_hex(4)}"
+_request_seq = 0
+_seq_lock = threading.Lock()
+
+def next_member() -> str:
+  global _request_seq
+  with _seq_lock:
+    _request_seq += 1
+    return f"{_member_prefix}:{_request_seq}"
 
 def validate_rate_limit_with_redis(redis_client: redis.Redis, redis_key: str, max_api_count: int, rate_windows_seconds: int):
-  # Check if the key exists in Redis
-  try:
-    if (redis_client.ping()):
-      print("Redis is available")
-      if not redis_client.exists(redis_key):
-        redis_client.set(redis_key, 1, ex=rate_windows_seconds)  # set value 1 with expiry of window_seconds
-      else:
-        redis_client.incrby(redis_key, 1) # increment the value
-      print("Redis key: ", redis_key)
-      print("Redis value: ", redis_client.get(redis_key))
-      count = int(redis_client.get(redis_key))
-      if count >= max_api_count:
-        raise RateLimitExceededException()
-      return True
-  except redis.exceptions.ConnectionError as e:
-    print("error: Could not connect to Redis: ", e)
-    return False
-
-def validate_rate_limit_with_sqlite(db: Session, current_user_id: str, max_api_count: int, rate_windows_seconds: int):
-  # Fallback to sqlite3 if Redis is not available
-  now = datetime.now(UTC)
-  window_start = now - timedelta(seconds=rate_windows_seconds)
-  # print("Current User id: ", current_user_id, ", Window start: ", window_start)
-  # Delete old timestamps (older than the rate window)
-  db.query(model.Request_Log).filter(
-    model.Request_Log.client_id == current_user_id,
-    model.Request_Log.timestamp < window_start
-  ).delete()
-  
-  # Count how many requests remain in the window
-  count = db.query(model.Request_Log).filter(
-    model.Request_Log.client_id == current_user_id,
-    model.Request_Log.timestamp >= window_start
-  ).count()
-  # print("Count: ", count)
-
-  # Block if the count is ≥ limit, otherwise, allow and log the new timestamp
-  if count >= max_api_count:
-    raise RateLimitExceededException()
-  else:
-    # Log the request    
-    new_request = model.Request_Log(client_id=current_user_id)
-    db.add(new_request)
-    db.commit() 
-    db.refresh(new_request)
-
-def validate_rate_limit(current_user, db: Session, redis_client: redis.Redis):
+  '''
+  Raises: RateLimitExceededException, redis.RedisError when Redis is not available
+  '''
+  global _script
+  if _script is None:
+    _script = redis_client.register_script(SLIDING_WINDOW_LUA) # EVALSHA, the script is loaded again on NOSCRIPT
+  allowed, retry_after_ms = _script(keys=[redis_key], args=[rate_windows_seconds * 1000, max_api_count, next_member()], client=redis_client)
+  if not allowed:
+    raise RateLimitExceededException(retry_after_ms / 1000)
+
+async def validate_rate_limit_with_redis_async(redis_client: redis.asyncio.Redis, redis_key: str, max_api_count: int, rate_windows_seconds: int):
+  '''
+  Raises: RateLimitExceededException, redis.RedisError when Redis is not available
+  '''
+  global _async_script
+  if _async_script is None:
+    _async_script = redis_client.register_script(SLIDING_WINDOW_LUA)
+  allowed, retry_after_ms = await _async_script(keys=[redis_key], args=[rate_windows_seconds * 1000, max_api_count, next_member()], client=redis_client)
+  if not allowed:
+    raise RateLimitExceededException(retry_after_ms / 1000)
+
+class ShardedTokenBucket:
+  '''
+  In-process token buckets (capacity `limit`, refilled at limit / window tokens per second), one per key.
+  The keys are spread over shards with their own lock, so concurrent requests of different clients rarely wait on each other.
+  Full buckets are dropped when a shard grows past max_keys_per_shard: an absent bucket is a full one.
+  '''
+  def __init__(self, shards: int = 16, max_keys_per_shard: int = 4096):
+    self.shards = [({}, threading.Lock()) for _ in range(shards)]
+    self.max_keys_per_shard = max_keys_per_shard
+
+  def acquire(self, key: str, limit: int, window_seconds: float) -> float:
+    '''
+    Take a token for key.
+    Returns: 0 when allowed, else the seconds until a token is available
+    '''
+    rate = limit / window_seconds
+    buckets, lock = self.shards[zlib.crc32(key.encode()) % len(self.shards)]
+    now = time.monotonic()
+    with lock:
+      tokens, updated = buckets.get(key, (limit, now))
+      tokens = min(limit, tokens + (now - updated) * rate)
+      if tokens < 1:
+        buckets[key] = (tokens, now)
+        return (1 - tokens) / rate
+      buckets[key] = (tokens - 1, now)
+      if len(buckets) > self.max_keys_per_shard:
+        self.prune(buckets, now, limit, rate)
+      return 0
+
+  @staticmethod
+  def prune(buckets: dict, now: float, limit: int, rate: float):
+    for key in [key for key, (tokens, updated) in buckets.items() if tokens + (now - updated) * rate >= limit]:
+      del buckets[key]
+
+local_buckets = ShardedTokenBucket()
+
+def validate_rate_limit_locally(redis_key: str, max_api_count: int, rate_windows_seconds: int):
+  # Fallback when Redis is not available: the limit is enforced per worker process
+  retry_after = local_buckets.acquire(redis_key, max_api_count, rate_windows_seconds)
+  if retry_after:
+    LOCAL_REJECTED.inc()
+    raise RateLimitExceededException(retry_after)
+  LOCAL_ALLOWED.inc()
+
+def rate_limit_of(current_user) -> tuple[str, int, int]:
+  ''' Returns: (redis_key, max_api_count, rate_windows_seconds) of the client '''
   # Fetch the rate limit configuration based on the user's role
   role = current_user.role or "client"  # default to client
   rate_config = settings.RATE_LIMIT_CONFIG.get(role, settings.RATE_LIMIT_CONFIG["client"]) # default to client
-  max_api_count = rate_config["limit"]
-  rate_windows_seconds = rate_config["window_seconds"]
+  return f"rate_limit:{current_user.client_id}", rate_config["limit"], rate_config["window_seconds"]
 
-  # Redis key is a combination of client_id and the current time divided by the window size
-  redis_bucket_num = int(time.time()) // rate_windows_seconds  # convert to Unix epoch and divided it by window_seconds to get the window/bucket
-  redis_key = f"rate_limit:{current_user.client_id}:{redis_bucket_num}" 
+def validate_rate_limit(current_user, redis_client: Optional[redis.Redis]):
+  '''
+  Raises: RateLimitExceededException (with retry_after) when the client used up the limit of its role
+  '''
+  redis_key, max_api_count, rate_windows_seconds = rate_limit_of(current_user)
 
   # Perform rate limiting with Redis
-  if validate_rate_limit_with_redis(redis_client, redis_key, max_api_count, rate_windows_seconds) == False:
-    # Fallback to sqlite3 if Redis is not available
-    current_user_id = current_user.client_id
-    validate_rate_limit_with_sqlite(db, current_user_id, max_api_count, rate_windows_seconds)
-
+  if redis_client is not None:
+    try:
+      validate_rate_limit_with_redis(redis_client, redis_key, max_api_count, rate_windows_seconds)
+    except RateLimitExceededException:
+      redis_connections.succeeded()
+      REDIS_REJECTED.inc()
+      raise
+    except redis.RedisError as e:
+      redis_connections.failed(e)
+    else:
+      redis_connections.succeeded()
+      REDIS_ALLOWED.inc()
+      return
+  # Fallback to the in-process buckets if Redis is not available
+  validate_rate_limit_locally(redis_key, max_api_count, rate_windows_seconds)
 
+async def validate_rate_limit_async(current_user, redis_client: Optional[redis.asyncio.Redis]):
+  '''
+  validate_rate_limit for the request handlers, through the asyncio Redis client
+  Raises: RateLimitExceededException (with retry_after) when the client used up the limit of its role
+  '''
+  redis_key, max_api_count, rate_windows_seconds = rate_limit_of(current_user)
+  if redis_client is not None: # None while the circuit breaker of redis_client is open
+    try:
+      await validate_rate_limit_with_redis_async(redis_client, redis_key, max_api_count, rate_windows_seconds)
+    except RateLimitExceededException:
+      redis_connections.succeeded()
+      REDIS_REJECTED.inc()
+      raise
+    except redis.RedisError as e:
+      redis_connections.failed(e)
+    else:
+      redis_connections.succeeded()
+      REDIS_ALLOWED.inc()
+      return
+  validate_rate_limit_locally(redis_key, max_api_count, rate_windows_seconds)
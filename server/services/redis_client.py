@@ -1,20 +1,247 @@
-import redis 
+import logging, threading, time
+from typing import Any, Awaitable, Callable, Optional
+import redis, redis.asyncio
 import settings
-from fastapi import Depends
-
-# Create Redis connection pool
-def create_redis_pool() -> redis.ConnectionPool:
-  return redis.ConnectionPool(
-    host=settings.REDIS_URL,  
-    password=settings.REDIS_PASSWORD,
-    port=settings.REDIS_PORT, 
-    db=0, 
-    decode_responses=True  
-) 
-
-# Get Redis client using the connection pool
-def get_redis_client(pool: redis.ConnectionPool = Depends(create_redis_pool)) -> redis.Redis:
+from services import metrics
+
+'''
+Redis connections of the process: one connection pool per client flavour (sync for the job workers and scripts,
+asyncio for the request handlers), created once (main.lifespan, or on first use) and shared by the rate limiter,
+the response cache, the principal cache and the token state.
+A circuit breaker tracks the health of Redis for all of them: the first connection error or timeout opens it, and for
+REDIS_RETRY seconds every caller goes straight to its in-process fallback instead of waiting on Redis; then a single
+call probes Redis again (half-open), which closes the breaker if it succeeds.
+call / call_async run one command through the breaker, execute / execute_async send a batch of commands in one round trip.
+'''
+
+logger = logging.getLogger(__name__)
+
+class CircuitBreaker:
+  def __init__(self, retry_after: float):
+    self.retry_after = retry_after
+    self.lock = threading.Lock()
+    self.open_until = 0.0 # monotonic, 0 while closed
+    self.opened = 0 # times the breaker opened
+    self.last_error: Optional[str] = None
+
+  @property
+  def state(self) -> str:
+    if not self.open_until:
+      return "closed"
+    return "open" if time.monotonic() < self.open_until else "half-open"
+
+  def allow(self) -> bool:
+    '''
+    True while closed. While open False, except for one call every REDIS_RETRY seconds (the probe): its success closes
+    the breaker, a failure or no report at all keeps it open for another REDIS_RETRY seconds.
+    '''
+    if not self.open_until:
+      return True
+    with self.lock:
+      if not self.open_until:
+        return True
+      now = time.monotonic()
+      if now < self.open_until:
+        return False
+      self.open_until = now + self.retry_after
+      return True
+
+  def success(self):
+    if not self.open_until:
+      return
+    with self.lock:
+      if self.open_until:
+        logger.info("Redis is available again")
+      self.open_until = 0.0
+
+  def failure(self, e: Exception):
+    with self.lock:
+      if not self.open_until:
+        self.opened += 1
+        logger.warning("Redis unavailable, using the in-process fallbacks", extra={"retry_after": self.retry_after, "error": f"{type(e).__name__}: {e}"})
+      self.open_until = time.monotonic() + self.retry_after
+      self.last_error = f"{type(e).__name__}: {e}"
+
+class RedisStats:
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.calls = self.commands = self.errors = self.skipped = 0
+
+  def incr(self, name: str, value: int = 1):
+    with self.lock:
+      setattr(self, name, getattr(self, name) + value)
+
+breaker = CircuitBreaker(settings.REDIS_RETRY)
+stats = RedisStats()
+_pool: Optional[redis.ConnectionPool] = None
+_async_pool: Optional[redis.asyncio.ConnectionPool] = None
+
+def pool_options() -> dict:
+  return {
+    "host": settings.REDIS_URL,
+    "password": settings.REDIS_PASSWORD,
+    "port": settings.REDIS_PORT,
+    "db": 0,
+    "decode_responses": True,
+    "socket_connect_timeout": settings.REDIS_TIMEOUT, # a request must not hang on Redis
+    "socket_timeout": settings.REDIS_TIMEOUT,
+    "health_check_interval": settings.REDIS_HEALTH_CHECK_INTERVAL, # PING a connection idle for longer before using it
+    "max_connections": settings.REDIS_MAX_CONNECTIONS,
+  }
+
+def get_pool() -> redis.ConnectionPool:
+  global _pool
+  if _pool is None:
+    _pool = redis.ConnectionPool(**pool_options())
+  return _pool
+
+def get_async_pool() -> redis.asyncio.ConnectionPool:
+  global _async_pool
+  if _async_pool is None:
+    _async_pool = redis.asyncio.ConnectionPool(**pool_options())
+  return _async_pool
+
+def get_client() -> Optional[redis.Redis]:
+  ''' A client on the pool of the process, None while the breaker is open '''
+  if not settings.REDIS_URL or not breaker.allow():
+    stats.incr("skipped")
+    return None
+  return redis.Redis(connection_pool=get_pool())
+
+def get_async_client() -> Optional[redis.asyncio.Redis]:
+  ''' An asyncio client on the pool of the process, None while the breaker is open '''
+  if not settings.REDIS_URL or not breaker.allow():
+    stats.incr("skipped")
+    return None
+  return redis.asyncio.Redis(connection_pool=get_async_pool())
+
+async def get_async_redis_client() -> Optional[redis.asyncio.Redis]:
+  return get_async_client() # async def: FastAPI runs a sync dependency in the thread pool
+
+def succeeded(commands: int = 1):
+  stats.incr("calls")
+  stats.incr("commands", commands)
+  breaker.success()
+
+def failed(e: Exception):
+  stats.incr("errors")
+  breaker.failure(e)
+
+def call(command: Callable[[redis.Redis], Any]) -> tuple[bool, Any]:
+  '''
+  Run command(client) through the breaker.
+  Returns: (True, its result), (False, None) when Redis is unavailable
+  '''
+  client = get_client()
+  if client is None:
+    return False, None
+  try:
+    result = command(client)
+  except redis.RedisError as e:
+    failed(e)
+    return False, None
+  succeeded()
+  return True, result
+
+async def call_async(command: Callable[[redis.asyncio.Redis], Awaitable]) -> tuple[bool, Any]:
+  ''' call for the request handlers, command(client) returns an awaitable '''
+  client = get_async_client()
+  if client is None:
+    return False, None
+  try:
+    result = await command(client)
+  except redis.RedisError as e:
+    failed(e)
+    return False, None
+  succeeded()
+  return True, result
+
+def execute(build: Callable[[redis.client.Pipeline], Any], transaction: bool = False) -> Optional[list]:
+  '''
+  Queue commands on a pipeline (build(pipe)) and send them in one round trip, in a MULTI/EXEC block if transaction.
+  Returns: the results of the commands, None when Redis is unavailable
+  '''
+  client = get_client()
+  if client is None:
+    return None
   try:
-    return redis.Redis(connection_pool=pool)
-  except redis.ConnectionError: # if error: send None
-    return None
\ No newline at end of file
+    pipe = client.pipeline(transaction=transaction)
+    build(pipe)
+    commands = len(pipe)
+    results = pipe.execute()
+  except redis.RedisError as e:
+    failed(e)
+    return None
+  succeeded(commands)
+  return results
+
+async def execute_async(build: Callable[[redis.asyncio.client.Pipeline], Any], transaction: bool = False) -> Optional[list]:
+  ''' execute for the request handlers '''
+  client = get_async_client()
+  if client is None:
+    return None
+  try:
+    async with client.pipeline(transaction=transaction) as pipe:
+      build(pipe)
+      commands = len(pipe)
+      results = await pipe.execute()
+  except redis.RedisError as e:
+    failed(e)
+    return None
+  succeeded(commands)
+  return results
+
+async def startup():
+  ''' main.lifespan: create the pools and check Redis once, so a dead Redis is reported at startup rather than by the first request '''
+  if not settings.REDIS_URL:
+    logger.info("REDIS_URL is not set, using the in-process fallbacks")
+    return
+  ok, _ = await call_async(lambda client: client.ping())
+  if ok:
+    logger.info("Redis is available", extra={"host": settings.REDIS_URL, "port": settings.REDIS_PORT})
+  else:
+    logger.warning("Redis is not available at startup", extra={"host": settings.REDIS_URL, "port": settings.REDIS_PORT})
+
+async def shutdown():
+  global _pool, _async_pool
+  if _async_pool is not None:
+    await _async_pool.disconnect()
+    _async_pool = None
+  if _pool is not None:
+    _pool.disconnect()
+    _pool = None
+
+def pool_summary(pool) -> Optional[dict]:
+  if pool is None:
+    return None
+  in_use, available = len(pool._in_use_connections), len(pool._available_connections)
+  return {"connections": in_use + available, "in_use": in_use, "available": available, "max": pool.max_connections}
+
+def summary() -> dict:
+  ''' Redis health and usage of this worker process '''
+  return {
+    "state": breaker.state,
+    "opened": breaker.opened,
+    "last_error": breaker.last_error,
+    "calls": stats.calls, # round trips
+    "commands": stats.commands,
+    "errors": stats.errors,
+    "skipped": stats.skipped, # calls sent to a fallback while the breaker was open
+    "pool": pool_summary(_pool),
+    "async_pool": pool_summary(_async_pool),
+  }
+
+def collect_metrics():
+  ''' metrics collector: the counters, breaker and pools of summary '''
+  yield "redis_round_trips_total", "counter", "Redis round trips (a pipeline is one)", [({}, stats.calls)]
+  yield "redis_commands_total", "counter", "Redis commands sent", [({}, stats.commands)]
+  yield "redis_errors_total", "counter", "Redis connection errors and timeouts", [({}, stats.errors)]
+  yield "redis_skipped_total", "counter", "Redis calls sent to an in-process fallback while the circuit breaker was open", [({}, stats.skipped)]
+  yield "redis_circuit_open", "gauge", "1 while the Redis circuit breaker is open or half-open", [({}, int(breaker.state != "closed"))]
+  yield "redis_circuit_opened_total", "counter", "Times the Redis circuit breaker opened", [({}, breaker.opened)]
+  pools = [({"pool": name}, pool) for name, pool in (("sync", pool_summary(_pool)), ("async", pool_summary(_async_pool))) if pool]
+  yield "redis_pool_connections", "gauge", "Connections of the Redis pools, by state", [
+    ({**labels, "state": state}, pool[state]) for labels, pool in pools for state in ("in_use", "available")
+  ]
+
+metrics.REGISTRY.add_collector(collect_metrics)
@@ -4,8 +4,11 @@ from sqlalchemy.orm import Session
 from models import client as model
 from db import SessionLocal
 from passlib.context import CryptContext
+import logging
 import settings
 
+logger = logging.getLogger(__name__)
+
 # Set up password hasher
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
@@ -14,7 +17,7 @@ def seed_super_admin():
   try:
     existing = db.query(model.Client).filter(model.Client.id == settings.SUPER_ADMIN_ID).first()
     if existing:
-      print("Super admin already exists.")
+      logger.info("Super admin already exists")
       return
 
     super_admin = model.Client(
@@ -26,7 +29,7 @@ def seed_super_admin():
 
     db.add(super_admin)
     db.commit()
-    print("Super admin created successfully.")
+    logger.info("Super admin created")
   finally:
     db.close()
 
@@ -0,0 +1,132 @@
+import hashlib, math, threading, time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Optional
+import settings
+from services import redis_client
+
+'''
+Server-side state of the tokens: the revoked access tokens (until they expire) and the refresh tokens (client id, single use).
+Tokens are stored under their SHA-256, and no entry outlives its token. TOKEN_STATE_BACKEND picks the store:
+  redis: shared by the workers and kept across restarts, every key expires with its token (revocation check: one EXISTS,
+    refresh token rotation: one GET + DEL transaction); while Redis is down the state goes to the in-process store, and
+    the revocations of the other workers are not seen (see RedisTokenState)
+  memory: bounded in-process store, for a single process (development)
+'''
+
+REVOKED_PREFIX = "token-revoked:"
+REFRESH_PREFIX = "token-refresh:"
+
+def token_hash(token: str) -> str:
+  return hashlib.sha256(token.encode()).hexdigest()
+
+class TokenStateBackend(ABC):
+  ''' Interface of the token-state stores '''
+  @abstractmethod
+  async def revoke(self, token: str, expires_at: float):
+    ''' Refuse an access token until expires_at (seconds since the epoch), when it expires anyway '''
+
+  @abstractmethod
+  async def is_revoked(self, token: str) -> bool:
+    ...
+
+  @abstractmethod
+  async def add_refresh_token(self, refresh_token: str, client_id: str, ttl: float):
+    ...
+
+  @abstractmethod
+  async def pop_refresh_token(self, refresh_token: str) -> Optional[str]:
+    ''' Returns: the client id of a refresh token, None if unknown or expired; the token is consumed (single use) '''
+
+class MemoryTokenState(TokenStateBackend):
+  '''
+  Dicts of token hash -> (expires_at, value), bounded to maxsize entries each: the expired entries are dropped first,
+  then the oldest ones (a revocation evicted this way is forgotten before its token expires, keep maxsize above the
+  number of tokens revoked within ACCESS_TOKEN_EXPIRE_MINUTES).
+  '''
+  def __init__(self, maxsize: int):
+    self.maxsize = maxsize
+    self.revoked = OrderedDict()
+    self.refresh_tokens = OrderedDict()
+    self.lock = threading.Lock()
+
+  def put(self, entries: OrderedDict, token: str, expires_at: float, value):
+    with self.lock:
+      entries[token_hash(token)] = (expires_at, value)
+      if len(entries) > self.maxsize:
+        now = time.time()
+        for key in [key for key, (expires, _) in entries.items() if expires <= now]:
+          del entries[key]
+        while len(entries) > self.maxsize:
+          entries.popitem(last=False)
+
+  def get(self, entries: OrderedDict, token: str, pop: bool = False):
+    with self.lock:
+      key = token_hash(token)
+      entry = entries.pop(key, None) if pop else entries.get(key)
+      if entry is None:
+        return None
+      if entry[0] <= time.time():
+        entries.pop(key, None)
+        return None
+      return entry[1]
+
+  async def revoke(self, token: str, expires_at: float):
+    self.put(self.revoked, token, expires_at, True)
+
+  async def is_revoked(self, token: str) -> bool:
+    return self.get(self.revoked, token) is not None
+
+  async def add_refresh_token(self, refresh_token: str, client_id: str, ttl: float):
+    self.put(self.refresh_tokens, refresh_token, time.time() + ttl, client_id)
+
+  async def pop_refresh_token(self, refresh_token: str) -> Optional[str]:
+    return self.get(self.refresh_tokens, refresh_token, pop=True)
+
+class RedisTokenState(TokenStateBackend):
+  '''
+  One key per token, expiring with it, through the Redis pool of the process (and its circuit breaker, see redis_client);
+  the revocations are also kept in process, so this worker still refuses them while Redis is down.
+  is_revoked fails open while Redis is unreachable (breaker open): the tokens revoked by the other workers, or before a
+  restart, are accepted again until Redis is back or they expire (ACCESS_TOKEN_EXPIRE_MINUTES at most). Failing closed
+  would refuse every access token, as a revocation cannot be told apart from a token never revoked.
+  A refresh token issued while Redis is down is only known to the worker which issued it.
+  '''
+  def __init__(self, maxsize: int):
+    self.local = MemoryTokenState(maxsize)
+
+  async def revoke(self, token: str, expires_at: float):
+    ttl = math.ceil(expires_at - time.time())
+    if ttl <= 0:
+      return
+    await self.local.revoke(token, expires_at)
+    await redis_client.call_async(lambda client: client.set(REVOKED_PREFIX + token_hash(token), 1, ex=ttl))
+
+  async def is_revoked(self, token: str) -> bool:
+    if await self.local.is_revoked(token):
+      return True
+    _, exists = await redis_client.call_async(lambda client: client.exists(REVOKED_PREFIX + token_hash(token)))
+    return bool(exists)
+
+  async def add_refresh_token(self, refresh_token: str, client_id: str, ttl: float):
+    stored, _ = await redis_client.call_async(lambda client: client.set(REFRESH_PREFIX + token_hash(refresh_token), client_id, ex=math.ceil(ttl)))
+    if not stored:
+      await self.local.add_refresh_token(refresh_token, client_id, ttl)
+
+  async def pop_refresh_token(self, refresh_token: str) -> Optional[str]:
+    client_id = await self.local.pop_refresh_token(refresh_token) # issued while Redis was down
+    if client_id is not None:
+      return client_id
+    key = REFRESH_PREFIX + token_hash(refresh_token)
+    # GET + DEL in one transaction: a token is used once, even by concurrent requests
+    results = await redis_client.execute_async(lambda pipe: (pipe.get(key), pipe.delete(key)), transaction=True)
+    return results[0] if results else None
+
+def create_backend(name: str = settings.TOKEN_STATE_BACKEND) -> TokenStateBackend:
+  if name == "memory":
+    return MemoryTokenState(settings.TOKEN_STATE_MAX_ENTRIES)
+  if name == "redis":
+    return RedisTokenState(settings.TOKEN_STATE_MAX_ENTRIES)
+  raise ValueError(f"Unknown TOKEN_STATE_BACKEND '{name}', expected redis or memory.")
+
+backend = create_backend()
@@ -1,14 +1,28 @@
 import os
-from bs4 import BeautifulSoup
 from fastapi import Depends
 from sqlalchemy.orm import Session 
-from typing import Optional
-from typing import Optional
-import requests, csv
+from typing import AsyncIterator, Iterable, Optional
+import requests, csv, gzip, base64, binascii, logging, time, io
+import orjson
+import pyarrow as pa
+from pyarrow import csv as pa_csv
+from sqlalchemy import Float, String, Table, cast, literal_column, or_, select, type_coerce
+from sqlalchemy.ext.asyncio import AsyncSession
 import settings
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, date
+from db import AsyncSessionLocal
 from models import transaction as model # ORM 
+from services.utils import parser, loader, normalizer
+from services.utils.fetcher import AsyncFetcher
+from services import pipeline, cache, ledger, aggregate, metrics
+from services.pipeline import PipelineReport
+from pydantic import TypeAdapter
+from schemas import transaction as schema
+from schemas import aggregate as aggregate_schema
+import migrations
+
+logger = logging.getLogger(__name__)
 
 COLUMN_HEADERS = ['X', 'Filling Date', 'Trade Date', 'Ticker', 'Company Name', 'Insider Name','Title', 'Trade Type', 'Price', 'Qty', 'Owned', 'Delta_owned', 'Value']
 
@@ -36,137 +50,196 @@ def parse_date(value):
         return date.fromisoformat(value)  # Format: 'YYYY-MM-DD'
     return None
 
-def clear_data(db: Session): 
-  """
-  Deletes all records from the Transaction table.
-  Parameters: db (Session) which is the database session.
-  Returns: None
-  Raises: Exception for any issues
-  """
-  try:
-    db.query(model.Transaction).delete()  # Delete all records
-    db.commit()  # Commit the changes
-    print("All transaction records have been deleted.")
-  except Exception as e:
-    db.rollback()  # Rollback in case of an error
-    print(f"Error clearing transaction data: {str(e)}")
-    raise
-  
-def bootstrap_data(db: Session, start_year: int, daily_sync):
+def bootstrap_data(db: Session, start_year: int, daily_sync, use_ledger: bool = True):
   """
   Initializes the data extraction process.
-  Parameters: db (Session) which is the database session.
-  Returns: None
+  Parameters: db (Session) which is the database session, use_ledger (skip the months already imported, see services/ledger.py)
+  Returns: PipelineReport with the outcome of every month
   """
   try: 
-    if extract_data(start_year, daily_sync): # Extract data from the source
-      print("Importing data into the database...")
-      import_data(db, daily_sync) # Import data into the database
-    print("Bootstrap completed successfully!")
-  except Exception as e:
-    print(f"Bootstrap failed with the error: {e}.")
+    report = extract_data(db, start_year, daily_sync, use_ledger=use_ledger) # Extract the data from the source and import it into the database
+    logger.info("Bootstrap summary", extra={"summary": report.summary()})
+    if report.failed:
+      logger.warning("Bootstrap completed with failed months", extra={"failed": len(report.failed)})
+    else:
+      logger.info("Bootstrap completed successfully")
+    return report
+  except Exception:
+    logger.exception("Bootstrap failed")
     raise
 
-def extract_data(start_year: int, daily_sync: bool = False):
+def month_ranges(start_year: int, daily_sync: bool = False, today: date = None) -> list[tuple[str, str]]:
   """
-  Extract the data from openinsider.com
-  Parameters: None
-  Returns: True if the extraction was successful, False otherwise. 
+  Filing date ranges to scrape, one per month from start_year up to yesterday (today only, for the daily sync).
+  today: the current date by default, the day a job was submitted when it resumes
+  Returns: [(start_date, end_date)] formatted as MM/DD/YYYY
+  Raises: ValueError if start_year is in the future
+  """
+  today = today or datetime.now().date()
+  if start_year > today.year:
+    raise ValueError(f"Invalid start_year {start_year}. It cannot be in the future.")
+  ranges = []
+  for year in range(start_year, today.year + 1):
+    start_month = 1 if year != 2013 else 3 # this is hardcoded to start from March 2013, to accomodate the data available on openinsider.com
+    end_month = today.month if year == today.year else 12 # end_month is current month if it is the current year, otherwise it is December
+    if daily_sync and year == today.year: # for daily sync only
+      start_month = today.month
+    for month in range(start_month, end_month + 1):
+      first_day = date(year, month, 1)
+      if daily_sync and year == today.year and month == today.month: # for daily sync only
+        start_date = end_date = today
+      elif year == today.year and month == today.month: # the current month is scraped up to yesterday
+        start_date, end_date = first_day, today - timedelta(days=1)
+        if end_date < start_date: # first day of the month, nothing to scrape yet
+          continue
+      else:
+        start_date, end_date = first_day, (first_day + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+      ranges.append((start_date.strftime('%m/%d/%Y'), end_date.strftime('%m/%d/%Y'))) # formatting as MM/DD/YYYY
+  return ranges
+
+def extract_data(db: Session, start_year: int, daily_sync: bool = False, ingest_mode: str = settings.INGEST_MODE, months: list[tuple[str, str]] = None, on_month=None, should_stop=None, use_ledger: bool = True, table: Table = None, trade_months: set = None) -> PipelineReport:
+  """
+  Extract the data from openinsider.com and import it into the database, month by month.
+  Months are fetched concurrently while the earlier ones are parsed and imported (see services/pipeline.py);
+  an empty or failing month is reported and does not stop the others (a page without results table is an empty month,
+  only the fetch, parse and load errors fail one).
+  Parameters: 
+    db (Session), start_year, daily_sync (only scrape today's filings of the current month)
+    ingest_mode: direct (typed rows go straight to the database, the CSV archive is written on the side)
+                 or csv (each month is written to CSV, then read back by import_file_db)
+    months: the date ranges to scrape, month_ranges(start_year, daily_sync) by default
+    on_month, should_stop: progress and cancellation hooks of the pipeline (see services/pipeline.py)
+    use_ledger: skip the months already imported which can no longer change, and do not load again the fetched months
+                whose rows did not change (see services/ledger.py). The ledger is updated either way.
+    table: the table to load, the transactions table by default (see refresh_data for its shadow table)
+    trade_months: a set getting the (year, month) pairs of the trade dates of the rows loaded, e.g. to export them
+  Returns: PipelineReport
   Raises:
-    ValueError: If there is an issue with parsing the data
-    IOError: If there is an issue with writing to the file.
-  """
-  current_year = datetime.now().year
-  current_month = datetime.now().month
-  current_day = datetime.now().day  
-  data = []
-  futures = []
+    ValueError: If start_year is in the future
+  """
+  if months is None:
+    months = month_ranges(start_year, daily_sync)
+  known_hashes = None
+  if use_ledger:
+    months, skipped, known_hashes = ledger.plan(db, months)
+    if skipped:
+      logger.info("Skipping the months already imported (ingestion ledger)", extra={"skipped": len(skipped), "to_fetch": len(months)})
+  def month_done(month):
+    if table is None: # the rows of a shadow table are not served yet, refresh_data records them once swapped in
+      ledger.record(month)
+    if on_month:
+      on_month(month)
+
+  if ingest_mode == "csv":
+    def normalize(month, rows): # the CSV file is what import_file_db reads
+      return save_rows(rows, month.start_date, settings.CSV_ARCHIVE if settings.CSV_ARCHIVE != "off" else "csv")
+    def load(month, file_name):
+      return import_file_db(db, file_name, table, trade_months)
+    archive = None
+  elif ingest_mode == "direct":
+    def normalize(month, rows):
+      return normalize_rows(rows)
+    def load(month, rows):
+      return import_rows_db(db, rows, table, trade_months)
+    def archive(month, rows):
+      save_rows(rows, month.start_date)
+    archive = archive if settings.CSV_ARCHIVE != "off" else None
+  else:
+    raise ValueError(f"Unknown ingest mode '{ingest_mode}', expected direct or csv.")
+
+  return pipeline.run_pipeline_sync(
+    months, build_screener_url, parse_page, normalize, load, archive=archive,
+    on_month=month_done, should_stop=should_stop, fingerprint=ledger.fingerprint, known_hashes=known_hashes,
+    stream_parser=PageStream if settings.PARSER_ENGINE == "stream" else None, # the pages are parsed while they download
+  )
+
+def parse_page(html: str, engine: str = settings.PARSER_ENGINE) -> list[list[str]]:
+  """
+  Rows of a screener page. A page without results table (a future or quiet range) has no rows: an empty month, not a failure.
+  Raises: ValueError if a row is malformed
+  """
   try:
-    if start_year > current_year:
-      raise ValueError(f"Invalid start_year {start_year}. It cannot be in the future.")
-    with ThreadPoolExecutor(max_workers=int(settings.MAX_WORKERS)) as executor:
-      for year in range(start_year, current_year + 1):
-        start_month = 1 if year != 2013 else 3 # this is hardcoded to start from March 2013, to accomodate the data available on openinsider.com
-        end_month = current_month if year == current_year else 12 # end_month is current month if it is the current year, otherwise it is December
-        if daily_sync and year == current_year: # for daily sync only
-          start_month = current_month
-        for month in range(start_month, end_month + 1):
-          if daily_sync and year == current_year and month == current_month: # for daily sync only
-            start_date = end_date = datetime(year, month, current_day).strftime('%m/%d/%Y') # formatting as MM/DD/YYYY
-          else:
-            start_date = datetime(year, month, 1).strftime('%m/%d/%Y') # formatting as MM/DD/YYYY
-            end_date = datetime(year, month, current_day - 1) if month == end_month else (datetime(year, month, 1) + timedelta(days=32)).replace(day=1) - timedelta(days=1)
-            end_date = end_date.strftime('%m/%d/%Y') # formatting as MM/DD/YYYY
-
-          # after getting start_date and end_date, scrape the data and pass it to the thread, which means every thread will scrape data for a specific month
-          futures.append(executor.submit(scrape_data_by_date_range, start_date, end_date)) 
-
-          # Process futures as they complete
-          for future in as_completed(futures):
-            try:
-              result = future.result()
-              if result is None:
-                print(f"No data found for the date range {start_date} to {end_date}.")
-                return False
-            except Exception as e:
-                print(f"Error occurred while processing data: {e}")
-
-        # # Write to CSV
-        # try: 
-        #   if daily_sync: # for daily sync
-        #      filename = f"openinsider_{current_year}_{current_month}_{current_day}.csv"
-        #   else: # for bootstrap 
-        #       filename = settings.OUTPUT_FILE # for bootstrap 
-        #   with open(filename, 'w', newline='') as f:
-        #     print("Writing to CSV file...")
-        #     writer = csv.writer(f)
-        #     writer.writerow(COLUMN_HEADERS)
-        #     writer.writerows(data)
-        #   print(f"CSV file '{filename}' saved successfully!")
-        # except IOError as e:
-        #   raise IOError(f"Error writing to CSV file: {str(e)}")
-  except Exception as e:
-    print(f"Unexpected error in extract_data: {str(e)}")
-    raise
-  return True  # return True if the extraction was successful
+    return parser.get_engine(engine)(html, len(COLUMN_HEADERS))
+  except parser.TableNotFoundError:
+    return []
+
+class PageStream(parser.RowStream):
+  """ parse_page for a page fed in chunks as it downloads (stream engine, pipeline stream_parser) """
+  def __init__(self):
+    super().__init__(len(COLUMN_HEADERS))
 
-def scrape_data_by_date_range(start_date, end_date):
+  def close(self) -> list[list[str]]:
+    try:
+      return super().close()
+    except parser.TableNotFoundError:
+      return []
+
+def build_screener_url(start_date, end_date):
   # url = f'http://openinsider.com/screener?fd=-{fd}&fdr={start_date}+-+{end_date}&td={td}&cnt=5000&page=1' # sample
-  url = f"{settings.BASE_URL}?fd=-{settings.DEFAULT_FILLING_DAYS}&fdr={start_date}+-+{end_date}&td={settings.TRADE_DATE_FILTER}&cnt={settings.MAX_ROWS}&page=1"
-  print(f"Scraping data from {url}")
-  res = requests.get(url)
-  soup = BeautifulSoup(res.text, 'html.parser')
+  return f"{settings.BASE_URL}?fd=-{settings.DEFAULT_FILLING_DAYS}&fdr={start_date}+-+{end_date}&td={settings.TRADE_DATE_FILTER}&cnt={settings.MAX_ROWS}&page=1"
+
+def scrape_data_by_date_range(start_date, end_date, engine: str = settings.PARSER_ENGINE):
+  url = build_screener_url(start_date, end_date)
+  logger.debug("Scraping data", extra={"url": url})
   try:
-    rows = soup.find('table', {'class': 'tinytable'}).find('tbody').find_all('tr')
-  except:
-    print(f"Error: Failed to fetch data from {url}") 
+    if engine == "stream": # parse the rows while the page is being downloaded
+      with requests.get(url, stream=True) as res:
+        res.encoding = res.encoding or "utf-8"
+        chunks = res.iter_content(chunk_size=settings.PARSER_CHUNK_SIZE, decode_unicode=True)
+        cleaned_rows = list(parser.iter_rows_stream(chunks, len(COLUMN_HEADERS)))
+    else:
+      res = requests.get(url)
+      cleaned_rows = parser.get_engine(engine)(res.text, len(COLUMN_HEADERS))
+  except parser.TableNotFoundError:
+    logger.warning("No transactions table in the page", extra={"url": url})
     return
-  cleaned_rows = []
-  for row in rows:
-    cols = row.find_all('td')
-    if not cols:
-      continue
-    cleaned_row = []
-    for idx, col_header in enumerate(COLUMN_HEADERS):
-      ele = cols[idx].find('a').text.strip() if cols[idx].find('a') else cols[idx].text.strip()
-      cleaned_row.insert(idx,ele)
-    cleaned_rows.append(cleaned_row)
-  if cleaned_rows:
+  save_rows(cleaned_rows, start_date)
+  return cleaned_rows
+
+async def scrape_data_by_date_range_async(fetcher: AsyncFetcher, start_date, end_date, engine: str = settings.PARSER_ENGINE):
+  """
+  Same as scrape_data_by_date_range, but the page is downloaded through the shared AsyncFetcher
+  (pooled connections, per-host concurrency and rate limits, retries with backoff).
+  Raises: FetchError if the page could not be downloaded.
+  """
+  url = build_screener_url(start_date, end_date)
+  html = await fetcher.fetch(url)
+  try:
+    cleaned_rows = parser.get_engine(engine)(html, len(COLUMN_HEADERS))
+  except parser.TableNotFoundError:
+    logger.warning("No transactions table in the page", extra={"url": url})
+    return
+  save_rows(cleaned_rows, start_date)
+  return cleaned_rows
+
+def save_rows(cleaned_rows, start_date, archive_format: str = settings.CSV_ARCHIVE):
+  """
+  Archive the scraped rows of a date range in OUTPUT_DIR.
+  archive_format: csv, gzip (csv.gz) or off
+  Returns: the file name, None if nothing was written
+  """
+  if cleaned_rows and archive_format != "off":
     year_obj = datetime.strptime(start_date, '%m/%d/%Y').year
     month_obj = datetime.strptime(start_date, '%m/%d/%Y').month
     day_obj = datetime.strptime(start_date, '%m/%d/%Y').day
-    filename = f"openinsider_{year_obj}_{month_obj:02d}_{day_obj:02d}.csv" 
-    write_to_csv(cleaned_rows, os.path.join(settings.OUTPUT_DIR, filename),COLUMN_HEADERS) # write to CSV file
-  return cleaned_rows
+    filename = f"openinsider_{year_obj}_{month_obj:02d}_{day_obj:02d}.csv" + (".gz" if archive_format == "gzip" else "")
+    file_name = os.path.join(settings.OUTPUT_DIR, filename)
+    write_to_csv(cleaned_rows, file_name, COLUMN_HEADERS) # write to CSV file
+    return file_name
+
+def open_csv(filename, mode):
+  """ Open a CSV file, transparently compressed when the name ends with .gz """
+  if filename.endswith(".gz"):
+    return gzip.open(filename, mode + 't', newline='', encoding="utf-8")
+  return open(filename, mode, newline='', encoding="utf-8")
 
 def write_to_csv(data, filename, headers):
   try: 
-    with open(filename, 'w', newline='') as f:
-      print("Writing to CSV file...")
+    with open_csv(filename, 'w') as f:
       writer = csv.writer(f)
       writer.writerow(headers)
       writer.writerows(data)
-      print(f"CSV file '{filename}' saved successfully!")
+    logger.debug("CSV file saved", extra={"file": filename})
   except IOError as e:
     raise IOError(f"Error writing to CSV file: {str(e)}")
 
@@ -184,16 +257,16 @@ def import_data(db: Session, daily_sync: bool = False):
     try:
       files = os.listdir(settings.OUTPUT_DIR)
     except FileNotFoundError:
-      print(f"Directory '{settings.OUTPUT_DIR}' not found.")
+      logger.warning("Directory not found", extra={"directory": settings.OUTPUT_DIR})
       return []
     # Filter files based on the naming convention
-    files = [f for f in files if f.startswith("openinsider_") and f.endswith(".csv")]
+    files = [f for f in files if f.startswith("openinsider_") and f.endswith((".csv", ".csv.gz"))]
   else: # for daily sync, we only import the latest file
     year = datetime.now().year
     month = datetime.now().month
     current_day = datetime.now().day
     filename = f"openinsider_{year}_{month:02d}_{current_day:02d}.csv"
-    files = [filename] # this is a placeholder, we will replace it with the actual file name
+    files = [filename if os.path.exists(os.path.join(settings.OUTPUT_DIR, filename)) else filename + ".gz"]
 
   for file in files:
     file_name = os.path.join(settings.OUTPUT_DIR, file)
@@ -202,34 +275,122 @@ def import_data(db: Session, daily_sync: bool = False):
       try:
         result = future.result()  # Wait for the thread to complete
         if result:
-          print(f"Successfully imported data from {file_name}")
+          logger.info("Imported file", extra={"file": file_name})
       except Exception as e:
-        print(f"Error importing data from {file_name}: {str(e)}")
+        logger.error("Failed to import file", extra={"file": file_name, "error": str(e)})
     
-def import_file_db(db: Session, file_name: str):
+def normalize_row(row: list[str]) -> tuple:
+  """
+  Convert one scraped row (cell texts in COLUMN_HEADERS order) to a tuple of typed values in loader.TRANSACTION_COLUMNS order.
+  Raises: ValueError if a cell cannot be parsed
+  """
+  x, filing_date, trade_date, ticker, company_name, insider_name, title, trade_type, price, qty, owned, delta_owned, value = row
+  return (
+    x,
+    parse_timestamp(filing_date),
+    parse_date(trade_date),
+    ticker,
+    company_name,
+    insider_name,
+    title,
+    trade_type,
+    parse_float(price),
+    parse_int(qty),
+    parse_int(owned),
+    delta_owned,
+    *normalizer.parse_delta_owned(delta_owned),
+    parse_float(value),
+  )
+
+def normalize_rows(rows: list[list[str]], engine: str = settings.NORMALIZER) -> list[tuple]:
+  """
+  Normalize the scraped rows of a month, see normalize_row.
+  engine: batch (one vectorized pass per column, see services/utils/normalizer.py) or row (normalize_row on every row)
+  Raises: ValueError if a cell cannot be parsed
+  """
+  if engine == "batch":
+    return normalizer.to_rows(normalizer.normalize_batch(rows))
+  if engine == "row":
+    return [normalize_row(row) for row in rows]
+  raise ValueError(f"Unknown normalizer '{engine}', expected batch or row.")
+
+def import_rows_db(db: Session, rows: Iterable[tuple], table: Table = None, trade_months: set = None):
+  """
+  Upsert normalized rows (see normalize_row) in one transaction, in chunks of LOAD_BATCH_SIZE.
+  Rows are matched on their natural key, so importing overlapping date ranges again does not duplicate them.
+  rows can be a generator, only one chunk is held in memory at a time.
+  table: a shadow table (see refresh_data) is appended to, it has no unique index yet and serves no response
+  trade_months: a set getting the (year, month) pairs of the trade dates of the rows, once committed
+  Returns: the number of rows imported (inserted or already there)
+  """
+  if table is not None:
+    stats = loader.bulk_insert(db.get_bind(), table, rows)
+    logger.info("Imported rows", extra={"table": table.name, **stats.summary()})
+    return stats.rows
+  days = set()
+  def on_loaded(conn): # committed with the rows
+    aggregate.refresh(conn, days)
+    cache.record_invalidation(conn, days_cache_tags(days)) # for the in-process LRU of the API processes
+  stats = loader.bulk_insert(
+    db.get_bind(), model.TransactionFact.__table__, track_days(rows, days), conflict_keys=model.NATURAL_KEY, on_loaded=on_loaded,
+  )
+  logger.info("Imported rows", extra={"table": model.TransactionFact.__tablename__, **stats.summary()})
+  tags = days_cache_tags(days)
+  if tags: # the rows are committed, drop the cached responses they change
+    logger.info("Invalidated cached responses", extra={"entries": cache.invalidate(tags)})
+  if trade_months is not None:
+    trade_months.update((trade_date.year, trade_date.month) for _, trade_date in days if trade_date)
+  return stats.rows
+
+TRADE_DATE_INDEX = loader.TRANSACTION_COLUMNS.index("trade_date")
+TICKER_INDEX = loader.TRANSACTION_COLUMNS.index("ticker")
+
+def track_days(rows: Iterable[tuple], days: set):
+  """ Pass the normalized rows through, adding their (ticker, trade_date) to days """
+  for row in rows:
+    days.add((row[TICKER_INDEX], row[TRADE_DATE_INDEX]))
+    yield row
+
+def days_cache_tags(days: set) -> set:
+  """ Cache tags (see cache_tags) of the responses changed by the rows of the (ticker, trade_date) pairs in days """
+  tags = set()
+  for ticker, trade_date in days:
+    tags.add(f"ticker:{ticker}")
+    if trade_date:
+      tags.add(f"month:{trade_date:%Y-%m}")
+  if tags:
+    tags.add("month:*")
+  return tags
+
+def read_csv_rows(file_name: str, engine: str = settings.NORMALIZER):
+  """
+  Generator of the normalized rows of a CSV file written by save_rows (see normalize_rows for engine).
+  The batch engine reads the file as string columns, a block at a time (pyarrow.csv), and normalizes each block.
+  Raises: ValueError if the headers are not COLUMN_HEADERS or a cell cannot be parsed
+  """
+  if engine == "row":
+    with open_csv(file_name, 'r') as f:
+      reader = csv.reader(f)
+      headers = next(reader, None)
+      if headers is not None and headers != COLUMN_HEADERS:
+        raise ValueError(f"Unexpected headers {headers}")
+      yield from (normalize_row(row) for row in reader)
+    return
+  if engine != "batch":
+    raise ValueError(f"Unknown normalizer '{engine}', expected batch or row.")
+  reader = pa_csv.open_csv( # decompresses .gz files
+    file_name,
+    parse_options=pa_csv.ParseOptions(newlines_in_values=True),
+    convert_options=pa_csv.ConvertOptions(column_types={header: pa.string() for header in COLUMN_HEADERS}, strings_can_be_null=False),
+  )
+  if reader.schema.names != COLUMN_HEADERS:
+    raise ValueError(f"Unexpected headers {reader.schema.names}")
+  for batch in reader:
+    yield from normalizer.to_rows(normalizer.normalize_columns(batch.columns))
+
+def import_file_db(db: Session, file_name: str, table: Table = None, trade_months: set = None):
   try:
-    with open(file_name, newline="", encoding="utf-8") as f:
-      reader = csv.DictReader(f)  # Reads CSV with column names
-      transactions = []
-      for row in reader:
-          transactions.append(model.Transaction(
-              x=row["X"],
-              filing_date=(parse_timestamp(row["Filling Date"])),
-              trade_date=(parse_date(row["Trade Date"])),
-              ticker=row["Ticker"],
-              company_name=row["Company Name"],
-              insider_name=row["Insider Name"],
-              insider_title=row["Title"],
-              trade_type=row["Trade Type"],
-              price=float(parse_float(row["Price"])) if row["Price"] else None,
-              qty=int(parse_int(row["Qty"])) if row["Qty"] else None,
-              owned=int(parse_int(row["Owned"])) if row["Owned"] else None,
-              delta_owned=row["Delta_owned"],
-              value=float(parse_float(row["Value"])) if row["Value"] else None,
-          ))
-    db.bulk_save_objects(transactions)
-    db.commit()
-    return True
+    return import_rows_db(db, read_csv_rows(file_name), table, trade_months) # streamed from the file
   except ValueError as ve:
       # Handle invalid data format
       raise ValueError(f"Invalid data format: {str(ve)}")
@@ -237,25 +398,59 @@ def import_file_db(db: Session, file_name: str):
       # Handle I/O errors
       raise IOError(f"Error reading the data source: {str(ioe)}")
 
+def refresh_data(db: Session, start_year: int, months: list[tuple[str, str]] = None, on_month=None, should_stop=None, resume: bool = False) -> PipelineReport:
+  """
+  Rebuild the transactions table from a full scrape, without ever serving an empty or partial table:
+  every month is loaded into a shadow table (no index, plain inserts), then the shadow table is deduplicated
+  and swapped in, with its indexes, in a single transaction (see loader.swap_in).
+  When a month fails or the refresh is cancelled, the shadow table is dropped and the transactions table is left as it was.
+  Parameters: db (Session), start_year, months, on_month, should_stop (see extract_data),
+    resume: keep the rows of the shadow table loaded by an interrupted refresh (the caller only passes the missing months)
+  Returns: PipelineReport
+  """
+  engine = db.get_bind()
+  table = model.TransactionFact.__table__
+  shadow = loader.shadow_table(table)
+  loader.reset_shadow(engine, shadow, keep=resume)
+  report = extract_data(db, start_year, months=months, on_month=on_month, should_stop=should_stop, use_ledger=False, table=shadow)
+  if report.failed or any(month.status == "cancelled" for month in report.months):
+    shadow.drop(bind=engine, checkfirst=True)
+    logger.warning("Refresh not applied, the transactions table is unchanged", extra={"failed": len(report.failed)})
+    return report
+  started = time.perf_counter()
+  with engine.begin() as conn:
+    deleted = migrations.dedupe_transactions(conn, shadow.name)
+    loader.swap_in(conn, shadow, table)
+    aggregate.rebuild(conn)
+    cache.record_invalidation(conn, [cache.ALL_TAGS])
+  with engine.begin() as conn:
+    conn.exec_driver_sql("ANALYZE") # refresh the planner statistics for the new indexes
+  logger.info("Swapped in the refreshed transactions", extra={"seconds": round(time.perf_counter() - started, 3), "duplicates": deleted})
+  for month in report.months:
+    ledger.record(month)
+  logger.info("Invalidated cached responses", extra={"entries": cache.clear()})
+  return report
+
 def force_refresh(db: Session, start_year: int):
   """
-  Clears any existing data and proceeds with bootstrapping the system.
-  This function wipes any existing data and initiates the bootstrapping 
-  process to initialize the system.
-  Parameters: None
-  Returns: None
+  Re-scrapes every month since start_year and re-imports it, whatever the ingestion ledger says.
+  The data is rebuilt aside and swapped in once complete (see refresh_data), so it stays available while the refresh runs.
+  Parameters: db (Session), start_year
+  Returns: PipelineReport
   Raises: Exception If the system fails during the refresh process.
   """
   try:
-    clear_data(db)                              # Wipe data clean from the database
-    bootstrap_data(db, start_year, False)       # Bootstrapping the data       
+    return refresh_data(db, start_year)
   except Exception as e:                        # Handle exceptions that might occur during the refresh
-    print(f"Failed to force refresh: {str(e)}")
+    logger.exception("Failed to force refresh")
     raise Exception(f"Failed to force refresh: {str(e)}")
 
 def get_ticker(db: Session, ticker_id: str):
   return db.query(model.Transaction).filter(model.Transaction.ticker==ticker_id).first()
 
+async def get_ticker_async(db: AsyncSession, ticker_id: str):
+  return (await db.scalars(select(model.Transaction).where(model.Transaction.ticker == ticker_id).limit(1))).first()
+
 def retrieve_by_ticker(db: Session, ticker_id:str):
   # check if ticker exists in the database 
   existing_ticker = get_ticker(db, ticker_id)
@@ -263,14 +458,63 @@ def retrieve_by_ticker(db: Session, ticker_id:str):
     return None # not found then, return None
   return existing_ticker
 
-def retrieve_transactions(db: Session, ticker_id: str, from_date: Optional[date] = None, to_date: Optional[date] = None, trade_type = None, skip: int = 0, limit: int = 100):
-  # If from_date is not provided, set it to the default: earliest date 
-  if not from_date:
-    from_date = datetime.today() # todo: to change to the earliest date
+async def retrieve_by_ticker_async(db: AsyncSession, ticker_id: str):
+  return await get_ticker_async(db, ticker_id) # None when not in the database
+
+def encode_cursor(transaction) -> str:
+  """ Opaque page cursor: the (trade_date, id) key of the last row of a page """
+  return base64.urlsafe_b64encode(f"{transaction.trade_date.isoformat()}|{transaction.id}".encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> tuple[date, int]:
+  """ Raises: ValueError if the cursor is malformed (or was taken before the ids became integers) """
+  try:
+    trade_date, transaction_id = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode().split("|", 1)
+    return date.fromisoformat(trade_date), int(transaction_id)
+  except (ValueError, UnicodeDecodeError, binascii.Error):
+    raise ValueError("Invalid cursor.")
+
+TRANSACTION_FIELDS = tuple(schema.Transaction.model_fields) # the columns of a response row, in the order of the JSON objects
+# the sources of the columns of a response row: the expressions of the transactions view (models.transaction.TRANSACTIONS_VIEW),
+# read from transaction_facts and its dimensions by transactions_query
+ROW_SOURCES = {
+  "id": cast(model.TransactionFact.id, String), # the integer id as text, as schema.Transaction dumps it
+  "ticker": model.Ticker.ticker,
+  "company_name": model.Ticker.company_name,
+  "insider_name": model.Insider.name,
+  "trade_type": model.TradeType.trade_type,
+  "price": type_coerce(model.TransactionFact.price_cents.op("/")(literal_column("100.0")), Float),
+  "value": type_coerce(model.TransactionFact.value_cents.op("/")(literal_column("100.0")), Float),
+}
+# the columns of a response row as plain values, as schema.Transaction dumps them
+ROW_COLUMNS = [
+  (ROW_SOURCES[field] if field in ROW_SOURCES else getattr(model.TransactionFact, field)).label(field)
+  for field in TRANSACTION_FIELDS
+]
+# the facts and the names of their ticker, insider and trade type (LEFT JOINs: the lines without one are kept, as in the view)
+ROW_JOINS = (
+  model.TransactionFact.__table__
+  .outerjoin(model.Ticker.__table__, model.Ticker.id == model.TransactionFact.ticker_id)
+  .outerjoin(model.Insider.__table__, model.Insider.id == model.TransactionFact.insider_id)
+  .outerjoin(model.TradeType.__table__, model.TradeType.id == model.TransactionFact.trade_type_id)
+)
 
+def transactions_query(ticker_id: str, from_date: Optional[date] = None, to_date: Optional[date] = None, trade_type = None, cursor: Optional[str] = None):
+  """
+  Select statement of the transactions matching the filters (rows of ROW_COLUMNS), most recent trade first (ties broken by id,
+  which makes the order stable).
+  cursor (see encode_cursor) resumes right after the row it was taken from: the (trade_date, id) key is a seek in the index,
+  so every page costs the same whatever its depth.
+  The filters and the cursor apply to transaction_facts (a ticker or trade type is turned into its id first, by a lookup in
+  its dimension table), each combination is served by one of the indexes of models.transaction.TransactionFact:
+    ticker (+ trade_type): ix_transaction_facts_ticker_trade_date
+    dates only: ix_transaction_facts_trade_date
+    dates + trade_type: ix_transaction_facts_trade_type_trade_date
+  The names are joined by primary key to the selected rows only, up to the limit of the page.
+  Raises: ValueError if the cursor is malformed
+  """
   # If to_date is not provided, set it to today's date
   if not to_date:
-    to_date = datetime.today()
+    to_date = date.today()
 
   # If trade_type is not provided, set it to None
   if not trade_type:
@@ -278,39 +522,193 @@ def retrieve_transactions(db: Session, ticker_id: str, from_date: Optional[date]
   else:
     trade_type = trade_type.value
 
-  if ticker_id != "" and trade_type == None: # if ticker_id is provided and trade_type is not provided
-    return db.query(model.Transaction)\
-              .filter(model.Transaction.ticker == ticker_id)\
-              .filter(model.Transaction.trade_date >= from_date)\
-              .filter(model.Transaction.trade_date <= to_date)\
-              .order_by(model.Transaction.trade_date.desc())\
-              .offset(skip)\
-              .limit(limit)\
-              .all()
-  elif ticker_id != "" and trade_type != None: # if ticker_id and trade_type are provided
-    return db.query(model.Transaction)\
-              .filter(model.Transaction.ticker == ticker_id)\
-              .filter(model.Transaction.trade_date >= from_date)\
-              .filter(model.Transaction.trade_date <= to_date)\
-              .filter(model.Transaction.trade_type == trade_type)\
-              .order_by(model.Transaction.trade_date.desc())\
-              .offset(skip)\
-              .limit(limit)\
-              .all()
-  elif ticker_id == "" and trade_type == None: # trade dates are provided and trade_type is not provided
-    return db.query(model.Transaction)\
-              .filter(model.Transaction.trade_date >= from_date)\
-              .filter(model.Transaction.trade_date <= to_date)\
-              .order_by(model.Transaction.trade_date.desc())\
-              .offset(skip)\
-              .limit(limit)\
-              .all()
-  else: # trade dates and trade_type are provided
-    return db.query(model.Transaction)\
-              .filter(model.Transaction.trade_date >= from_date)\
-              .filter(model.Transaction.trade_date <= to_date)\
-              .filter(model.Transaction.trade_type == trade_type)\
-              .order_by(model.Transaction.trade_date.desc())\
-              .offset(skip)\
-              .limit(limit)\
-              .all()
\ No newline at end of file
+  cursor_date = cursor_id = None
+  if cursor: # rows strictly after the cursor in (trade_date desc, id desc) order
+    cursor_date, cursor_id = decode_cursor(cursor)
+    to_date = min(to_date, cursor_date) # a single upper bound, so the index seek starts at the cursor
+
+  facts = model.TransactionFact
+  query = select(*ROW_COLUMNS).select_from(ROW_JOINS)
+  if ticker_id != "": # if ticker_id is provided
+    # uncorrelated: the id is looked up once, not matched against the joined tickers row by row
+    query = query.where(facts.ticker_id == select(model.Ticker.id).where(model.Ticker.ticker == ticker_id).correlate(None).scalar_subquery())
+  if from_date: # If from_date is not provided, start from the earliest trade
+    query = query.where(facts.trade_date >= from_date)
+  query = query.where(facts.trade_date <= to_date)
+  if trade_type != None: # if trade_type is provided
+    query = query.where(facts.trade_type_id == select(model.TradeType.id).where(model.TradeType.trade_type == trade_type).correlate(None).scalar_subquery())
+  if cursor:
+    query = query.where(or_(facts.trade_date < cursor_date, facts.id < cursor_id))
+  return query.order_by(facts.trade_date.desc(), facts.id.desc())
+
+QUERY_SECONDS = metrics.Histogram("db_query_duration_seconds", "Time of the transactions page queries, by filters (each combination has its index, see transactions_query)", ["branch"])
+
+def query_branch(ticker_id: str, trade_type) -> str:
+  """ The label of the filters of a query in QUERY_SECONDS """
+  if ticker_id:
+    return "ticker+trade_type" if trade_type else "ticker"
+  return "dates+trade_type" if trade_type else "dates"
+
+def split_page(transactions: list, limit: int):
+  """ transactions holds up to limit + 1 rows: Returns (the page, next_cursor or None on the last page) """
+  if len(transactions) > limit: # there is at least one more page
+    transactions = transactions[:limit]
+    return transactions, encode_cursor(transactions[-1])
+  return transactions, None
+
+def retrieve_transactions(db: Session, ticker_id: str, from_date: Optional[date] = None, to_date: Optional[date] = None, trade_type = None, cursor: Optional[str] = None, limit: int = settings.DEFAULT_PAGE_SIZE):
+  """
+  Returns: (transactions, next_cursor), next_cursor is None on the last page
+    transactions are rows of ROW_COLUMNS (no ORM objects: a page is only read and serialized)
+  Raises: ValueError if the cursor is malformed
+  """
+  query = transactions_query(ticker_id, from_date, to_date, trade_type, cursor).limit(limit + 1)
+  with QUERY_SECONDS.labels(query_branch(ticker_id, trade_type)).time():
+    transactions = db.execute(query).all()
+  return split_page(transactions, limit)
+
+async def retrieve_transactions_async(db: AsyncSession, ticker_id: str, from_date: Optional[date] = None, to_date: Optional[date] = None, trade_type = None, cursor: Optional[str] = None, limit: int = settings.DEFAULT_PAGE_SIZE):
+  """ retrieve_transactions through an AsyncSession """
+  query = transactions_query(ticker_id, from_date, to_date, trade_type, cursor).limit(limit + 1)
+  with QUERY_SECONDS.labels(query_branch(ticker_id, trade_type)).time():
+    transactions = (await db.execute(query)).all()
+  return split_page(transactions, limit)
+
+def cache_key(ticker_id: str, from_date: Optional[date], to_date: Optional[date], trade_type, cursor: Optional[str], limit: int) -> str:
+  """ The query parameters in a fixed order, to_date resolved (it defaults to today) """
+  return "transactions:" + "|".join([
+    ticker_id,
+    from_date.isoformat() if from_date else "",
+    (to_date or date.today()).isoformat(),
+    trade_type.value if trade_type else "",
+    cursor or "",
+    str(limit),
+  ])
+
+def cache_tags(ticker_id: str, from_date: Optional[date], to_date: Optional[date]) -> list[str]:
+  """
+  Tags of a cached page, matched against the ones of the imported rows (see days_cache_tags):
+  a ticker page changes with the rows of its ticker, a date range page with the rows of the months it covers
+  (a range of more than CACHE_MAX_TAG_MONTHS months is tagged month:*, dropped by every import).
+  """
+  if ticker_id:
+    return [f"ticker:{ticker_id}"]
+  to_date = to_date or date.today()
+  months = (to_date.year - from_date.year) * 12 + to_date.month - from_date.month + 1 if from_date else None
+  if months is None or months > settings.CACHE_MAX_TAG_MONTHS:
+    return ["month:*"]
+  year, month = from_date.year, from_date.month
+  tags = []
+  for _ in range(months):
+    tags.append(f"month:{year:04d}-{month:02d}")
+    year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+  return tags
+
+def serialize_page(transactions: list) -> str:
+  """
+  JSON body of a page of ROW_COLUMNS rows, encoded by orjson without building schema.Transaction models:
+  the same bytes as the response_model would produce, the rows being already typed by the database.
+  """
+  return orjson.dumps([dict(zip(TRANSACTION_FIELDS, row)) for row in transactions]).decode()
+
+def retrieve_page(db: Session, ticker_id: str, from_date: Optional[date] = None, to_date: Optional[date] = None, trade_type = None, cursor: Optional[str] = None, limit: int = settings.DEFAULT_PAGE_SIZE):
+  """
+  retrieve_transactions through the response cache: the page is serialized to JSON once and served from the cache until
+  it expires (REDIS_EX) or an import touches its ticker or months.
+  The ticker is only looked up when the page is empty, to tell an unknown ticker from a range without trades.
+  Returns: (json_body, next_cursor, cache_hit), None if the ticker is unknown
+  Raises: ValueError if the cursor is malformed
+  """
+  key = cache_key(ticker_id, from_date, to_date, trade_type, cursor, limit)
+  tags = cache_tags(ticker_id, from_date, to_date)
+  cached, version = cache.get(key, tags) # version: the page is not stored if an import invalidates it while it is read
+  if cached is not None:
+    next_cursor, body = cached.split("\n", 1)
+    return body, next_cursor or None, True
+
+  transactions, next_cursor = retrieve_transactions(db, ticker_id, from_date, to_date, trade_type, cursor, limit)
+  if not transactions and ticker_id and not retrieve_by_ticker(db, ticker_id):
+    return None
+  body = serialize_page(transactions)
+  cache.put(key, f"{next_cursor or ''}\n{body}", tags, version)
+  return body, next_cursor, False
+
+async def retrieve_page_async(db: AsyncSession, ticker_id: str, from_date: Optional[date] = None, to_date: Optional[date] = None, trade_type = None, cursor: Optional[str] = None, limit: int = settings.DEFAULT_PAGE_SIZE):
+  """ retrieve_page for the request handlers: AsyncSession and asyncio Redis client """
+  key = cache_key(ticker_id, from_date, to_date, trade_type, cursor, limit)
+  tags = cache_tags(ticker_id, from_date, to_date)
+  cached, version = await cache.get_async(key, tags)
+  if cached is not None:
+    next_cursor, body = cached.split("\n", 1)
+    return body, next_cursor or None, True
+
+  transactions, next_cursor = await retrieve_transactions_async(db, ticker_id, from_date, to_date, trade_type, cursor, limit)
+  if not transactions and ticker_id and not await retrieve_by_ticker_async(db, ticker_id):
+    return None
+  body = serialize_page(transactions)
+  await cache.put_async(key, f"{next_cursor or ''}\n{body}", tags, version)
+  return body, next_cursor, False
+
+def encode_ndjson(rows: Iterable[tuple]) -> bytes:
+  return b"".join(orjson.dumps(dict(zip(TRANSACTION_FIELDS, row))) + b"\n" for row in rows)
+
+def encode_csv(rows: Iterable[tuple]) -> bytes:
+  buffer = io.StringIO()
+  writer = csv.writer(buffer, lineterminator="\n")
+  writer.writerows(
+    tuple(value.isoformat() if isinstance(value, (date, datetime)) else value for value in row) for row in rows
+  )
+  return buffer.getvalue().encode()
+
+async def stream_transactions_async(query, fmt: str) -> AsyncIterator[bytes]:
+  """
+  Every row of a transactions_query, encoded as NDJSON or CSV (header line first), STREAM_BATCH_SIZE rows at a time.
+  The rows come as plain column tuples from a server-side cursor (yield_per) and are encoded without Pydantic models,
+  so the memory stays the same whatever the size of the result.
+  The rows are read in a session of their own: the one of the request is closed before the body is sent.
+  """
+  query = query.execution_options(yield_per=settings.STREAM_BATCH_SIZE)
+  encode = encode_ndjson if fmt == schema.ResponseFormat.ndjson.value else encode_csv
+  if encode is encode_csv:
+    yield encode_csv([TRANSACTION_FIELDS])
+  async with AsyncSessionLocal() as db:
+    result = await db.stream(query)
+    async for rows in result.partitions():
+      yield encode(rows)
+
+summary_adapter = TypeAdapter(aggregate_schema.TickerSummary)
+top_adapter = TypeAdapter(list[aggregate_schema.TopTicker])
+
+async def retrieve_summary_async(db: AsyncSession, ticker_id: str, from_date: Optional[date] = None, to_date: Optional[date] = None):
+  """
+  aggregate.ticker_summary through the response cache, dropped by the imports of the ticker.
+  Returns: (json_body, cache_hit), None if the ticker is unknown
+  """
+  key = "summary:" + "|".join([ticker_id, from_date.isoformat() if from_date else "", to_date.isoformat() if to_date else ""])
+  tags = [f"ticker:{ticker_id}"]
+  cached, version = await cache.get_async(key, tags)
+  if cached is not None:
+    return cached, True
+  summary = await aggregate.ticker_summary_async(db, ticker_id, from_date, to_date)
+  if summary is None:
+    return None
+  body = summary_adapter.dump_json(summary_adapter.validate_python(summary)).decode()
+  await cache.put_async(key, body, tags, version)
+  return body, False
+
+async def retrieve_top_async(db: AsyncSession, by: str, window: str, to_date: Optional[date] = None, trade_type = None, limit: int = 20):
+  """
+  aggregate.top_tickers over window (see aggregate.window_range) through the response cache, dropped by the imports of its months.
+  Returns: (json_body, cache_hit)
+  Raises: ValueError for a malformed window
+  """
+  from_date, to_date = aggregate.window_range(window, to_date)
+  key = "top:" + "|".join([by, from_date.isoformat(), to_date.isoformat(), trade_type.value if trade_type else "", str(limit)])
+  tags = cache_tags("", from_date, to_date)
+  cached, version = await cache.get_async(key, tags)
+  if cached is not None:
+    return cached, True
+  top = await aggregate.top_tickers_async(db, by, from_date, to_date, trade_type.value if trade_type else None, limit)
+  body = top_adapter.dump_json(top_adapter.validate_python(top)).decode()
+  await cache.put_async(key, body, tags, version)
+  return body, False
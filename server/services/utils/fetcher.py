@@ -0,0 +1,163 @@
+import asyncio, random, time
+from typing import AsyncIterator, Awaitable, Callable, TypeVar
+from urllib.parse import urlsplit
+import httpx
+import settings
+
+'''
+Asyncio fetch layer for the scraper.
+One pooled keep-alive httpx client is shared by every request, and each host gets:
+  - a concurrency cap (semaphore)
+  - a requests-per-second budget (token bucket)
+Server errors (5xx, 429), timeouts and connection errors are retried with full-jitter exponential backoff.
+'''
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+T = TypeVar("T")
+
+class FetchError(Exception):
+  def __init__(self, url: str, message: str):
+    super().__init__(f"{message} ({url})")
+    self.url = url
+
+class RateLimiter:
+  ''' Token bucket allowing `rate` requests per second with bursts of up to `burst` requests. rate <= 0 disables it. '''
+  def __init__(self, rate: float, burst: int = 1):
+    self.rate = rate
+    self.capacity = max(burst, 1)
+    self.tokens = self.capacity
+    self.updated = time.monotonic()
+    self.lock = asyncio.Lock()
+
+  async def acquire(self):
+    if self.rate <= 0:
+      return
+    async with self.lock:
+      while True:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+          self.tokens -= 1
+          return
+        await asyncio.sleep((1 - self.tokens) / self.rate)
+
+class LatencyStats:
+  ''' Latency of every request attempt, summarized with percentiles. '''
+  def __init__(self):
+    self.latencies = []
+    self.requests = 0
+    self.retries = 0
+    self.errors = 0
+
+  def record(self, seconds: float):
+    self.latencies.append(seconds)
+
+  def summary(self) -> dict:
+    ordered = sorted(self.latencies)
+    def percentile(p):
+      if not ordered:
+        return None
+      return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+    return {
+      "requests": self.requests,
+      "attempts": len(ordered),
+      "retries": self.retries,
+      "errors": self.errors,
+      "mean": sum(ordered) / len(ordered) if ordered else None,
+      "p50": percentile(50),
+      "p95": percentile(95),
+      "p99": percentile(99),
+      "max": ordered[-1] if ordered else None,
+    }
+
+class AsyncFetcher:
+  '''
+  Usage:
+    async with AsyncFetcher() as fetcher:
+      html = await fetcher.fetch(url)
+      rows = await fetcher.fetch_stream(url, parse_chunks) # parsed while it downloads, the page is never held whole
+    logger.info("Fetch stats", extra=fetcher.stats.summary())
+  '''
+  def __init__(
+    self,
+    concurrency: int = settings.FETCH_CONCURRENCY,
+    rps: float = settings.FETCH_RPS,
+    timeout: float = settings.FETCH_TIMEOUT,
+    max_retries: int = settings.FETCH_MAX_RETRIES,
+    backoff_base: float = settings.FETCH_BACKOFF_BASE,
+    backoff_max: float = settings.FETCH_BACKOFF_MAX,
+  ):
+    self.concurrency = concurrency
+    self.rps = rps
+    self.timeout = timeout
+    self.max_retries = max_retries
+    self.backoff_base = backoff_base
+    self.backoff_max = backoff_max
+    self.stats = LatencyStats()
+    self._client = None
+    self._semaphores = {} # {host: asyncio.Semaphore}
+    self._limiters = {}   # {host: RateLimiter}
+
+  async def __aenter__(self):
+    self._client = httpx.AsyncClient(
+      timeout=self.timeout,
+      limits=httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency),
+      headers={"User-Agent": settings.FETCH_USER_AGENT},
+      follow_redirects=True,
+    )
+    return self
+
+  async def __aexit__(self, *exc):
+    await self._client.aclose()
+    self._client = None
+
+  def _host_limits(self, url: str):
+    host = urlsplit(url).netloc
+    if host not in self._semaphores:
+      self._semaphores[host] = asyncio.Semaphore(self.concurrency)
+      self._limiters[host] = RateLimiter(self.rps, burst=self.concurrency)
+    return self._semaphores[host], self._limiters[host]
+
+  def backoff(self, attempt: int) -> float:
+    ''' Full jitter: a random delay between 0 and base * 2^attempt, capped at backoff_max '''
+    return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+  async def fetch(self, url: str) -> str:
+    return await self.fetch_stream(url, read_text)
+
+  async def fetch_stream(self, url: str, consume: Callable[[AsyncIterator[str]], Awaitable[T]]) -> T:
+    '''
+    GET url and hand its body to consume(chunks) as it downloads (decoded text chunks).
+    A transport error while the body is read retries the request, and consume is called again from the start.
+    The latency recorded for an attempt includes consume.
+    Returns: what consume returns
+    Raises: FetchError, or what consume raises
+    '''
+    semaphore, limiter = self._host_limits(url)
+    self.stats.requests += 1
+    async with semaphore:
+      for attempt in range(self.max_retries + 1):
+        await limiter.acquire()
+        start = time.perf_counter()
+        try:
+          async with self._client.stream("GET", url) as res:
+            error = f"HTTP {res.status_code}" if res.status_code in RETRY_STATUS_CODES else None
+            if error is None:
+              if res.is_error: # other 4xx are not worth retrying
+                self.stats.errors += 1
+                raise FetchError(url, f"HTTP {res.status_code}")
+              return await consume(res.aiter_text())
+        except (httpx.TimeoutException, httpx.TransportError) as e:
+          error = f"{type(e).__name__}: {e}"
+        finally:
+          self.stats.record(time.perf_counter() - start)
+
+        if attempt < self.max_retries:
+          self.stats.retries += 1
+          await asyncio.sleep(self.backoff(attempt))
+    self.stats.errors += 1
+    raise FetchError(url, f"Giving up after {self.max_retries + 1} attempts, last error: {error}")
+
+async def read_text(chunks: AsyncIterator[str]) -> str:
+  return "".join([chunk async for chunk in chunks])
@@ -0,0 +1,222 @@
+import time
+from contextlib import contextmanager
+from itertools import islice
+from typing import Any, Callable, Iterable
+from sqlalchemy import MetaData, Table, func, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import Connection, Engine
+import settings
+from models import transaction as model
+from services import metrics
+
+'''
+Bulk loader: rows are plain tuples (see TRANSACTION_COLUMNS) streamed in chunks through SQLAlchemy Core executemany,
+instead of one ORM object per row. Only one chunk is held in memory at a time, whatever the size of the input.
+Each chunk is encoded to the compact layout of models/transaction.py on the way (see Dimensions.encode).
+'''
+
+# order of the values of a normalized row
+TRANSACTION_COLUMNS = ("x", "filing_date", "trade_date", "ticker", "company_name", "insider_name", "insider_title", "trade_type", "price", "qty", "owned", "delta_owned", "delta_owned_pct", "delta_owned_flag", "value")
+# columns of transaction_facts refreshed when a row with the same natural key is imported again, the others make the key
+# (the company name is a column of tickers, see Dimensions)
+UPSERT_COLUMNS = ("x", "insider_title", "owned", "delta_owned", "delta_owned_pct", "delta_owned_flag", "value_cents")
+
+ROWS_LOADED = metrics.Counter("ingest_rows_total", "Rows written by the bulk loader (rows per second: rate of ingest_rows_total / rate of ingest_load_seconds_total)")
+LOAD_SECONDS = metrics.Counter("ingest_load_seconds_total", "Time spent by the bulk loader, commit included")
+
+class LoadStats:
+  def __init__(self):
+    self.rows = 0
+    self.batches = 0
+    self.seconds = 0.0
+
+  @property
+  def rows_per_sec(self):
+    return self.rows / self.seconds if self.seconds else None
+
+  def summary(self) -> dict:
+    return {"rows": self.rows, "batches": self.batches, "seconds": round(self.seconds, 3), "rows_per_sec": round(self.rows_per_sec or 0)}
+
+  def __repr__(self):
+    return f"LoadStats(rows={self.rows}, batches={self.batches}, seconds={self.seconds:.3f}, rows_per_sec={self.rows_per_sec or 0:.0f})"
+
+@contextmanager
+def bulk_load_pragmas(conn: Connection, cache_size_mb: int = settings.LOAD_CACHE_SIZE_MB):
+  '''
+  Tune a SQLite connection for a bulk load, and restore the defaults afterwards (the connection goes back to the pool).
+  WAL is persistent and also lets the readers carry on while the load is writing.
+  Pragmas cannot be changed inside a transaction, so use it before the load begins.
+  '''
+  if conn.dialect.name != "sqlite":
+    yield conn
+    return
+  previous = {name: conn.exec_driver_sql(f"PRAGMA {name}").scalar() for name in ("synchronous", "cache_size", "temp_store")}
+  conn.exec_driver_sql("PRAGMA journal_mode=WAL")
+  conn.exec_driver_sql("PRAGMA synchronous=NORMAL")
+  conn.exec_driver_sql(f"PRAGMA cache_size=-{cache_size_mb * 1024}") # negative: size in KiB
+  conn.exec_driver_sql("PRAGMA temp_store=MEMORY")
+  conn.commit()
+  try:
+    yield conn
+  finally:
+    conn.rollback() # nothing is pending unless the load failed
+    for name, value in previous.items():
+      conn.exec_driver_sql(f"PRAGMA {name}={value}")
+    conn.commit()
+
+def to_cents(value) -> int:
+  return None if value is None else round(value * 100)
+
+class Dimensions:
+  '''
+  Integer ids of the tickers, insiders and trade types of the rows loaded on a connection, the missing ones created on first use.
+  The ids are kept for the whole load, so each name is looked up once, not once per chunk.
+  A ticker takes the company name of its last imported row (the first one when on_conflict is nothing).
+  '''
+  def __init__(self, conn: Connection, on_conflict: str = settings.LOAD_ON_CONFLICT):
+    self.conn = conn
+    self.on_conflict = on_conflict
+    self.ids = {} # {table name: {name: id}}
+    self.values = {} # {table name: {name: {column: value}}}, the other columns as last written
+
+  def ensure(self, table: Table, key: str, names: dict):
+    '''
+    Create the names of a dimension table which are missing, and update the other columns of the ones which changed.
+    names: {name: {column: value}}, a None value leaves the stored one unchanged
+    '''
+    ids, values = self.ids.setdefault(table.name, {}), self.values.setdefault(table.name, {})
+    changed = [name for name, columns in names.items() if name not in ids or any(value is not None and value != values[name].get(column) for column, value in columns.items())]
+    if not changed:
+      return
+    others = [column for column in table.columns if column.name not in ("id", key)]
+    stmt = sqlite_insert(table)
+    if others and self.on_conflict == "update":
+      stmt = stmt.on_conflict_do_update(index_elements=[key], set_={column.name: func.coalesce(stmt.excluded[column.name], column) for column in others})
+    else:
+      stmt = stmt.on_conflict_do_nothing(index_elements=[key])
+    self.conn.execute(stmt, [{key: name, **{column.name: names[name].get(column.name) for column in others}} for name in changed])
+    for name_id, name, *rest in self.conn.execute(select(table.c.id, table.c[key], *others).where(table.c[key].in_(changed))):
+      ids[name] = name_id
+      values[name] = {column.name: value for column, value in zip(others, rest)}
+
+  def encode(self, rows: list[tuple]) -> list[dict]:
+    ''' The transaction_facts parameters of rows in TRANSACTION_COLUMNS order: names replaced by their ids, money in cents '''
+    tickers, insiders, trade_types = {}, {}, {}
+    for _, _, _, ticker, company_name, insider_name, _, trade_type, *_ in rows:
+      if ticker is not None:
+        columns = tickers.setdefault(ticker, {})
+        if company_name is not None:
+          columns["company_name"] = company_name
+      if insider_name is not None:
+        insiders[insider_name] = {}
+      if trade_type is not None:
+        trade_types[trade_type] = {}
+    self.ensure(model.Ticker.__table__, "ticker", tickers)
+    self.ensure(model.Insider.__table__, "name", insiders)
+    self.ensure(model.TradeType.__table__, "trade_type", trade_types)
+    ticker_ids, insider_ids, trade_type_ids = self.ids["tickers"], self.ids["insiders"], self.ids["trade_types"]
+    return [{
+      "x": x,
+      "filing_date": filing_date,
+      "trade_date": trade_date,
+      "ticker_id": ticker_ids.get(ticker),
+      "insider_id": insider_ids.get(insider_name),
+      "insider_title": insider_title,
+      "trade_type_id": trade_type_ids.get(trade_type),
+      "price_cents": to_cents(price),
+      "qty": qty,
+      "owned": owned,
+      "delta_owned": delta_owned,
+      "delta_owned_pct": delta_owned_pct,
+      "delta_owned_flag": delta_owned_flag,
+      "value_cents": to_cents(value),
+    } for x, filing_date, trade_date, ticker, _, insider_name, insider_title, trade_type, price, qty, owned, delta_owned, delta_owned_pct, delta_owned_flag, value in rows]
+
+def iter_batches(rows: Iterable, batch_size: int):
+  rows = iter(rows)
+  while batch := list(islice(rows, batch_size)):
+    yield batch
+
+def upsert_statement(table: Table, conflict_keys: Iterable[str], on_conflict: str):
+  '''
+  INSERT ... ON CONFLICT (conflict_keys) DO NOTHING / DO UPDATE (UPSERT_COLUMNS)
+  '''
+  stmt = sqlite_insert(table)
+  if on_conflict == "nothing":
+    return stmt.on_conflict_do_nothing(index_elements=list(conflict_keys))
+  if on_conflict == "update":
+    return stmt.on_conflict_do_update(index_elements=list(conflict_keys), set_={column: stmt.excluded[column] for column in UPSERT_COLUMNS})
+  raise ValueError(f"Unknown on_conflict '{on_conflict}', expected nothing or update.")
+
+def insert_batches(conn: Connection, table: Table, rows: Iterable[tuple], batch_size: int = settings.LOAD_BATCH_SIZE, stats: LoadStats = None, conflict_keys: Iterable[str] = None, on_conflict: str = settings.LOAD_ON_CONFLICT) -> LoadStats:
+  '''
+  Insert rows (tuples in TRANSACTION_COLUMNS order) in table (transaction_facts or its shadow) on an open connection,
+  the caller owns the transaction.
+  With conflict_keys (the columns of a unique index), rows already in the table are skipped or updated (on_conflict: nothing, update),
+  so importing the same rows again is idempotent.
+  '''
+  stats = stats or LoadStats()
+  started = time.perf_counter()
+  stmt = upsert_statement(table, conflict_keys, on_conflict) if conflict_keys else table.insert()
+  dimensions = Dimensions(conn, on_conflict)
+  for batch in iter_batches(rows, batch_size):
+    conn.execute(stmt, dimensions.encode(batch)) # executemany
+    stats.rows += len(batch)
+    stats.batches += 1
+  stats.seconds += time.perf_counter() - started
+  return stats
+
+def bulk_insert(engine: Engine, table: Table, rows: Iterable[tuple], batch_size: int = settings.LOAD_BATCH_SIZE, conflict_keys: Iterable[str] = None, on_conflict: str = settings.LOAD_ON_CONFLICT, on_loaded: Callable[[Connection], Any] = None) -> LoadStats:
+  '''
+  Load rows in a single transaction, with the bulk load pragmas, and return the load statistics.
+  on_loaded(conn) runs after the last chunk, in the same transaction (e.g. to update tables derived from the rows).
+  '''
+  started = time.perf_counter()
+  with engine.connect() as conn, bulk_load_pragmas(conn):
+    stats = insert_batches(conn, table, rows, batch_size, conflict_keys=conflict_keys, on_conflict=on_conflict)
+    if on_loaded:
+      on_loaded(conn)
+    conn.commit()
+  stats.seconds = time.perf_counter() - started # including the commit
+  ROWS_LOADED.inc(stats.rows)
+  LOAD_SECONDS.inc(stats.seconds)
+  return stats
+
+# ============================
+# Shadow table: a full reload is built aside and swapped in at once
+# ============================
+SHADOW_SUFFIX = "_shadow"
+
+def shadow_table(table: Table) -> Table:
+  '''
+  Copy of table named {table}_shadow, with the same columns and primary key but no index:
+  rows are appended at full speed, without maintaining the indexes row by row.
+  '''
+  shadow = table.to_metadata(MetaData(), name=table.name + SHADOW_SUFFIX)
+  shadow.indexes.clear() # the index names are global in SQLite, they are created on the table once it is swapped in
+  return shadow
+
+def reset_shadow(engine: Engine, shadow: Table, keep: bool = False):
+  ''' Create the shadow table, emptied first unless keep (resuming a reload) '''
+  if not keep:
+    shadow.drop(bind=engine, checkfirst=True)
+  shadow.create(bind=engine, checkfirst=True)
+
+def swap_in(conn: Connection, shadow: Table, table: Table):
+  '''
+  Replace table by shadow in the transaction of conn: drop table, rename shadow to it and build the indexes of table.
+  The readers keep seeing the previous table until the commit (WAL), then the full new one: never an empty or partial table.
+  The indexes are built in bulk on the final rows, which is much faster than maintaining them during the load;
+  only the other writers wait for it.
+  The views are dropped and created again around the swap: SQLite checks them when a table is renamed, and they would
+  still name the dropped table.
+  '''
+  views = conn.exec_driver_sql("SELECT name, sql FROM sqlite_master WHERE type = 'view'").fetchall()
+  for name, _ in views:
+    conn.exec_driver_sql(f"DROP VIEW {name}")
+  conn.exec_driver_sql(f"DROP TABLE {table.name}")
+  conn.exec_driver_sql(f"ALTER TABLE {shadow.name} RENAME TO {table.name}")
+  for index in table.indexes:
+    index.create(bind=conn)
+  for _, sql in views:
+    conn.exec_driver_sql(sql)
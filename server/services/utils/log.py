@@ -0,0 +1,62 @@
+import json, logging, sys
+from datetime import datetime, UTC
+import settings
+
+'''
+Logging of the service: the modules log through logging.getLogger(__name__), configure() sets up the root logger of a
+process (main, the job worker processes) from LOG_LEVEL and LOG_FORMAT.
+The values of an event go in extra, as fields, rather than in the message:
+  logger.info("Imported rows", extra={"rows": stats.rows, "seconds": round(stats.seconds, 3)})
+  text: 2025-01-31T21:00:00.123Z INFO services.transaction Imported rows rows=5000 seconds=0.41
+  json: {"ts": "2025-01-31T21:00:00.123Z", "level": "INFO", "logger": "services.transaction", "msg": "Imported rows", "rows": 5000, "seconds": 0.41}
+'''
+
+RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "taskName"}
+
+def fields(record: logging.LogRecord) -> dict:
+  ''' The extra values of a record '''
+  return {key: value for key, value in vars(record).items() if key not in RESERVED}
+
+def timestamp(record: logging.LogRecord) -> str:
+  return datetime.fromtimestamp(record.created, UTC).isoformat(timespec="milliseconds").replace("+00:00", "Z")
+
+def text_value(value) -> str:
+  value = json.dumps(value, default=str, separators=(",", ":")) if isinstance(value, (dict, list)) else str(value)
+  return json.dumps(value) if not value or any(c in value for c in ' "=\n') else value
+
+class TextFormatter(logging.Formatter):
+  def format(self, record: logging.LogRecord) -> str:
+    line = f"{timestamp(record)} {record.levelname} {record.name} {record.getMessage()}"
+    for key, value in fields(record).items():
+      line += f" {key}={text_value(value)}"
+    if record.exc_info:
+      line += "\n" + self.formatException(record.exc_info)
+    return line
+
+class JsonFormatter(logging.Formatter):
+  def format(self, record: logging.LogRecord) -> str:
+    entry = {"ts": timestamp(record), "level": record.levelname, "logger": record.name, "msg": record.getMessage()}
+    entry.update(fields(record))
+    if record.exc_info:
+      entry["exc_info"] = self.formatException(record.exc_info)
+    return json.dumps(entry, default=str)
+
+FORMATTERS = {"text": TextFormatter, "json": JsonFormatter}
+QUIET_LOGGERS = ("httpx", "httpcore") # one INFO line per scraped page, only kept at DEBUG level
+
+def configure(level: str = settings.LOG_LEVEL, fmt: str = settings.LOG_FORMAT):
+  '''
+  One handler on stderr for the whole process, below level nothing is formatted (nor are its arguments).
+  Raises: ValueError for an unknown level or format
+  '''
+  if fmt not in FORMATTERS:
+    raise ValueError(f"Unknown LOG_FORMAT '{fmt}', expected text or json.")
+  handler = logging.StreamHandler(sys.stderr)
+  handler.setFormatter(FORMATTERS[fmt]())
+  root = logging.getLogger()
+  for previous in list(root.handlers):
+    root.removeHandler(previous)
+  root.addHandler(handler)
+  root.setLevel(level)
+  for name in QUIET_LOGGERS:
+    logging.getLogger(name).setLevel(level if root.level <= logging.DEBUG else logging.WARNING)
@@ -0,0 +1,139 @@
+import re
+from datetime import date, datetime
+from typing import Sequence
+import pyarrow as pa
+import pyarrow.compute as pc
+
+'''
+Columnar normalization of scraped rows: the raw cell texts of a month are turned into typed Arrow arrays, one
+vectorized pass per column (Arrow compute kernels), instead of parsing every cell with a Python call (normalize_row).
+The result has the columns and types of loader.TRANSACTION_COLUMNS, with the same values as normalize_row.
+'''
+
+# raw columns, in COLUMN_HEADERS order (services/transaction.py)
+RAW_COLUMNS = ("x", "filing_date", "trade_date", "ticker", "company_name", "insider_name", "insider_title", "trade_type", "price", "qty", "owned", "delta_owned", "value")
+
+# normalized columns, in loader.TRANSACTION_COLUMNS order
+SCHEMA = pa.schema([
+  ("x", pa.string()),
+  ("filing_date", pa.timestamp("us")),
+  ("trade_date", pa.date32()),
+  ("ticker", pa.string()),
+  ("company_name", pa.string()),
+  ("insider_name", pa.string()),
+  ("insider_title", pa.string()),
+  ("trade_type", pa.string()),
+  ("price", pa.float64()),
+  ("qty", pa.int64()),
+  ("owned", pa.int64()),
+  ("delta_owned", pa.string()),
+  ("delta_owned_pct", pa.float64()),
+  ("delta_owned_flag", pa.string()),
+  ("value", pa.float64()),
+])
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+# change of the holding: "+5%", "-100%", ">999%" (more than 999%, the site's cap) or "New" (no holding before the trade)
+DELTA_OWNED_PATTERN = r"^(?P<capped>>?)\+?(?P<pct>-?[0-9]+(?:\.[0-9]+)?)%$"
+DELTA_OWNED_NEW = "New"
+# delta_owned_flag values, NULL for a plain percentage
+FLAG_NEW = "new" # delta_owned_pct is NULL
+FLAG_CAPPED = "capped" # delta_owned_pct is the cap, a lower bound of the change
+
+NUMBER_NOISE = ("$", ",", "+") # currency sign, thousands separators, explicit plus sign
+
+def parse_delta_owned(value: str) -> tuple[float | None, str | None]:
+  '''
+  Row-at-a-time version of delta_owned_columns, for normalize_row.
+  Returns: (delta_owned_pct, delta_owned_flag), (None, None) for an empty or unknown text
+  '''
+  if value == DELTA_OWNED_NEW:
+    return None, FLAG_NEW
+  match = re.match(DELTA_OWNED_PATTERN, value or "")
+  if not match:
+    return None, None
+  return float(match["pct"]), FLAG_CAPPED if match["capped"] else None
+
+def nullify_empty(column: pa.Array) -> pa.Array:
+  ''' Empty cells are missing values '''
+  return pc.if_else(pc.equal(column, ""), pa.scalar(None, pa.string()), column)
+
+def parse_numbers(column: pa.Array, type: pa.DataType) -> pa.Array:
+  '''
+  "$1,234.50", "+1,000", "-$5,000" -> 1234.5, 1000, -5000 (the same values as parse_float and parse_int)
+  Raises: ValueError (pyarrow.ArrowInvalid) if a cell is not a number
+  '''
+  for noise in NUMBER_NOISE: # plain substring replaces, several times faster than one regex replace
+    column = pc.replace_substring(column, noise, "")
+  return pc.cast(nullify_empty(column), type)
+
+def parse_timestamps(column: pa.Array) -> pa.Array:
+  return pc.strptime(nullify_empty(column), format=TIMESTAMP_FORMAT, unit="us", error_is_null=False)
+
+def parse_dates(column: pa.Array) -> pa.Array:
+  return pc.cast(nullify_empty(column), pa.date32())
+
+def delta_owned_columns(column: pa.Array) -> tuple[pa.Array, pa.Array]:
+  '''
+  The change of the holding as a number and a flag (see parse_delta_owned), the raw text being kept in delta_owned.
+  Returns: (delta_owned_pct, delta_owned_flag)
+  '''
+  parts = pc.extract_regex(column, DELTA_OWNED_PATTERN) # NULL when the text does not match
+  pct = pc.cast(pc.struct_field(parts, "pct"), pa.float64())
+  flag = pc.if_else(
+    pc.equal(column, DELTA_OWNED_NEW), pa.scalar(FLAG_NEW),
+    pc.if_else(pc.equal(pc.struct_field(parts, "capped"), ">"), pa.scalar(FLAG_CAPPED), pa.scalar(None, pa.string())),
+  )
+  return pct, flag
+
+def normalize_columns(columns: Sequence[pa.Array]) -> pa.Table:
+  '''
+  Normalize raw string columns (in RAW_COLUMNS order, e.g. the record batches of a CSV file read as strings).
+  Returns: a Table of SCHEMA
+  Raises: ValueError if a cell cannot be parsed
+  '''
+  raw = dict(zip(RAW_COLUMNS, columns))
+  delta_owned_pct, delta_owned_flag = delta_owned_columns(raw["delta_owned"])
+  return pa.Table.from_arrays([
+    raw["x"],
+    parse_timestamps(raw["filing_date"]),
+    parse_dates(raw["trade_date"]),
+    raw["ticker"],
+    raw["company_name"],
+    raw["insider_name"],
+    raw["insider_title"],
+    raw["trade_type"],
+    parse_numbers(raw["price"], pa.float64()),
+    parse_numbers(raw["qty"], pa.int64()),
+    parse_numbers(raw["owned"], pa.int64()),
+    raw["delta_owned"],
+    delta_owned_pct,
+    delta_owned_flag,
+    parse_numbers(raw["value"], pa.float64()),
+  ], schema=SCHEMA)
+
+def normalize_batch(rows: Sequence[Sequence[str]]) -> pa.Table:
+  '''
+  Normalize scraped rows (cell texts in RAW_COLUMNS order), e.g. a month of the screener, in one pass per column.
+  Returns: a Table of SCHEMA
+  Raises: ValueError if a row has not len(RAW_COLUMNS) cells or a cell cannot be parsed
+  '''
+  if any(len(row) != len(RAW_COLUMNS) for row in rows):
+    raise ValueError(f"Expected rows of {len(RAW_COLUMNS)} cells")
+  columns = list(zip(*rows)) or [() for _ in RAW_COLUMNS]
+  return normalize_columns([pa.array(column, pa.string()) for column in columns])
+
+def to_pylist(column: pa.ChunkedArray) -> list:
+  '''
+  The values of a column as Python objects. Dates and timestamps go through their ISO text and fromisoformat,
+  several times faster than Arrow building every datetime object.
+  '''
+  if column.type == pa.date32():
+    return [None if value is None else date.fromisoformat(value) for value in pc.cast(column, pa.string()).to_pylist()]
+  if pa.types.is_timestamp(column.type):
+    return [None if value is None else datetime.fromisoformat(value) for value in pc.cast(column, pa.string()).to_pylist()]
+  return column.to_pylist()
+
+def to_rows(table: pa.Table) -> list[tuple]:
+  ''' The rows of a normalized Table as tuples of Python values, in loader.TRANSACTION_COLUMNS order '''
+  return list(zip(*(to_pylist(column) for column in table.columns)))
@@ -0,0 +1,164 @@
+from html.parser import HTMLParser
+from bs4 import BeautifulSoup
+from typing import Iterable, Iterator
+
+'''
+Parser engines for the openinsider screener page.
+Both engines return the same rows: one list of stripped cell texts per <tr> of the tinytable's <tbody>,
+where a cell containing a link is represented by the text of its first <a>.
+  - bs4: builds the whole BeautifulSoup tree, then walks it (original implementation)
+  - stream: event-driven html.parser which yields each row as soon as its </tr> closes, so memory stays constant
+    (RowStream: the same, fed the chunks of a page as they are downloaded)
+A row with fewer than num_cols cells raises ValueError, with either engine.
+'''
+
+class TableNotFoundError(Exception):
+  pass
+
+def parse_rows_bs4(html: str, num_cols: int) -> list[list[str]]:
+  soup = BeautifulSoup(html, 'html.parser')
+  table = soup.find('table', {'class': 'tinytable'})
+  if table is None or table.find('tbody') is None:
+    raise TableNotFoundError()
+  rows = table.find('tbody').find_all('tr')
+  cleaned_rows = []
+  for row in rows:
+    cols = row.find_all('td')
+    if not cols:
+      continue
+    if len(cols) < num_cols:
+      raise ValueError(f"Expected {num_cols} columns, got {len(cols)}: {[col.text.strip() for col in cols]}")
+    cleaned_row = []
+    for idx in range(num_cols):
+      link = cols[idx].find('a')
+      ele = link.text.strip() if link else cols[idx].text.strip()
+      cleaned_row.append(ele)
+    cleaned_rows.append(cleaned_row)
+  return cleaned_rows
+
+class TinyTableRowParser(HTMLParser):
+  '''
+  Incremental row extractor: feed() it chunks of the page and collect the completed rows with pop_rows().
+  Only the cells of the current row are kept in memory.
+  '''
+  def __init__(self, num_cols: int):
+    super().__init__(convert_charrefs=True)
+    self.num_cols = num_cols
+    self.found_table = False
+    self._table_depth = 0    # nesting depth of <table> inside the tinytable (1 = the tinytable itself)
+    self._in_tbody = False
+    self._row = None         # cells of the current <tr>, None when outside of a row
+    self._cell = None        # text parts of the current <td>
+    self._link = None        # text parts of the first <a> of the current <td>
+    self._link_open = False
+    self._rows = []
+
+  def handle_starttag(self, tag, attrs):
+    if tag == 'table':
+      if self._table_depth:
+        self._table_depth += 1
+      elif not self.found_table and 'tinytable' in (dict(attrs).get('class') or '').split():
+        self.found_table = True
+        self._table_depth = 1
+      return
+    if not self._table_depth:
+      return
+    if tag == 'tbody' and self._table_depth == 1:
+      self._in_tbody = True
+    elif tag == 'tr' and self._in_tbody:
+      self._row = []
+    elif tag == 'td' and self._row is not None:
+      self._cell = []
+      self._link = None
+    elif tag == 'a' and self._cell is not None and self._link is None:
+      self._link = []
+      self._link_open = True
+
+  def handle_endtag(self, tag):
+    if not self._table_depth:
+      return
+    if tag == 'table':
+      self._table_depth -= 1
+    elif tag == 'tbody' and self._table_depth == 1:
+      self._in_tbody = False
+    elif tag == 'a':
+      self._link_open = False
+    elif tag == 'td' and self._cell is not None:
+      self._close_cell()
+    elif tag == 'tr' and self._row is not None:
+      if self._cell is not None: # unclosed <td>
+        self._close_cell()
+      if self._row:
+        self._rows.append(self._clean_row(self._row))
+      self._row = None
+
+  def handle_data(self, data):
+    if self._cell is not None:
+      self._cell.append(data)
+      if self._link_open:
+        self._link.append(data)
+
+  def _close_cell(self):
+    parts = self._link if self._link is not None else self._cell
+    self._row.append(''.join(parts).strip())
+    self._cell = None
+    self._link = None
+    self._link_open = False
+
+  def _clean_row(self, row: list[str]) -> list[str]:
+    if len(row) < self.num_cols:
+      raise ValueError(f"Expected {self.num_cols} columns, got {len(row)}: {row}")
+    return row[:self.num_cols]
+
+  def pop_rows(self) -> list[list[str]]:
+    rows, self._rows = self._rows, []
+    return rows
+
+def iter_rows_stream(chunks: Iterable[str], num_cols: int) -> Iterator[list[str]]:
+  '''
+  Yield rows while the page is still being read, chunks can be the lines of a file or response.iter_content().
+  Raises TableNotFoundError once the input is exhausted without a tinytable.
+  '''
+  parser = TinyTableRowParser(num_cols)
+  for chunk in chunks:
+    parser.feed(chunk)
+    yield from parser.pop_rows()
+  parser.close()
+  yield from parser.pop_rows()
+  if not parser.found_table:
+    raise TableNotFoundError()
+
+class RowStream:
+  '''
+  Push form of iter_rows_stream, for chunks which arrive asynchronously (AsyncFetcher.fetch_stream):
+  feed() it the chunks of a page, then close() returns its rows.
+  '''
+  def __init__(self, num_cols: int):
+    self.parser = TinyTableRowParser(num_cols)
+    self.rows = []
+
+  def feed(self, chunk: str):
+    self.parser.feed(chunk)
+    self.rows += self.parser.pop_rows()
+
+  def close(self) -> list[list[str]]:
+    ''' Raises: TableNotFoundError if the page had no tinytable '''
+    self.parser.close()
+    self.rows += self.parser.pop_rows()
+    if not self.parser.found_table:
+      raise TableNotFoundError()
+    return self.rows
+
+def parse_rows_stream(html: str, num_cols: int) -> list[list[str]]:
+  return list(iter_rows_stream([html], num_cols))
+
+ENGINES = {
+  "bs4": parse_rows_bs4,
+  "stream": parse_rows_stream,
+}
+
+def get_engine(name: str):
+  try:
+    return ENGINES[name]
+  except KeyError:
+    raise ValueError(f"Unknown parser engine '{name}', expected one of {list(ENGINES)}.")
@@ -19,7 +19,11 @@ SQLALCHEMY_DATABASE_URL=os.environ.get("SQLALCHEMY_DATABASE_URL")
 REDIS_URL=os.environ.get("REDIS_URL")
 REDIS_PASSWORD=os.environ.get("REDIS_PASSWORD")
 REDIS_PORT=os.environ.get("REDIS_PORT")
-REDIS_EX=os.environ.get("REDIS_EX", 600)  # Default to 600 seconds if not set
+REDIS_EX=int(os.environ.get("REDIS_EX", 600))  # Default to 600 seconds if not set
+REDIS_TIMEOUT=float(os.environ.get("REDIS_TIMEOUT", os.environ.get("CACHE_REDIS_TIMEOUT", 0.25))) # seconds, connect and command
+REDIS_RETRY=float(os.environ.get("REDIS_RETRY", os.environ.get("CACHE_REDIS_RETRY", 30))) # seconds on the in-process fallbacks after a connection error, before Redis is tried again
+REDIS_HEALTH_CHECK_INTERVAL=int(os.environ.get("REDIS_HEALTH_CHECK_INTERVAL", 30)) # seconds a pooled connection may sit idle before it is checked (PING) on use
+REDIS_MAX_CONNECTIONS=int(os.environ["REDIS_MAX_CONNECTIONS"]) if os.environ.get("REDIS_MAX_CONNECTIONS") else None # per pool and process, unbounded by default
 
 # ============================
 # Rate Limiter Constants
@@ -40,15 +44,58 @@ MAX_WORKERS=os.environ.get("MAX_WORKERS")
 OUTPUT_DIR=os.path.join(basedir, os.environ.get("OUTPUT_DIR"))
 COLUMN_HEADERS=os.environ.get("COLUMN_HEADERS")
 MAX_ROWS=os.environ.get("MAX_ROWS")
+PARSER_ENGINE=os.environ.get("PARSER_ENGINE", "stream") # values: stream (incremental html.parser), bs4 (full BeautifulSoup tree)
+PARSER_CHUNK_SIZE=int(os.environ.get("PARSER_CHUNK_SIZE", 64 * 1024)) # bytes read from the response per parser feed
+FETCH_CONCURRENCY=int(os.environ.get("FETCH_CONCURRENCY", MAX_WORKERS or 3)) # max in-flight requests per host
+FETCH_RPS=float(os.environ.get("FETCH_RPS", 2)) # max requests per second per host, 0 to disable
+FETCH_TIMEOUT=float(os.environ.get("FETCH_TIMEOUT", 60)) # seconds
+FETCH_MAX_RETRIES=int(os.environ.get("FETCH_MAX_RETRIES", 4)) # retries on 5xx/429, timeouts and connection errors
+FETCH_BACKOFF_BASE=float(os.environ.get("FETCH_BACKOFF_BASE", 0.5)) # seconds, doubled on every retry (with full jitter)
+FETCH_BACKOFF_MAX=float(os.environ.get("FETCH_BACKOFF_MAX", 30)) # seconds
+FETCH_USER_AGENT=os.environ.get("FETCH_USER_AGENT", "open-insider-trades/1.0")
+PARSE_WORKERS=int(os.environ.get("PARSE_WORKERS", 2)) # threads parsing fetched pages while the next ones download
+PIPELINE_QUEUE_SIZE=int(os.environ.get("PIPELINE_QUEUE_SIZE", 4)) # months buffered between two pipeline stages
+INGEST_MODE=os.environ.get("INGEST_MODE", "direct") # values: direct (scraped rows go straight to the database), csv (write then re-read the CSV files)
+NORMALIZER=os.environ.get("NORMALIZER", "batch") # values: batch (a month per column with Arrow kernels, see services/utils/normalizer.py), row (normalize_row)
+LOAD_BATCH_SIZE=int(os.environ.get("LOAD_BATCH_SIZE", 5000)) # rows per executemany during the import
+LOAD_ON_CONFLICT=os.environ.get("LOAD_ON_CONFLICT", "update") # re-imported filing lines: update (refresh the non-key columns) or nothing (keep the first import)
+LOAD_CACHE_SIZE_MB=int(os.environ.get("LOAD_CACHE_SIZE_MB", 256)) # SQLite page cache of the loading connection
+LEDGER_REFETCH_DAYS=int(os.environ.get("LEDGER_REFETCH_DAYS", 7)) # ranges ending in the last N days are fetched again by a bootstrap, older imported ones are skipped
+CSV_ARCHIVE=os.environ.get("CSV_ARCHIVE", "gzip") # values: gzip (.csv.gz), csv, off. In direct mode the archive is written on the side
+EXPORT_ENABLED=os.environ.get("EXPORT_ENABLED", "false").lower() == "true" # every ingestion job is followed by an export job rewriting the Parquet partitions of the months it touched
+EXPORT_DIR=os.path.join(OUTPUT_DIR, os.environ.get("EXPORT_DIR", "export")) # Parquet dataset partitioned by trade year/month (relative to OUTPUT_DIR)
+EXPORT_COMPRESSION=os.environ.get("EXPORT_COMPRESSION", "zstd") # values: zstd, snappy, gzip, none
 
 # ============================
 # API Constants
 # ============================
 SUPER_ADMIN_ID = os.environ.get("SUPER_ADMIN_ID")
 SUPER_ADMIN_SECRET = os.environ.get("SUPER_ADMIN_SECRET")
+DEFAULT_PAGE_SIZE = int(os.environ.get("DEFAULT_PAGE_SIZE", 100)) # transactions per page when the limit is not given
+MAX_PAGE_SIZE = int(os.environ.get("MAX_PAGE_SIZE", 1000))
+STREAM_BATCH_SIZE = int(os.environ.get("STREAM_BATCH_SIZE", 1000)) # rows fetched and encoded at a time by the ndjson and csv formats
+CACHE_ENABLED = os.environ.get("CACHE_ENABLED", "true").lower() == "true" # response cache of the transaction endpoints, entries expire after REDIS_EX seconds
+CACHE_LRU_SIZE = int(os.environ.get("CACHE_LRU_SIZE", 1024)) # responses kept in the in-process fallback while Redis is down
+CACHE_INVALIDATION_POLL = float(os.environ.get("CACHE_INVALIDATION_POLL", 1)) # seconds between two reads of the invalidations of the imports by an API process (for its in-process LRU)
+CACHE_MAX_TAG_MONTHS = int(os.environ.get("CACHE_MAX_TAG_MONTHS", 24)) # longer date ranges are invalidated by every import
+AUTH_CACHE_ENABLED = os.environ.get("AUTH_CACHE_ENABLED", "true").lower() == "true" # verified access token -> client cache, entries never outlive the token
+AUTH_CACHE_SIZE = int(os.environ.get("AUTH_CACHE_SIZE", 4096)) # tokens kept in the in-process tier
+AUTH_CACHE_TTL = float(os.environ.get("AUTH_CACHE_TTL", 60)) # seconds in the in-process tier: how long another worker may still accept a revoked token
+TOKEN_STATE_BACKEND = os.environ.get("TOKEN_STATE_BACKEND", "redis" if REDIS_URL else "memory") # revoked and refresh tokens, values: redis (shared by the workers), memory (single process)
+TOKEN_STATE_MAX_ENTRIES = int(os.environ.get("TOKEN_STATE_MAX_ENTRIES", 100000)) # revoked and refresh tokens each, in the memory store
+REFRESH_TOKEN_EXPIRE_DAYS = float(os.environ.get("REFRESH_TOKEN_EXPIRE_DAYS", 7))
 
 # ============================
 # DAILY SYNC Constants
 # ============================
 DAILY_SYNC_HOUR=os.environ.get("DAILY_SYNC_HOUR", 21) # default is 20 (9 PM)
-MISFIRE_GRACE_TIME=os.environ.get("MISFIRE_GRACE_TIME", 3600) # default is 3600 seconds (1 hour)
\ No newline at end of file
+MISFIRE_GRACE_TIME=os.environ.get("MISFIRE_GRACE_TIME", 3600) # default is 3600 seconds (1 hour)
+JOB_WORKERS=int(os.environ.get("JOB_WORKERS", 1)) # processes running the bootstrap/daily sync jobs (SQLite has a single writer)
+
+# ============================
+# Observability Constants
+# ============================
+LOG_LEVEL=os.environ.get("LOG_LEVEL", "INFO").upper() # values: DEBUG, INFO, WARNING, ERROR
+LOG_FORMAT=os.environ.get("LOG_FORMAT", "text") # values: text (message then key=value fields), json (one object per line)
+METRICS_ENABLED=os.environ.get("METRICS_ENABLED", "true").lower() == "true" # GET /metrics (Prometheus text format) and the request timing
+METRICS_DIR=os.path.join(OUTPUT_DIR, os.environ.get("METRICS_DIR", "metrics")) # metrics of the job worker processes, read by the API process (relative to OUTPUT_DIR)
\ No newline at end of file
@@ -0,0 +1,17 @@
+import os, tempfile
+
+'''
+The settings are read from the environment when the app modules are imported: the tests run against a database and an
+output directory of their own (unless set), created before any of them is imported.
+'''
+
+TEST_DIR = tempfile.mkdtemp(prefix="oit-tests-")
+os.environ.setdefault("SQLALCHEMY_DATABASE_URL", f"sqlite:///{os.path.join(TEST_DIR, 'app.db')}")
+os.environ.setdefault("OUTPUT_DIR", os.path.join(TEST_DIR, "out"))
+os.environ.setdefault("SECRET_KEY", "test-secret")
+os.environ.setdefault("ALGORITHM", "HS256")
+os.environ.setdefault("ACCESS_TOKEN_EXPIRE_MINUTES", "30")
+os.environ.setdefault("SUPER_ADMIN_ID", "test-admin")
+os.environ.setdefault("SUPER_ADMIN_SECRET", "test-admin-secret")
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "fixtures")
@@ -0,0 +1,61 @@
+import asyncio
+from datetime import date
+import pytest
+from db import engine, async_engine
+from services import cache
+from services import transaction as transact_mgr
+
+@pytest.fixture
+def lru(monkeypatch):
+  cache.invalidations.create(bind=engine, checkfirst=True)
+  cache.lru.clear()
+  monkeypatch.setattr(cache, "stats", cache.CacheStats())
+  asyncio.run(cache.poll_invalidations(async_engine)) # a process starting: takes the position
+  yield cache.lru
+  cache.lru.clear()
+
+def test_worker_invalidations_reach_the_lru_of_another_process(lru):
+  lru.set("page-aapl", "[]", ["ticker:AAPL", "month:2024-01"])
+  lru.set("page-msft", "[]", ["ticker:MSFT", "month:2024-02"])
+  lru.set("top", "[]", ["month:2024-03"])
+  with engine.begin() as conn: # an import in a job worker, which only records the invalidation
+    cache.record_invalidation(conn, ["ticker:AAPL", "month:2024-02"])
+  assert lru.get("page-aapl") is not None # until the next poll
+  assert asyncio.run(cache.poll_invalidations(async_engine)) == 2
+  assert (lru.get("page-aapl"), lru.get("page-msft"), lru.get("top")) == (None, None, "[]")
+  assert asyncio.run(cache.poll_invalidations(async_engine)) == 0 # each invalidation is applied once
+
+def test_refresh_drops_every_entry(lru):
+  lru.set("top", "[]", ["month:2024-03"])
+  with engine.begin() as conn:
+    cache.record_invalidation(conn, [cache.ALL_TAGS])
+  asyncio.run(cache.poll_invalidations(async_engine))
+  assert len(lru) == 0
+
+def test_rolled_back_import_invalidates_nothing(lru):
+  lru.set("top", "[]", ["month:2024-03"])
+  with engine.connect() as conn:
+    cache.record_invalidation(conn, ["month:2024-03"])
+    conn.rollback()
+  asyncio.run(cache.poll_invalidations(async_engine))
+  assert lru.get("top") == "[]"
+
+def test_an_invalidation_between_the_read_and_the_put_is_not_cached_over(lru, monkeypatch):
+  async def retrieve_transactions_async(db, ticker_id, *args):
+    rows = [] # read before the import commits
+    with engine.begin() as conn: # the import commits, and this process applies its invalidation before the put
+      cache.record_invalidation(conn, transact_mgr.days_cache_tags({("AAPL", date(2024, 1, 5))}))
+    await cache.poll_invalidations(async_engine)
+    return rows, None
+  monkeypatch.setattr(transact_mgr, "retrieve_transactions_async", retrieve_transactions_async)
+  page = asyncio.run(transact_mgr.retrieve_page_async(None, "", date(2024, 1, 1), date(2024, 1, 31)))
+  assert page == ("[]", None, False)
+  assert len(lru) == 0 and cache.stats.stale_sets == 1
+
+def test_a_put_after_the_invalidation_is_cached(lru):
+  tags = ["month:2024-01"]
+  lru.invalidate(set(tags))
+  value, version = cache.get("page", tags)
+  assert value is None
+  cache.put("page", "[]", tags, version)
+  assert cache.get("page", tags)[0] == "[]"
@@ -0,0 +1,35 @@
+import asyncio
+import httpx
+from test_parser import read_page
+from services import transaction as transact_mgr
+from services.utils.fetcher import AsyncFetcher
+
+class BrokenStream(httpx.AsyncByteStream):
+  ''' A body cut after its first chunk '''
+  def __init__(self, body: bytes):
+    self.body = body
+
+  async def __aiter__(self):
+    yield self.body[:1000]
+    raise httpx.ReadError("Connection reset by peer")
+
+def test_stream_retries_a_body_cut_halfway_with_a_new_parser():
+  body = read_page("screener_month.html").encode()
+  responses = [httpx.Response(503), httpx.Response(200, stream=BrokenStream(body)), httpx.Response(200, content=body)]
+  parsers = []
+  async def parse(chunks):
+    page = transact_mgr.PageStream()
+    parsers.append(page)
+    async for chunk in chunks:
+      page.feed(chunk)
+    return page.close()
+  async def main():
+    async with AsyncFetcher(rps=0, backoff_base=0) as fetcher:
+      await fetcher._client.aclose()
+      fetcher._client = httpx.AsyncClient(transport=httpx.MockTransport(lambda request: responses.pop(0)))
+      rows = await fetcher.fetch_stream("http://openinsider.test/screener", parse)
+      return rows, fetcher.stats.summary()
+  rows, stats = asyncio.run(main())
+  assert rows == transact_mgr.parse_page(body.decode())
+  assert len(parsers) == 2 # the parser of the cut body is dropped
+  assert (stats["attempts"], stats["retries"], stats["errors"]) == (3, 2, 0)
@@ -0,0 +1,79 @@
+from datetime import date, timedelta
+import pytest
+from sqlalchemy import select
+from db import engine, SessionLocal
+from models import job as model
+from services import jobs
+from services.pipeline import MonthResult, PipelineReport
+
+DEAD_PID = 2 ** 22 + 1 # above pid_max, never alive
+
+class StubExecutor:
+  def __init__(self):
+    self.submitted = []
+
+  def submit(self, fn, *args):
+    self.submitted.append(args)
+
+@pytest.fixture
+def executor(monkeypatch):
+  model.Job.__table__.create(bind=engine, checkfirst=True)
+  model.JobMonth.__table__.create(bind=engine, checkfirst=True)
+  with SessionLocal() as db:
+    db.query(model.JobMonth).delete()
+    db.query(model.Job).delete()
+    db.commit()
+  executor = StubExecutor()
+  monkeypatch.setattr(jobs, "get_executor", lambda: executor)
+  return executor
+
+def add_job(status: str, pid: int = None, kind: str = "bootstrap", as_of: date = None) -> str:
+  with SessionLocal() as db:
+    job = model.Job(kind=kind, start_year=as_of.year if as_of else 2024, as_of=as_of, status=status, pid=pid)
+    db.add(job)
+    db.commit()
+    return job.id
+
+def test_each_interrupted_job_is_resumed_by_one_api_process(executor, monkeypatch):
+  orphaned = {add_job("running", DEAD_PID), add_job("queued", DEAD_PID), add_job("queued")}
+  add_job("succeeded", DEAD_PID)
+  assert set(jobs.resume_jobs()) == orphaned
+  monkeypatch.setattr(jobs.os, "getpid", lambda: 1) # another API process, started alongside: the jobs are owned by a live one
+  assert jobs.resume_jobs() == []
+  assert sorted(executor.submitted) == sorted((job_id,) for job_id in orphaned)
+
+def test_a_claim_on_a_stale_read_loses(executor):
+  job_id = add_job("running", DEAD_PID)
+  with SessionLocal() as db:
+    assert jobs.claim_job(db, job_id, ("running", DEAD_PID), "queued")
+    assert not jobs.claim_job(db, job_id, ("running", DEAD_PID), "queued") # a process which read the job before the first claim
+    assert not jobs.claim_job(db, job_id, ("queued", DEAD_PID), "running")
+
+def test_a_failed_export_fails_its_own_job_not_the_ingestion(executor, monkeypatch):
+  def extract_data(db, start_year, daily_sync, months, trade_months, **hooks): # an ingestion loading rows traded in two months
+    trade_months.update({(2024, 1), (2023, 12)})
+    return PipelineReport(months=[MonthResult(start, end, "loaded", rows=10) for start, end in months])
+  def write_month(conn, year, month):
+    raise OSError("No space left on device")
+  monkeypatch.setattr(jobs.settings, "EXPORT_ENABLED", True)
+  monkeypatch.setattr(jobs.ledger, "plan", lambda db, months: (months, [], {}))
+  monkeypatch.setattr(jobs.transact_mgr, "extract_data", extract_data)
+  monkeypatch.setattr(jobs.export, "write_month", write_month)
+  job_id = add_job("queued")
+  jobs.run_job(job_id)
+  with SessionLocal() as db:
+    assert db.get(model.Job, job_id).status == "succeeded"
+    export_job = db.scalars(select(model.Job).where(model.Job.kind == "export")).one()
+    assert export_job.status == "failed" and "No space left" in export_job.error
+    assert [(month.start_date, month.end_date) for month in export_job.months] == [(date(2023, 12, 1), date(2023, 12, 31)), (date(2024, 1, 1), date(2024, 1, 31))]
+
+def test_a_daily_sync_resumed_the_next_day_scrapes_the_day_it_was_submitted_for(executor, monkeypatch):
+  scraped = []
+  def extract_data(db, start_year, daily_sync, months, trade_months, **hooks):
+    scraped.extend(months)
+    return PipelineReport()
+  monkeypatch.setattr(jobs.ledger, "plan", lambda db, months: (months, [], {}))
+  monkeypatch.setattr(jobs.transact_mgr, "extract_data", extract_data)
+  yesterday = date.today() - timedelta(days=1)
+  jobs.run_job(add_job("queued", DEAD_PID, "daily_sync", yesterday))
+  assert scraped == [(yesterday.strftime("%m/%d/%Y"),) * 2]
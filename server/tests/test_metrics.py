@@ -0,0 +1,29 @@
+import pytest
+from services import metrics
+
+@pytest.fixture
+def metrics_dir(tmp_path, monkeypatch):
+  monkeypatch.setattr(metrics.settings, "METRICS_DIR", str(tmp_path))
+  monkeypatch.setattr(metrics.settings, "METRICS_ENABLED", True)
+  return tmp_path
+
+def worker_flush(monkeypatch, pid: int, rows: int):
+  ''' A job worker process with this pid, which loaded rows '''
+  registry = metrics.Registry()
+  metrics.Counter("rows_total", "Rows loaded", registry=registry).inc(rows)
+  monkeypatch.setattr(metrics.os, "getpid", lambda: pid)
+  monkeypatch.setattr(metrics, "_process_id", None) # a new process
+  metrics.flush(registry)
+
+def test_a_reused_pid_does_not_overwrite_the_snapshot_of_a_dead_worker(metrics_dir, monkeypatch):
+  worker_flush(monkeypatch, 4242, 100)
+  worker_flush(monkeypatch, 4242, 5) # a later worker, given the pid of the first one
+  monkeypatch.setattr(metrics.os, "getpid", lambda: 1) # the API process
+  merged = metrics.merge(metrics.read_snapshots())
+  assert merged["rows_total"]["samples"] == {(): 105}
+
+def test_a_metric_implements_new_child():
+  class Gauge(metrics.Metric):
+    kind = "gauge"
+  with pytest.raises(TypeError):
+    Gauge("gauge", "A metric without children", registry=metrics.Registry())
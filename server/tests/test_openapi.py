@@ -0,0 +1,12 @@
+import pytest
+
+@pytest.fixture(scope="module")
+def spec():
+  import main
+  return main.app.openapi()
+
+@pytest.mark.parametrize("path", ("/insider_trades", "/insider_trades/{ticker_id}"))
+def test_page_headers_are_documented(spec, path):
+  response = spec["paths"][path]["get"]["responses"]["200"]
+  assert set(response["headers"]) == {"X-Next-Cursor", "X-Cache"}
+  assert response["content"]["application/json"]["schema"]["type"] == "array" # the body stays a list of transactions
@@ -0,0 +1,58 @@
+import os
+import pytest
+from conftest import FIXTURES_DIR
+from services.transaction import COLUMN_HEADERS
+from services.utils import parser
+
+NUM_COLS = len(COLUMN_HEADERS)
+PAGES = ("screener_month.html", "screener_irregular.html")
+
+def read_page(name: str) -> str:
+  with open(os.path.join(FIXTURES_DIR, name), encoding="utf-8") as f:
+    return f.read()
+
+@pytest.mark.parametrize("page", PAGES)
+def test_engines_return_identical_rows(page):
+  html = read_page(page)
+  rows = parser.get_engine("bs4")(html, NUM_COLS)
+  assert rows # a page of results
+  assert parser.get_engine("stream")(html, NUM_COLS) == rows
+
+@pytest.mark.parametrize("page", PAGES)
+@pytest.mark.parametrize("chunk_size", (1, 7, 4096))
+def test_stream_rows_do_not_depend_on_chunk_boundaries(page, chunk_size):
+  html = read_page(page)
+  chunks = (html[i:i + chunk_size] for i in range(0, len(html), chunk_size))
+  assert list(parser.iter_rows_stream(chunks, NUM_COLS)) == parser.get_engine("bs4")(html, NUM_COLS)
+
+@pytest.mark.parametrize("engine", tuple(parser.ENGINES))
+def test_page_without_table_raises(engine):
+  with pytest.raises(parser.TableNotFoundError):
+    parser.get_engine(engine)(read_page("screener_empty.html"), NUM_COLS)
+
+@pytest.mark.parametrize("engine", tuple(parser.ENGINES))
+def test_short_row_raises_value_error(engine):
+  html = read_page("screener_month.html").replace("<td></td><td></td><td></td><td></td></tr>", "</tr>", 1).replace("<td align=right>-$2,020,410</td>", "", 1)
+  with pytest.raises(ValueError, match="Expected 13 columns"):
+    parser.get_engine(engine)(html, NUM_COLS)
+
+@pytest.mark.parametrize("page", PAGES)
+def test_row_stream_fed_chunks_returns_the_page_rows(page):
+  html = read_page(page)
+  stream = parser.RowStream(NUM_COLS)
+  for i in range(0, len(html), 100):
+    stream.feed(html[i:i + 100])
+  assert stream.close() == parser.get_engine("bs4")(html, NUM_COLS)
+
+def test_irregular_rows():
+  rows = parser.get_engine("stream")(read_page("screener_irregular.html"), NUM_COLS)
+  assert len(rows) == 4 # the empty <tr> is skipped
+  assert rows[0][1] == "2024-03-28 21:14:02" # no SEC link: the cell text
+  assert rows[0][6] == ""
+  assert (rows[1][2], rows[1][8], rows[1][11]) == ("", "", "")
+  assert rows[2][3:6] == ["T&E", "Tom & Eve's Corp.", "O'Brien Ann"] # the first link of the cell, entities decoded
+  assert rows[3][4] == "" # a link without text
+
+def test_unknown_engine():
+  with pytest.raises(ValueError):
+    parser.get_engine("lxml")
@@ -0,0 +1,69 @@
+import asyncio
+import pytest
+from test_parser import read_page
+from services import pipeline
+from services import transaction as transact_mgr
+
+MONTHS = [("01/01/2024", "01/31/2024"), ("02/01/2024", "02/29/2024"), ("03/01/2099", "03/31/2099")]
+
+class StubFetcher:
+  ''' Pages by url instead of the network, an exception instead of a page raises it '''
+  concurrency = 2
+
+  def __init__(self, pages: dict):
+    self.pages = pages
+    self.stats = type("Stats", (), {"summary": lambda self: {}})()
+
+  async def fetch(self, url: str) -> str:
+    page = self.pages[url]
+    if isinstance(page, Exception):
+      raise page
+    return page
+
+  async def fetch_stream(self, url: str, consume):
+    page = await self.fetch(url)
+    async def chunks():
+      for i in range(0, len(page), 100):
+        yield page[i:i + 100]
+    return await consume(chunks())
+
+@pytest.fixture(params=(False, True), ids=("parse", "stream"))
+def stream(request):
+  return request.param
+
+def run(pages: dict, stream: bool = False) -> pipeline.PipelineReport:
+  loaded = {}
+  def load(month, rows):
+    loaded[month.start_date] = rows
+    return len(rows)
+  return pipeline.run_pipeline_sync(
+    MONTHS, lambda start, end: start, transact_mgr.parse_page, lambda month, rows: rows, load,
+    fetcher=StubFetcher(pages), parse_workers=1, stream_parser=transact_mgr.PageStream if stream else None,
+  )
+
+def test_page_without_table_is_an_empty_month(stream):
+  assert transact_mgr.parse_page(read_page("screener_empty.html")) == []
+  report = run({
+    "01/01/2024": read_page("screener_month.html"),
+    "02/01/2024": ValueError("HTTP 503"),
+    "03/01/2099": read_page("screener_empty.html"),
+  }, stream)
+  statuses = {month.start_date: month.status for month in report.months}
+  assert statuses == {"01/01/2024": "loaded", "02/01/2024": "failed", "03/01/2099": "empty"}
+  assert [month.start_date for month in report.failed] == ["02/01/2024"] # only the fetch error
+  assert report.rows == 8
+
+def test_malformed_page_fails_its_month(stream):
+  report = run({
+    "01/01/2024": read_page("screener_month.html").replace("<td></td><td></td><td></td><td></td></tr>", "</tr>", 1).replace("<td align=right>-$2,020,410</td>", "", 1),
+    "02/01/2024": read_page("screener_month.html"),
+    "03/01/2099": read_page("screener_empty.html"),
+  }, stream)
+  assert [month.status for month in report.months] == ["failed", "loaded", "empty"]
+  assert report.months[0].error.startswith("parse: ValueError")
+
+def test_sync_entry_point_refuses_a_running_loop():
+  async def main():
+    with pytest.raises(RuntimeError, match="await run_pipeline"):
+      pipeline.run_pipeline_sync([], None, None, None, None)
+  asyncio.run(main())
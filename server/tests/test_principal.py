@@ -0,0 +1,27 @@
+import asyncio, time
+import pytest
+from schemas import auth as schema
+from services import principal, token_state
+
+TOKEN = "access-token"
+CLIENT = schema.Client(client_id="client-1", is_active=True, role="client")
+
+@pytest.fixture
+def backend(monkeypatch):
+  backend = token_state.MemoryTokenState(100)
+  monkeypatch.setattr(token_state, "backend", backend)
+  monkeypatch.setattr(principal.settings, "AUTH_CACHE_ENABLED", True)
+  principal.lru.clear()
+  yield backend
+  principal.lru.clear()
+
+def test_a_verified_token_is_cached(backend):
+  assert asyncio.run(principal.put_async(TOKEN, CLIENT, ["client"], time.time() + 60))
+  assert asyncio.run(principal.get_async(TOKEN)) == (CLIENT, ["client"])
+
+def test_a_revocation_between_the_check_and_the_put_is_not_cached_over(backend):
+  assert not asyncio.run(backend.is_revoked(TOKEN)) # the request's check
+  asyncio.run(backend.revoke(TOKEN, time.time() + 60)) # a logout, whose entry drop finds nothing cached yet
+  asyncio.run(principal.revoke_async(TOKEN))
+  assert not asyncio.run(principal.put_async(TOKEN, CLIENT, ["client"], time.time() + 60))
+  assert asyncio.run(principal.get_async(TOKEN)) is None
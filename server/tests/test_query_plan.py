@@ -0,0 +1,58 @@
+import os
+from datetime import date
+from types import SimpleNamespace
+import pytest
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.orm import Session
+from conftest import TEST_DIR
+from schemas.transaction import TransactionType
+from services import transaction as transact_mgr
+
+'''
+Query plan regression check for retrieve_transactions: every branch of transactions_query, with and without a page
+cursor, must search the index made for it (see its docstring) and never sort in a temp B-tree.
+The plans are checked on a seeded database, QUERY_PLAN_ROWS synthetic rows (the plans of a multi-million rows table:
+QUERY_PLAN_ROWS=2000000), in QUERY_PLAN_DB when set (reused when it already has rows, e.g. for several runs).
+'''
+
+ROWS = int(os.environ.get("QUERY_PLAN_ROWS", 200000))
+FROM_DATE, TO_DATE = date(2019, 1, 1), date(2019, 3, 31)
+CURSOR = transact_mgr.encode_cursor(SimpleNamespace(trade_date=date(2019, 2, 15), id=8))
+
+# branch: (ticker, trade_type, the index of transaction_facts it must search)
+BRANCHES = {
+  "ticker": ("T0042", None, "ix_transaction_facts_ticker_trade_date"),
+  "ticker+trade_type": ("T0042", TransactionType.P, "ix_transaction_facts_ticker_trade_date"),
+  "date_range": ("", None, "ix_transaction_facts_trade_date"),
+  "date_range+trade_type": ("", TransactionType.S, "ix_transaction_facts_trade_type_trade_date"),
+}
+
+@pytest.fixture(scope="session")
+def plan_db():
+  from bench import common
+  import migrations
+  path = os.environ.get("QUERY_PLAN_DB") or os.path.join(TEST_DIR, "plan.db")
+  engine = create_engine(f"sqlite:///{path}")
+  with engine.connect() as conn:
+    seeded = inspect(conn).has_table("transactions") and conn.execute(text("SELECT 1 FROM transactions LIMIT 1")).first()
+  if seeded:
+    migrations.upgrade(engine)
+  else:
+    common.seed_transactions(engine, ROWS)
+  yield engine
+  engine.dispose()
+
+def explain(db: Session, query) -> list[str]:
+  compiled = query.compile(dialect=db.get_bind().dialect)
+  params = tuple(compiled.params[name] for name in compiled.positiontup)
+  return [row[-1] for row in db.connection().exec_driver_sql(f"EXPLAIN QUERY PLAN {compiled}", params)]
+
+@pytest.mark.parametrize("cursor", (None, CURSOR), ids=("first_page", "cursor"))
+@pytest.mark.parametrize("branch", tuple(BRANCHES))
+def test_plan_searches_its_index_without_sorting(plan_db, branch, cursor):
+  ticker, trade_type, index = BRANCHES[branch]
+  query = transact_mgr.transactions_query(ticker, FROM_DATE, TO_DATE, trade_type, cursor).limit(101)
+  with Session(plan_db) as db:
+    plan = explain(db, query)
+  assert any(step.startswith("SEARCH") and f"INDEX {index} " in step for step in plan), plan
+  assert not any("TEMP B-TREE" in step for step in plan), plan
@@ -0,0 +1,9 @@
+import pytest
+from services import token_state
+
+def test_a_backend_implements_the_whole_interface():
+  class PartialState(token_state.TokenStateBackend):
+    async def is_revoked(self, token: str) -> bool:
+      return False
+  with pytest.raises(TypeError):
+    PartialState()